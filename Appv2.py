@@ -2,10 +2,13 @@
 #IMPORTAR BIBLIOTECAS
 #==================================================================================================================================
 import streamlit as st # Importa la biblioteca Streamlit para crear aplicaciones web interactivas.
-import pandas as pd # Importa la biblioteca Pandas para manipulación y análisis de datos.
 import base64 # Importa la biblioteca Base64 para codificar y decodificar datos.
-import fpdf # Importa la biblioteca FPDF, aunque luego se importa directamente desde ella.
-from fpdf import FPDF # Importa la clase FPDF desde la biblioteca FPDF para crear archivos PDF.
+import arranque # Importa el precalentamiento en segundo plano (pandas no se usa en esta página y ya no se importa).
+import cpic # Importa el acceso a CPIC (copia local en SQLite o API en línea).
+from informes import PlantillaPDF # Importa la plantilla de informe con logos precargados y cabecera/pie reutilizables.
+from cliente_http import cliente # Importa el cliente HTTP compartido (pool de conexiones, reintentos y límite de tasa).
+import metricas # Importa la instrumentación (tiempos por función, latencia HTTP y cachés).
+from metricas import instrumentar # Importa el decorador que mide cada función de consulta.
 
 #==================================================================================================================================
 #CONFIGURACIÓN DE LA PÁGINA
@@ -13,6 +16,8 @@ from fpdf import FPDF # Importa la clase FPDF desde la biblioteca FPDF para crea
 
 st.set_page_config(layout="wide", page_icon='Logo_pagina.png', page_title="PharmPrev") # Configura la página de Streamlit con un diseño ancho, un icono y un título.
 
+cpic.catalogo_alelos() # Arranca (una vez por proceso) la precarga en segundo plano de los alelos del panel de genes.
+
 st.image("Logo.png") # Muestra una imagen en la aplicación Streamlit.
 
 left, right = st.columns([1,1], gap="large") # Divide la página en dos columnas de igual tamaño con un espacio grande entre ellas.
@@ -55,6 +60,7 @@ with right: # Define el contenido de la columna derecha.
 #DEFINICIÓN DE FUNCIONES
 #_________________________________________________________________________________________________________________________________
 
+@instrumentar("Appv2.buscarAlelosGen") # Mide llamadas, tiempo y elementos devueltos.
 def buscarAlelosGen(gen):
     """
     Busca los alelos de un gen específico utilizando la API CPIC.
@@ -65,21 +71,9 @@ def buscarAlelosGen(gen):
     Returns:
         list: Una lista ordenada de alelos únicos para el gen especificado.
     """
-    import json # Importa la biblioteca JSON para trabajar con datos JSON.
-    import requests # Importa la biblioteca Requests para realizar solicitudes HTTP.
-    listaAlelos=[] # Inicializa una lista vacía para almacenar los alelos.
-    url="https://api.cpicpgx.org/v1/allele?genesymbol=eq."+gen # Define la URL de la API CPIC para buscar alelos por símbolo de gen.
-    response = requests.get(url) # Realiza una solicitud GET a la API.
-    json_obtenido = response.json() # Convierte la respuesta JSON en un objeto Python.
-    datos=json_obtenido # Asigna los datos JSON a la variable 'datos'.
-    for i in range(len(datos)): # Itera sobre los datos para extraer los alelos.
-        alelo=datos[i]["name"] # Obtiene el nombre del alelo.
-        listaAlelos.append(alelo) # Agrega el alelo a la lista.
-    setAlelos=set(listaAlelos) # Convierte la lista de alelos en un conjunto para eliminar duplicados.
-    ListaFiltradaAlelos=(list(setAlelos)) # Convierte el conjunto de alelos en una lista.
-    ListaFiltradaAlelos.sort() # Ordena la lista de alelos.
-    return ListaFiltradaAlelos # Devuelve la lista filtrada y ordenada de alelos.
+    return cpic.catalogo_alelos().alelos(gen) # Lista del catálogo compartido (precargado y refrescado en segundo plano).
 
+@instrumentar("Appv2.ID_CPIC_Farmaco", filas=None) # Mide llamadas y tiempo.
 def ID_CPIC_Farmaco(nombreFarmaco):
     """
     Obtiene el ID de un fármaco en la base de datos CPIC.
@@ -90,18 +84,14 @@ def ID_CPIC_Farmaco(nombreFarmaco):
     Returns:
         str: El ID del fármaco en CPIC, o una cadena vacía si no se encuentra.
     """
-    import json # Importa la biblioteca JSON para trabajar con datos JSON.
-    import requests # Importa la biblioteca Requests para realizar solicitudes HTTP.
-    url="https://api.cpicpgx.org/v1/drug?name=eq."+nombreFarmaco # Define la URL de la API CPIC para buscar fármacos por nombre.
-    response = requests.get(url) # Realiza una solicitud GET a la API.
-    json_obtenido = response.json() # Convierte la respuesta JSON en un objeto Python.
-    datos=json_obtenido # Asigna los datos JSON a la variable 'datos'.
+    datos = cpic.resolver().farmacos(nombreFarmaco) # Consulta el fármaco por nombre en CPIC.
     if len(datos) != 0: # Verifica si se encontraron datos.
         ID_Farmaco=datos[0]['drugid'] # Obtiene el ID del fármaco del primer resultado.
         return ID_Farmaco # Devuelve el ID del fármaco.
     else:
         return '' # Devuelve una cadena vacía si no se encuentra el fármaco.
 
+@instrumentar("Appv2.fenotipoSegunAlelos") # Mide llamadas, tiempo y elementos devueltos.
 def fenotipoSegunAlelos(gen,alelo1,alelo2):
     """
     Determina el fenotipo basado en los alelos de un gen.
@@ -114,16 +104,10 @@ def fenotipoSegunAlelos(gen,alelo1,alelo2):
     Returns:
         dict: Un diccionario con la información del fenotipo.
     """
-    import json # Importa la biblioteca JSON para trabajar con datos JSON.
-    import requests # Importa la biblioteca Requests para realizar solicitudes HTTP.
-    listaAlelos=[] # Inicializa una lista vacía (no utilizada en la función).
-    #url="https://api.cpicpgx.org/v1/diplotype?genesymbol=eq.CYP2C19&diplotype=eq.*17/*17" # URL de ejemplo comentada.
-    url="https://api.cpicpgx.org/v1/diplotype?genesymbol=eq."+gen+"&diplotype=eq."+alelo1+"/"+alelo2 # Define la URL de la API CPIC para buscar el diplotipo.
-    response= requests.get(url) # Realiza una solicitud GET a la API.
-    json_obtenido = response.json() # Convierte la respuesta JSON en un objeto Python.
-    datos=json_obtenido # Asigna los datos JSON a la variable 'datos'.
+    datos = cpic.resolver().diplotipos(gen, alelo1+"/"+alelo2) # Consulta el diplotipo en CPIC.
     return datos # Devuelve los datos JSON obtenidos.
 
+@instrumentar("Appv2.urlGuia", filas=None) # Mide llamadas y tiempo.
 def urlGuia(farmaco,ID):
     """
     Obtiene la URL de la guía de un fármaco específico.
@@ -135,16 +119,12 @@ def urlGuia(farmaco,ID):
     Returns:
         str: La URL de la guía del fármaco.
     """
-    import json # Importa la biblioteca JSON para trabajar con datos JSON.
-    import requests # Importa la biblioteca Requests para realizar solicitudes HTTP.
-    url = 'https://api.cpicpgx.org/v1/drug?name=eq.'+farmaco+'&select=drugid,name,guideline_for_drug(*)' # Define la URL de la API CPIC para buscar información del fármaco y sus guías.
-    response = requests.get(url) # Realiza una solicitud GET a la API.
-    json_obtenido = response.json() # Convierte la respuesta JSON en un objeto Python.
-    datos = json_obtenido # Asigna los datos JSON a la variable 'datos'.
+    datos = cpic.resolver().farmacos_con_guia(farmaco) # Consulta el fármaco y sus guías en CPIC.
     for i in datos: # Itera sobre los datos para encontrar la guía con el ID especificado.
         if i['guideline_for_drug']['id'] == ID: # Verifica si el ID de la guía coincide con el ID buscado.
             return i['guideline_for_drug']['url'] # Devuelve la URL de la guía.
 
+@instrumentar("Appv2.recomendacionClinica", filas=None) # Mide llamadas y tiempo.
 def recomendacionClinica(gen,alelo1,alelo2,farmaco):
     """
     Obtiene la recomendación clínica basada en el gen, los alelos y el fármaco.
@@ -163,12 +143,7 @@ def recomendacionClinica(gen,alelo1,alelo2,farmaco):
     if len(fenotipo) != 0: # Verifica si se encontró un fenotipo.
         lookupkey= fenotipo[0]['lookupkey'] # Obtiene la clave de búsqueda del fenotipo.
         ID_Farmaco=ID_CPIC_Farmaco(farmaco) # Obtiene el ID del fármaco.
-        import json # Importa la biblioteca JSON para trabajar con datos JSON.
-        import requests # Importa la biblioteca Requests para realizar solicitudes HTTP.
-        url='https://api.cpicpgx.org/v1/recommendation?select=drug(name), guideline(name), * &drugid=eq.'+ID_Farmaco+'&lookupkey=cs.{\"'+list(lookupkey.keys())[0]+'":"'+list(lookupkey.values())[0]+'"}' # Define la URL de la API CPIC para buscar recomendaciones basadas en el ID del fármaco y la clave de búsqueda.
-        response = requests.get(url) # Realiza una solicitud GET a la API.
-        json_obtenido = response.json() # Convierte la respuesta JSON en un objeto Python.
-        datos=json_obtenido # Asigna los datos JSON a la variable 'datos'.
+        datos = cpic.resolver().recomendaciones(ID_Farmaco, list(lookupkey.keys())[0], list(lookupkey.values())[0]) # Consulta las recomendaciones para el fármaco y la clave de búsqueda.
         if len(datos) != 0: # Verifica si se encontraron recomendaciones.
             lista.append(fenotipo[0]['generesult']) # Agrega el resultado del gen a la lista.
             lista.append(datos[0]['drugrecommendation'].encode('latin-1','ignore').decode('latin-1')) # Agrega la recomendación del fármaco a la lista, decodificando caracteres especiales.
@@ -176,6 +151,7 @@ def recomendacionClinica(gen,alelo1,alelo2,farmaco):
             lista.append(urlGuia(farmaco,datos[0]['guidelineid'])) # Agrega la URL de la guía a la lista.
     return lista # Devuelve la lista con los resultados.
 
+@instrumentar("Appv2.BuscarFarmacosRelacionadosGen") # Mide llamadas, tiempo y elementos devueltos.
 def BuscarFarmacosRelacionadosGen(gen):
     """
     Busca fármacos relacionados con un gen específico utilizando la API PharmGKB.
@@ -186,13 +162,9 @@ def BuscarFarmacosRelacionadosGen(gen):
     Returns:
         list: Una lista ordenada de fármacos únicos relacionados con el gen especificado.
     """
-    import json # Importa la biblioteca JSON para trabajar con datos JSON.
-    import requests # Importa la biblioteca Requests para realizar solicitudes HTTP.
     listaFarmacos=[] # Inicializa una lista vacía para almacenar los fármacos.
     url="https://api.pharmgkb.org/v1/data/clinicalAnnotation?location.genes.symbol="+gen # Define la URL de la API PharmGKB para buscar anotaciones clínicas por símbolo de gen.
-    response = requests.get(url) # Realiza una solicitud GET a la API.
-    json_obtenido = response.json() # Convierte la respuesta JSON en un objeto Python.
-    datos=json_obtenido # Asigna los datos JSON a la variable 'datos'.
+    datos = cliente().get_json(url, aceptar_error=True) # Realiza la solicitud GET con el cliente compartido; "sin resultados" llega como error HTTP con su 'status'.
     if datos['status'] == 'success': # Verifica si la solicitud a la API fue exitosa.
         for i in range(len(datos["data"])): # Itera sobre los datos para extraer los fármacos relacionados.
             farmaco=datos["data"][i]["relatedChemicals"][0]["name"] # Obtiene el nombre del fármaco relacionado.
@@ -254,17 +226,10 @@ alelos2 = [alelo1_2,alelo2_2,alelo3_2,alelo4_2,alelo5_2,alelo6_2] # Crea una lis
 #OBTENCIÓN DE RESULTADOS
 #==================================================================================================================================
 
-recomendaciones = dict() # Inicializa un diccionario para almacenar las recomendaciones.
-for i in farmacos: # Itera sobre la lista de fármacos.
-    recomendaciones[i] = dict() # Inicializa un diccionario para cada fármaco.
-    for x, y, z in zip(genes, alelos1, alelos2): # Itera sobre los genes y sus alelos.
-        if y != '-' and z != '-': # Verifica si se seleccionaron ambos alelos.
-            recomendaciones[i][x] = recomendacionClinica(x,y,z,i) # Obtiene la recomendación clínica para el fármaco y el gen, y la almacena en el diccionario.
-            
-relaciones = dict() # Inicializa un diccionario para almacenar las relaciones entre genes y fármacos.
-for x,y,z in zip(genes, alelos1, alelos2): # Itera sobre los genes y sus alelos.
-    if y != '-' and z != '-': # Verifica si se seleccionaron ambos alelos.
-        relaciones[x] = BuscarFarmacosRelacionadosGen(x) # Busca los fármacos relacionados con el gen y los almacena en el diccionario.
+seleccionados = [(x, y, z) for x, y, z in zip(genes, alelos1, alelos2) if y != '-' and z != '-'] # Genes con ambos alelos seleccionados.
+recomendaciones = cpic.recomendaciones_panel(farmacos, seleccionados) # Resuelve la matriz fármaco x gen completa con tres consultas a CPIC (diplotipos, fármacos y recomendaciones).
+
+relaciones = dict(zip([x for x, y, z in seleccionados], cliente().mapear(BuscarFarmacosRelacionadosGen, [x for x, y, z in seleccionados]))) # Busca en paralelo los fármacos relacionados con cada gen.
 #====================================================================================================================================
 #EXPORTAR COMO PDF
 #====================================================================================================================================
@@ -281,12 +246,13 @@ def create_download_link(val, filename):
     b64 = base64.b64encode(val)  # val looks like b'...'
     return f'<a href="data:application/octet-stream;base64,{b64.decode()}" download="{filename}.pdf">Download file</a>'
 
-class PDF(FPDF):
+class PDF(PlantillaPDF):
     """
     Clase para generar el PDF del informe.
-    Hereda de la clase FPDF.
+    Hereda de PlantillaPDF: los logos se decodifican una vez por proceso y la
+    cabecera y el pie se dibujan una vez y se reutilizan en cada página.
     """
-    def header(self):
+    def cabecera(self):
         """
         Encabezado del PDF.
         Incluye los logos y el título del informe.
@@ -309,7 +275,7 @@ class PDF(FPDF):
         self.ln(10)
 
     # Page footer
-    def footer(self):
+    def pie(self):
         """
         Pie de página del PDF.
         Incluye el número de página.
@@ -406,4 +372,8 @@ st.write(texto,unsafe_allow_html = True) # Muestra el texto HTML en la aplicaci
 
 for i in relaciones: # Itera sobre las relaciones entre genes y fármacos.
     texto = '<p style="text-indent: 30px; font-family:Cambria; font-size: 15px;">Fármacos metabolizados por <b>'+i+'</b>: '+str(', '.join(relaciones[i]))+'.'+'</p>' # Define un texto HTML con la información de las interacciones.
-    st.write(texto,unsafe_allow_html = True) # Muestra el texto HTML en la aplicación Streamlit.
\ No newline at end of file
+    st.write(texto,unsafe_allow_html = True) # Muestra el texto HTML en la aplicación Streamlit.
+
+with st.sidebar: # Al final de la página, cuando ya se han hecho todas las consultas.
+    metricas.panel_streamlit() # Muestra el panel de rendimiento en la barra lateral.
+arranque.precalentar(pasos=(), imagenes=("Logo.png", "HUBU.png")) # Con la página ya enviada, decodifica en segundo plano los logos del PDF.
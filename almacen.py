@@ -0,0 +1,301 @@
+"""
+Almacén persistente de resultados en SQLite.
+
+Guarda cada carga de la matriz como un *lote* con sus muestras, los genotipos,
+fenotipos y recomendaciones de cada gen, los datos demográficos de los
+pacientes y los informes PDF generados, de forma que la aplicación puede
+reabrir un lote anterior sin volver a analizar el CSV ni consultar CPIC.
+
+Tablas (indexadas por muestra, lote y gen):
+
+- ``lote``: una fila por archivo cargado (nombre, huella SHA-256, fecha) y si
+  alguna de sus recomendaciones es provisional (CPIC no respondió a tiempo).
+- ``muestra``: pacientes de cada lote, en orden, con la huella de sus llamadas.
+- ``resultado``: genotipo, score, fenotipo y recomendaciones por lote, paciente y gen.
+- ``paciente``: datos del formulario de cada paciente (no dependen del lote).
+- ``informe``: último PDF generado para cada paciente de un lote.
+
+La ruta se configura con la variable de entorno ALMACEN_DB (por defecto
+resultados.sqlite junto a la aplicación).
+
+numpy, pandas y ``cohorte`` se importan solo en las funciones que los usan:
+listar lotes y leer o guardar datos de pacientes (lo que necesita la primera
+página de la aplicación) no los carga.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+
+RUTA_ALMACEN = os.environ.get("ALMACEN_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados.sqlite"))
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS lote (id INTEGER PRIMARY KEY, nombre TEXT, huella TEXT UNIQUE, cabecera TEXT,
+                                 creado TEXT, pacientes INTEGER, provisional INTEGER DEFAULT 0);
+
+CREATE TABLE IF NOT EXISTS muestra (lote INTEGER, orden INTEGER, paciente TEXT, h1 INTEGER, h2 INTEGER,
+                                    PRIMARY KEY (lote, orden));
+CREATE INDEX IF NOT EXISTS muestra_paciente ON muestra (paciente);
+
+CREATE TABLE IF NOT EXISTS resultado (lote INTEGER, paciente TEXT, gen TEXT, genotipo TEXT, score, fenotipo TEXT,
+                                      recomendaciones TEXT, PRIMARY KEY (lote, paciente, gen));
+CREATE INDEX IF NOT EXISTS resultado_paciente ON resultado (paciente);
+CREATE INDEX IF NOT EXISTS resultado_gen ON resultado (gen, fenotipo);
+
+CREATE TABLE IF NOT EXISTS paciente (paciente TEXT PRIMARY KEY, datos TEXT, actualizado TEXT);
+
+CREATE TABLE IF NOT EXISTS informe (lote INTEGER, paciente TEXT, nombre TEXT, pdf BLOB, creado TEXT,
+                                    PRIMARY KEY (lote, paciente));
+"""
+
+
+class AlmacenResultados:
+    """
+    Lectura y escritura de lotes, pacientes e informes en la base SQLite.
+    """
+    def __init__(self, ruta=RUTA_ALMACEN):
+        self.ruta = ruta
+        self._local = threading.local()  # una conexión por hilo (Streamlit usa varios)
+
+    def conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta)
+            conexion.executescript(ESQUEMA)
+            _migrar(conexion)
+            self._local.conexion = conexion
+        return conexion
+
+    def guardar_lote(self, nombre, cohorte, huellas=None):
+        """
+        Guarda (o reemplaza, si ya existe un lote con la misma huella) los resultados de una carga.
+
+        Args:
+            nombre (str): Nombre del archivo cargado.
+            cohorte (Cohorte): Resultados de todos los pacientes.
+            huellas (dict): Huellas de ``flujo.analizar_incremental`` (archivo, cabecera, filas y provisional).
+
+        Returns:
+            int: Identificador del lote.
+        """
+        huellas = huellas or {}
+        provisional = int(bool(huellas.get("provisional")))
+        conexion = self.conexion()
+        with conexion:
+            fila = conexion.execute("SELECT id FROM lote WHERE huella = ?", (huellas.get("archivo"),)).fetchone()
+            if fila:
+                lote = fila[0]
+                for tabla in ("muestra", "resultado", "informe"):
+                    conexion.execute(f"DELETE FROM {tabla} WHERE lote = ?", (lote,))
+                conexion.execute("UPDATE lote SET nombre = ?, cabecera = ?, creado = ?, pacientes = ?, provisional = ? "
+                                 "WHERE id = ?", (nombre, huellas.get("cabecera"), _ahora(), len(cohorte), provisional, lote))
+            else:
+                lote = conexion.execute("INSERT INTO lote (nombre, huella, cabecera, creado, pacientes, provisional) "
+                                        "VALUES (?, ?, ?, ?, ?, ?)", (nombre, huellas.get("archivo"), huellas.get("cabecera"),
+                                                                      _ahora(), len(cohorte), provisional)).lastrowid
+            pacientes = [str(p) for p in cohorte.pacientes]
+            h1, h2 = _huellas_enteras(huellas.get("filas"), cohorte.pacientes)
+            conexion.executemany("INSERT INTO muestra VALUES (?, ?, ?, ?, ?)",
+                                 zip([lote] * len(pacientes), range(len(pacientes)), pacientes, h1, h2))
+            conexion.executemany("INSERT OR REPLACE INTO resultado VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 _filas_resultado(lote, pacientes, cohorte))
+        return lote
+
+    def lotes(self):
+        """
+        Returns:
+            list: Un diccionario por lote (id, nombre, huella, creado, pacientes, provisional), del más
+            reciente al más antiguo.
+        """
+        filas = self.conexion().execute("SELECT id, nombre, huella, creado, pacientes, provisional FROM lote ORDER BY id DESC")
+        return [dict(zip(("id", "nombre", "huella", "creado", "pacientes", "provisional"), fila)) for fila in filas]
+
+    def lote_por_huella(self, huella):
+        """
+        Devuelve el id del lote guardado para un archivo con esa huella, o None.
+        """
+        fila = self.conexion().execute("SELECT id FROM lote WHERE huella = ?", (huella,)).fetchone()
+        return fila[0] if fila else None
+
+    def cargar_lote(self, lote):
+        """
+        Reconstruye los resultados de un lote guardado.
+
+        Returns:
+            tuple: (Cohorte, huellas) listos para ``st.session_state.resultado`` y
+            ``st.session_state.huellas`` (de modo que la carga incremental continúa).
+        """
+        import numpy as np
+        import pandas as pd
+
+        from cohorte import AUSENTE, Cohorte, Internado
+
+        conexion = self.conexion()
+        huella, cabecera, provisional = conexion.execute("SELECT huella, cabecera, provisional FROM lote WHERE id = ?",
+                                                         (lote,)).fetchone()
+        muestras = conexion.execute("SELECT paciente, h1, h2 FROM muestra WHERE lote = ? ORDER BY orden", (lote,)).fetchall()
+        pacientes = pd.Index([m[0] for m in muestras], dtype=object)
+        alelos, valores = Internado(), Internado()
+        codigos_alelos, codigos_resultado = {}, {}
+        # Cada genotipo y cada resultado distinto se decodifica una sola vez
+        pares, distintos = {}, {}
+        filas = conexion.execute("SELECT r.gen, m.orden, r.genotipo, r.score, r.fenotipo, r.recomendaciones FROM resultado r "
+                                 "JOIN muestra m ON m.lote = r.lote AND m.paciente = r.paciente WHERE r.lote = ?", (lote,))
+        for gen, posicion, genotipo, score, fenotipo, recomendaciones in filas:
+            if gen not in codigos_alelos:
+                codigos_alelos[gen] = np.full((len(pacientes), 2), AUSENTE, dtype=np.int16)
+                codigos_resultado[gen] = np.full(len(pacientes), AUSENTE, dtype=np.int16)
+            par = pares.get(genotipo)
+            if par is None:
+                materno, _, paterno = genotipo.partition("/")
+                par = pares[genotipo] = (alelos.codigo(materno), alelos.codigo(paterno))
+            codigos_alelos[gen][posicion] = par
+            clave = (score, fenotipo, recomendaciones)
+            codigo = distintos.get(clave)
+            if codigo is None:
+                codigo = distintos[clave] = valores.codigo(_resultado(*clave))
+            codigos_resultado[gen][posicion] = codigo
+        cohorte = Cohorte(pacientes, alelos, valores, codigos_alelos, codigos_resultado)
+        con_huella = [(p, h1, h2) for p, h1, h2 in muestras if h1 is not None]
+        filas = pd.DataFrame({"h1": np.array([h[1] for h in con_huella], dtype=np.int64).view(np.uint64),
+                              "h2": np.array([h[2] for h in con_huella], dtype=np.int64).view(np.uint64)},
+                             index=pd.Index([h[0] for h in con_huella], dtype=object, name="Sample/Assay"))
+        return cohorte, {"archivo": huella, "cabecera": cabecera, "filas": filas, "provisional": bool(provisional)}
+
+    def guardar_paciente(self, paciente, datos):
+        """
+        Guarda los datos del formulario de un paciente (nombre, edad, médico...).
+        """
+        conexion = self.conexion()
+        with conexion:
+            conexion.execute("INSERT OR REPLACE INTO paciente VALUES (?, ?, ?)",
+                             (str(paciente), json.dumps(datos, ensure_ascii=False), _ahora()))
+
+    def datos_pacientes(self, pacientes=None):
+        """
+        Devuelve los datos guardados de los pacientes indicados (o de todos).
+
+        Returns:
+            dict: {paciente: datos del formulario}.
+        """
+        sql, parametros = "SELECT paciente, datos FROM paciente", ()
+        if pacientes is not None:
+            pacientes = [str(p) for p in pacientes]
+            if not pacientes:
+                return {}
+            sql += " WHERE paciente IN (SELECT value FROM json_each(?))"
+            parametros = (json.dumps(pacientes),)
+        return {paciente: json.loads(datos) for paciente, datos in self.conexion().execute(sql, parametros)}
+
+    def guardar_informes(self, lote, informes):
+        """
+        Guarda los PDF generados para un lote.
+
+        Args:
+            lote (int): Identificador del lote.
+            informes (dict): {paciente: (nombre del archivo, bytes del PDF, error)}.
+        """
+        conexion = self.conexion()
+        with conexion:
+            conexion.executemany("INSERT OR REPLACE INTO informe VALUES (?, ?, ?, ?, ?)",
+                                 [(lote, str(paciente), nombre, datos, _ahora())
+                                  for paciente, (nombre, datos, _) in informes.items() if datos is not None])
+
+    def informes(self, lote):
+        """
+        Returns:
+            dict: {paciente: (nombre del archivo, bytes del PDF, None)} con los informes guardados del lote.
+        """
+        filas = self.conexion().execute("SELECT paciente, nombre, pdf FROM informe WHERE lote = ?", (lote,))
+        return {paciente: (nombre, bytes(pdf), None) for paciente, nombre, pdf in filas}
+
+    def buscar(self, paciente=None, gen=None, fenotipo=None, lote=None, limite=1000):
+        """
+        Consulta los resultados de todos los lotes guardados.
+
+        Args:
+            paciente (str): Código de la muestra.
+            gen (str): Símbolo del gen.
+            fenotipo (str): Fenotipo exacto (p. ej. 'Poor Metabolizer').
+            lote (int): Restringe la búsqueda a un lote.
+            limite (int): Número máximo de filas.
+
+        Returns:
+            pandas.DataFrame: Una fila por lote, paciente y gen, de los lotes más recientes a los más antiguos.
+        """
+        import pandas as pd
+
+        condiciones, parametros = [], []
+        for columna, valor in (("r.paciente", paciente), ("r.gen", gen), ("r.fenotipo", fenotipo), ("r.lote", lote)):
+            if valor is not None:
+                condiciones.append(f"{columna} = ?")
+                parametros.append(valor)
+        sql = ("SELECT r.lote, l.nombre AS archivo, l.creado, r.paciente, r.gen, r.genotipo, r.score, r.fenotipo, "
+               "r.recomendaciones FROM resultado r JOIN lote l ON l.id = r.lote")
+        if condiciones:
+            sql += " WHERE " + " AND ".join(condiciones)
+        sql += " ORDER BY r.lote DESC, r.paciente, r.gen LIMIT ?"
+        return pd.read_sql_query(sql, self.conexion(), params=parametros + [limite])
+
+
+def _ahora():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _migrar(conexion):
+    # Columnas añadidas después de crear la base
+    columnas = {fila[1] for fila in conexion.execute("PRAGMA table_info(lote)")}
+    if "provisional" not in columnas:
+        with conexion:
+            conexion.execute("ALTER TABLE lote ADD COLUMN provisional INTEGER DEFAULT 0")
+
+
+def _huellas_enteras(filas, pacientes):
+    # SQLite guarda enteros con signo: los uint64 de las huellas se reinterpretan como int64
+    import numpy as np
+
+    if filas is None or not len(filas):
+        return [None] * len(pacientes), [None] * len(pacientes)
+    posiciones = filas.index.get_indexer(pacientes)
+    columnas = []
+    for columna in ("h1", "h2"):
+        valores = filas[columna].to_numpy(dtype=np.uint64).view(np.int64)[posiciones].tolist()
+        columnas.append([v if p >= 0 else None for v, p in zip(valores, posiciones.tolist())])
+    return columnas
+
+
+def _resultado(score, fenotipo, recomendaciones):
+    # Inversa de _filas_resultado: reconstruye la tupla (score, fenotipo, recomendaciones...)
+    if fenotipo is None and score is None:
+        return tuple(json.loads(recomendaciones or "[]"))
+    return (score, fenotipo) + tuple(json.loads(recomendaciones or "[]"))
+
+
+def _filas_resultado(lote, pacientes, cohorte):
+    # Filas (lote, paciente, gen, genotipo, score, fenotipo, recomendaciones) sin pasar por diccionarios
+    from cohorte import AUSENTE
+
+    alelos = cohorte.alelos.valores
+    valores = [(r[0] if len(r) > 0 else None, r[1] if len(r) > 1 else None, json.dumps(list(r[2:]), ensure_ascii=False))
+               for r in cohorte.resultados.valores] + [(None, None, "[]")]  # el código AUSENTE (-1) toma el último
+    for gen in cohorte.genes:
+        codigos = cohorte.codigos_alelos[gen].tolist()
+        resultados = cohorte.codigos_resultado[gen].tolist()
+        for paciente, (materno, paterno), codigo in zip(pacientes, codigos, resultados):
+            if materno != AUSENTE:
+                yield (lote, paciente, gen, f"{alelos[materno]}/{alelos[paterno]}") + valores[codigo]
+
+
+_almacen = None
+
+
+def almacen():
+    """
+    Devuelve el almacén del proceso (se crea la primera vez sobre RUTA_ALMACEN).
+    """
+    global _almacen
+    if _almacen is None:
+        _almacen = AlmacenResultados()
+    return _almacen
@@ -1,24 +1,26 @@
-import pandas as pd
 import streamlit as st
-from fpdf import FPDF
 
 from datetime import datetime
 import io
 import os
 import base64
-import openpyxl
 
+import arranque
+import cpic
+import metricas
+from almacen import almacen
+import trabajos
+
+# flujo y buscador (pandas, numpy) e informes (fpdf) se importan en las páginas que los usan;
+# arranque.precalentar los carga en segundo plano después de pintar la primera página
+
+# Segundos que el script espera a que se detenga un análisis cancelado; si tarda más,
+# panel_trabajo lo recoge cuando termine
+ESPERA_CANCELACION = 2.0
 
-# Configuración de la página
-st.set_page_config(
-    page_title="Sistema de Análisis de Alelos",
-    page_icon="🧬",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
 
 # CSS personalizado para diseño atractivo
-st.markdown("""
+ESTILOS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -74,287 +76,153 @@ st.markdown("""
         margin: 10px 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 
-def create_pdf(paciente_data, datos_geneticos, paciente_codigo):
-    pdf = FPDF()
-    pdf.add_page()
-    
-    # Header
-    pdf.set_font('Arial', 'B', 16)
-    pdf.cell(0, 10, 'INFORME DE FARMACOGENÉTICA', 0, 1, 'C')
-    pdf.set_font('Arial', 'I', 10)
-    pdf.cell(0, 10, f'Fecha: {datetime.now().strftime("%d/%m/%Y")}', 0, 1, 'C')
-    pdf.ln(10)
-    
-    # Datos del paciente
-    pdf.set_font('Arial', 'B', 14)
-    pdf.cell(0, 10, 'DATOS DEL PACIENTE', 0, 1)
-    pdf.ln(5)
-    
-    pdf.set_font('Arial', '', 12)
-    info_lines = [
-        f"Nombre: {paciente_data.get('nombre', 'No especificado')}",
-        f"Edad: {paciente_data.get('edad', 'No especificado')}",
-        f"Sexo: {paciente_data.get('sexo', 'No especificado')}",
-        f"ID Paciente: {paciente_data.get('id_paciente', paciente_codigo)}",
-        f"Médico: {paciente_data.get('medico', 'No especificado')}",
-        f"Fecha de Nacimiento: {paciente_data.get('fecha_nacimiento', 'No especificada')}"
-    ]
-    
-    for line in info_lines:
-        pdf.cell(0, 8, line, 0, 1)
-    
-    pdf.ln(10)
-    
-    # Resultados genéticos
-    pdf.set_font('Arial', 'B', 14)
-    pdf.cell(0, 10, 'RESULTADOS GENÉTICOS', 0, 1)
-    pdf.ln(5)
-    
-    if datos_geneticos:
-        for gen, info in datos_geneticos.items():
-            pdf.set_font('Arial', 'B', 12)
-            pdf.cell(0, 8, f"Gen: {gen}", 0, 1)
-            
-            pdf.set_font('Arial', '', 10)
-            pdf.cell(0, 6, f"Genotipo: {info[0]}", 0, 1)
-            pdf.cell(0, 6, f"Score: {info[1]}", 0, 1)
-            pdf.cell(0, 6, f"Fenotipo: {info[2]}", 0, 1)
-            
-            # Recomendación clínica (puede ser larga, usar multi_cell)
-            pdf.set_font('Arial', 'B', 10)
-            pdf.cell(0, 6, "Recomendación clínica:", 0, 1)
-            pdf.set_font('Arial', '', 9)
-            
-            # Dividir texto largo en líneas
-            recomendacion = info[3]
-            # Ajustar el ancho de línea para que quepa en la página
-            pdf.multi_cell(0, 5, recomendacion)
-            
-            pdf.ln(5)
-    else:
-        pdf.set_font('Arial', 'I', 12)
-        pdf.cell(0, 10, 'No hay datos genéticos disponibles', 0, 1)
-    
-    # Información adicional si existe
-    if paciente_data.get('observaciones'):
-        pdf.ln(5)
-        pdf.set_font('Arial', 'B', 12)
-        pdf.cell(0, 8, "Observaciones clínicas:", 0, 1)
-        pdf.set_font('Arial', '', 10)
-        pdf.multi_cell(0, 6, paciente_data.get('observaciones', ''))
-    
-    return pdf
-
-def lectura_csv(path):
-    # Lectura del archivo csv con los datos de cada paciente.
-    df = pd.read_csv(path, sep=';')
-    # Los datos se pasan a un diccionario
-    datos_dict = {df["Sample/Assay"][i]: {df.columns[j]: df[df.columns[j]][i] for j in range(1, len(df.columns))} for i in range(len(df))}
-    # Tabla con las variantes y sus mutaciones asociadas
-    tabla = {"CYP2D6": {"3": ["_"], "4": ["T"], "6": [ "_"], "7": ["G"],
-                    "8": ["A"], "9": ["_"], "10*4": ["A"], "10": ["G"],
-                    "12": ["T"], "14": ["T"], "15": ["_"], "17": ["A"],
-                    "19": ["_"], "29": ["A"], "41": ["T"], "56B": ["A"],
-                    "59": ["T"]},
-         "UGT1A1": {"80": ["T"]},
-         "DPYD": {"2A": [ "G","T" ], "13": ["C", "T"], "HapB3": ["T"], "D949V": ["A"]}}
-
-    dict_pacientes = {}
-
-
-    for i in datos_dict:
-        dict_pacientes[i] = {}
-        for j in datos_dict[i]:
-            # Separacion de nombre de gen y variantes
-            if "*" in j:
-                separador = "*"
-            elif "_" in j:
-                separador = "_"
-            snp = j.split(separador, 1)
-
-
-            if snp[0] not in dict_pacientes[i]:
-                dict_pacientes[i][snp[0]] = []
-
-            # Manejo de Indeterminados
-            if datos_dict[i][j] == "UND":
-                dict_pacientes[i][snp[0]].append(("*1", "*1"))
-                continue
-            # Determinar genotipo 
-            variante = []
-            if datos_dict[i][j].split("/")[0] in tabla[snp[0]][snp[1]]:
-                variante.append(f"{separador}{snp[1]}")
-            else:
-                variante.append(f"*1")
+def configurar_pagina():
+    """
+    Configura la página de Streamlit. Se llama al inicio de main() para que
+    importar este módulo no tenga efectos en la interfaz.
+    """
+    # Configuración de la página
+    st.set_page_config(
+        page_title="Sistema de Análisis de Alelos",
+        page_icon="🧬",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
 
-            if datos_dict[i][j].split("/")[1] in tabla[snp[0]][snp[1]]:
-                variante.append(f"{separador}{snp[1]}")
-            else:
-                variante.append(f"*1")
+    # Estilos CSS
+    st.markdown(ESTILOS, unsafe_allow_html=True)
 
-            dict_pacientes[i][snp[0]].append(tuple(variante))
 
-    # Eliminar duplicados
-    for i in dict_pacientes:
-        for j in dict_pacientes[i]:
-            dict_pacientes[i][j] = list(set(dict_pacientes[i][j]))
+def abrir_lote(lote):
+    """
+    Carga en la sesión los resultados, los datos de los pacientes y los informes de un lote guardado.
+    """
+    st.session_state.resultado, st.session_state.huellas = almacen().cargar_lote(lote)
+    st.session_state.lote = lote
+    st.session_state.pacientes_data = almacen().datos_pacientes(st.session_state.resultado.keys())
+    st.session_state.informes = almacen().informes(lote)
 
-    return dict_pacientes
 
-def determinar_genotipo_definitivo(datos_pacientes):
+def lanzar_analisis(uploaded_file, huella, lote_guardado):
     """
-    Determina el genotipo definitivo para cada gen de cada paciente
+    Lanza en segundo plano el análisis incremental del archivo y el guardado del lote.
+
+    El trabajo recibe el contenido del archivo y los resultados previos de la
+    sesión, que solo lee (los valores nuevos se añaden a sus tablas internadas,
+    que admiten varios hilos): no toca st.session_state, que solo se actualiza
+    en ``recoger_trabajo``. Debe haber como mucho un análisis en curso por sesión
+    (ver ``cancelar_trabajo``).
     """
-    resultados = {}
-    
-    for paciente, genes in datos_pacientes.items():
-        resultados[paciente] = {}
-        
-        for gen, alelos in genes.items():
-            # Recoger todos los alelos únicos, excluyendo *1 cuando hay otros
-            alelos_maternos_unicos = set()
-            alelos_paternos_unicos = set()
-
-            for alelo_materno, alelo_paterno in alelos:
-                # Si ambos son *1, es el caso base (sin mutaciones)
-                if alelo_materno == '*1' and alelo_paterno == '*1':
-                    continue
-                
-                # Añadir alelos no silvestres
-                
-                if alelo_materno != '*1':
-                    alelos_maternos_unicos.add(alelo_materno)
-                if alelo_paterno != '*1':
-                    alelos_paternos_unicos.add(alelo_paterno)
-
-            if gen == "CYP2D6":
-                # Manejo de Variante *10*4 Materno
-                if "*10*4" in alelos_maternos_unicos and "*10" in alelos_maternos_unicos:
-                    alelos_maternos_unicos.remove("*10*4")
-                    if "*4" in alelos_maternos_unicos:
-                        alelos_maternos_unicos.remove("*10")
-                # Manejo de Variante *10*4 Paterno 
-                if "*10*4" in alelos_paternos_unicos and "*10" in alelos_paternos_unicos:
-                    alelos_paternos_unicos.remove("*10*4")
-                    if "*4" in alelos_paternos_unicos:
-                        alelos_paternos_unicos.remove("*10")
-                #Manejo si estan en alelos distintos
-                if "*10*4" in alelos_paternos_unicos and "*10" in alelos_maternos_unicos:
-                    alelos_paternos_unicos.remove("*10*4")
-                    if "*4" in alelos_maternos_unicos:
-                        alelos_maternos_unicos.remove("*10")
-                if "*10*4" in alelos_maternos_unicos and "*10" in alelos_paternos_unicos:
-                    alelos_maternos_unicos.remove("*10*4")
-                    if "*4" in alelos_paternos_unicos:
-                        alelos_paternos_unicos.remove("*10")
-
-
-            # Manejo de variante *80 como *28
-            if gen == "UGT1A1":
-                if alelos_maternos_unicos:
-                    alelos_maternos_unicos = list(alelos_maternos_unicos)
-                    alelos_maternos_unicos[0] = "*28"
-                    alelos_maternos_unicos = set(alelos_maternos_unicos)
-                if alelos_paternos_unicos:
-                    alelos_paternos_unicos = list(alelos_paternos_unicos)
-                    alelos_paternos_unicos[0] = "*28"
-                    alelos_paternos_unicos = set(alelos_paternos_unicos)
-
-            # Si no hay mutaciones, el genotipo es *1/*1
-            if not alelos_maternos_unicos and not alelos_paternos_unicos:
-                resultados[paciente][gen] = ('*1', '*1')
-            # Si hay una mutación, es heterocigoto *1/mutación
-            elif alelos_maternos_unicos and not alelos_paternos_unicos:
-                mutacion = list(alelos_maternos_unicos)[0]
-                resultados[paciente][gen] = ('*1', mutacion)
-            # Si hay dos mutaciones, es heterocigoto mutación1/mutación2
-            elif not alelos_maternos_unicos and alelos_paternos_unicos:
-                mutacion = list(alelos_paternos_unicos)[0]
-                resultados[paciente][gen] = ('*1', mutacion)
-            elif alelos_maternos_unicos and alelos_paternos_unicos:
-
-                mutacion_materna = list(alelos_maternos_unicos)[0]
-                mutacion_paterna = list(alelos_paternos_unicos)[0]
-                resultados[paciente][gen] = (mutacion_materna, mutacion_paterna)
-
-    return resultados
-
-# Función para formatear el resultado como string
-def formatear_genotipos(resultados):
-    formateados = {}
-    for paciente, genes in resultados.items():
-        formateados[paciente] = {}
-        for gen, alelos in genes.items():
-            formateados[paciente][gen] = f"{alelos[0]}/{alelos[1]}"
-    return formateados
-
-df = pd.read_excel("CYP2D6_Diplotype_Phenotype_Table.xlsx")
-diccionario_CYP2D6 = dict(zip(df.iloc[:, 0], zip(df.iloc[:, 1], df.iloc[:, 2])))
-def fenotipo(genotipo):
-    Sol = {}
-    diccionario = genotipo
-    for nombre in diccionario:
-        Sol[nombre] = {}
-        for gen in diccionario[nombre]:
-            alelos = diccionario[nombre][gen].split('/')   
-            if gen == 'DPYD' or gen == 'UGT1A1':
-                if alelos[0] == "*1" and alelos[1] == "*1":       
-                    Sol[nombre][gen] = [f"{alelos[0]}/{alelos[1]}", 2.0, 'Normal Metabolizer']
-                elif alelos[0] != "*1" and alelos[1] != "*1":
-                    Sol[nombre][gen] = [f"{alelos[0]}/{alelos[1]}", 0.0, 'Poor Metabolizer']
-                else:
-                    Sol[nombre][gen] = [f"{alelos[0]}/{alelos[1]}", 1.0,'Intermediate Metabolizer']
-            else:
-                Sol[nombre][gen] = [diccionario[nombre][gen]]
-                Sol[nombre][gen].append(diccionario_CYP2D6[diccionario[nombre][gen]][0])
-                Sol[nombre][gen].append(diccionario_CYP2D6[diccionario[nombre][gen]][1])
-    return Sol
-
-
-def recomendacionClinica(fenotipo):
-    import json # Importa la biblioteca JSON para trabajar con datos JSON.
-    import requests # Importa la biblioteca Requests para realizar solicitudes HTTP.
-    resultado = fenotipo # Inicializa una lista vacía para almacenar los resultados.
-    for paciente in fenotipo:
-        for gen in fenotipo[paciente]:
-            if gen == "CYP2D6":
-                lookupkey= [gen, str(fenotipo[paciente][gen][1])] # Obtiene la clave de búsqueda del fenotipo.
-                ID_Farmaco = "RxNorm:10324"
-                url='https://api.cpicpgx.org/v1/recommendation?select=drug(name),guideline(name),*&drugid=eq.'+ID_Farmaco+'&lookupkey=cs.{\"'+lookupkey[0]+'":"'+lookupkey[1]+'"}' 
-            elif gen == "DPYD":
-                lookupkey= [gen, str(fenotipo[paciente][gen][1])] # Obtiene la clave de búsqueda del fenotipo.
-                ID_Farmaco = "RxNorm:51499"
-                url='https://api.cpicpgx.org/v1/recommendation?select=drug(name),guideline(name),*&drugid=eq.'+ID_Farmaco+'&lookupkey=cs.{\"'+lookupkey[0]+'":"'+lookupkey[1]+'"}' 
-                if float(lookupkey[1])==2.0:
-                    resultado[paciente][gen].append("Based on genotype, there is no indication to change dose or therapy. Use label-recommended dosage and administration.")
-                elif float(lookupkey[1])>=1.0:
-                    resultado[paciente][gen].append("Reduce starting dose by 50% followed by titration of dose based on toxicity or therapeutic drug monitoring (if available). Patients with the c.[2846A>T];[2846A>T] genotype may require >50% reduction in starting dose.")
-                elif float(lookupkey[1])==0.5:
-                    resultado[paciente][gen].append("Avoid use of 5- fluorouracil or 5-fluorouracil prodrug-based regimens. In the event, based on clinical advice, alternative agents are not considered a suitable therapeutic option, 5-fluorouracil should be administered at a strongly reduced dose with early therapeutic drug monitoring.")
-                elif float(lookupkey[1])== 0.0:
-                    resultado[paciente][gen].append("Avoid use of 5-fluorouracil or 5-fluorouracil prodrug-based regimens.")
-            elif gen == "UGT1A1":
-                lookupkey= [gen, str(fenotipo[paciente][gen][1])] # Obtiene la clave de búsqueda del fenotipo.
-                ID_Farmaco = "RxNorm:51499"
-                url='https://api.cpicpgx.org/v1/recommendation?select=drug(name),guideline(name),*&drugid=eq.'+ID_Farmaco+'&lookupkey=cs.{\"'+lookupkey[0]+'":"'+lookupkey[1]+'"}' 
-                if fenotipo[paciente][gen][0] == "*1/*1":
-                    resultado[paciente][gen].append("The guideline does not provide a recommendation for irinotecan in normal metabolizers.")
-                elif fenotipo[paciente][gen][0] == "*1/*28":
-                    resultado[paciente][gen].append("NO action is needed for this gene-drug interaction.")
-                elif fenotipo[paciente][gen][0] == "*28/*28":
-                    resultado[paciente][gen].append("Start with 70% of the normal dose If the patient tolerates this initial dose, the dose can be increased, guided by the neutrophil count.")
-            response = requests.get(url) # Realiza una solicitud GET a la API.
-            json_obtenido = response.json() # Convierte la respuesta JSON en un objeto Python.
-            datos=json_obtenido # Asigna los datos JSON a la variable 'datos'.
-            if len(datos) != 0: # Verifica si se encontraron recomendaciones.
-                resultado[paciente][gen].append(datos[0]['drugrecommendation'].encode('latin-1','ignore').decode('latin-1')) # Agrega la recomendación del fármaco a la lista, decodificando caracteres especiales.
-    return resultado # Devuelve la lista con los resultados.
+    from flujo import ETAPAS_ANALISIS, analizar_incremental
+
+    contenido = uploaded_file.getvalue()
+    nombre = uploaded_file.name
+    previo, huellas = st.session_state.get('resultado'), st.session_state.get('huellas')
+
+    def analizar(trabajo):
+        del_archivo, huellas_nuevas, calculados = analizar_incremental(io.BytesIO(contenido), previo, huellas,
+                                                                       progreso=trabajo.avanzar)
+        # Última oportunidad de cancelar: una vez empezado, el guardado se completa
+        trabajo.avanzar("guardado", 0)
+        lote = lote_guardado
+        if calculados or lote_guardado is None:
+            # El lote guarda solo las muestras de este archivo
+            lote = almacen().guardar_lote(nombre, del_archivo, huellas_nuevas)
+        trabajo.avanzar("guardado", trabajo.total)
+        # En la sesión se conservan también los pacientes de cargas anteriores
+        resultado = del_archivo if previo is None else previo.actualizar(del_archivo)
+        return {"resultado": resultado, "huellas": huellas_nuevas, "analizadas": calculados, "lote": lote}
+
+    # Pacientes aproximados: una línea por paciente más la cabecera
+    total = max(1, contenido.count(b"\n") - 1 + (not contenido.endswith(b"\n")))
+    trabajo = trabajos.lanzar(analizar, f"Análisis de {nombre}", ETAPAS_ANALISIS + ("guardado",), total)
+    trabajo.huella = huella
+    return trabajo
+
+
+def cancelar_trabajo(espera=ESPERA_CANCELACION):
+    """
+    Cancela el análisis en curso de la sesión y, si se detiene dentro de ``espera``
+    segundos, recoge su estado.
+
+    Si terminó antes de ver la cancelación, su resultado se incorpora a la sesión
+    como cualquier otro, de modo que el siguiente análisis parte de él. Si no se
+    detiene a tiempo sigue en la sesión y ``panel_trabajo`` lo recoge cuando termine.
+
+    Returns:
+        bool: True si ya no hay ningún análisis en curso.
+    """
+    trabajo = st.session_state.get('trabajo')
+    if trabajo is None:
+        return True
+    trabajo.cancelar()
+    if not trabajo.esperar(espera):
+        return False
+    recoger_trabajo()
+    return True
+
+
+def recoger_trabajo():
+    """
+    Incorpora a la sesión el resultado del análisis en segundo plano cuando ha terminado.
+    """
+    trabajo = st.session_state.get('trabajo')
+    if trabajo is None or trabajo.activo:
+        return
+    del st.session_state.trabajo
+    if trabajo.estado == trabajos.TERMINADO:
+        for clave in ('resultado', 'huellas', 'analizadas', 'lote'):
+            st.session_state[clave] = trabajo.resultado[clave]
+        st.session_state.archivo_cargado = trabajo.huella
+        if 'pacientes_data' not in st.session_state:
+            st.session_state.pacientes_data = almacen().datos_pacientes(st.session_state.resultado.keys())
+    else:
+        # No se relanza solo: el usuario decide si volver a analizar el archivo
+        st.session_state.archivo_interrumpido = trabajo.huella
+        st.session_state.motivo_interrupcion = ("⏹️ El análisis de este archivo se canceló."
+                                                if trabajo.estado == trabajos.CANCELADO
+                                                else f"❌ Error al cargar el archivo: {trabajo.error}")
+
+
+@st.fragment(run_every=1.0)
+def panel_trabajo():
+    """
+    Muestra el progreso por etapas del análisis en curso; se refresca solo cada segundo.
+    """
+    trabajo = st.session_state.get('trabajo')
+    if trabajo is None:
+        return
+    if not trabajo.activo:
+        # Rerun completo para incorporar el resultado a toda la página
+        st.rerun()
+    st.markdown(f"**⏳ {trabajo.descripcion}** ({trabajo.segundos():.0f} s)")
+    for etapa, hechas, fraccion in trabajo.progreso():
+        st.progress(fraccion or 0.0, text=f"{etapa.capitalize()}: {hechas}/{trabajo.total} pacientes")
+    if st.button("⏹️ Cancelar análisis"):
+        trabajo.cancelar()
+        st.info("Cancelando...")
+
+
+def indice_pacientes():
+    """
+    Devuelve el índice de búsqueda de la cohorte de la sesión, construyéndolo solo cuando cambia la cohorte.
+    """
+    from buscador import IndicePacientes
+
+    indice = st.session_state.get('indice_pacientes')
+    if indice is None or indice.cohorte is not st.session_state.resultado:
+        indice = st.session_state.indice_pacientes = IndicePacientes(st.session_state.resultado,
+                                                                     st.session_state.pacientes_data)
+    return indice
 
 
 def main():
+    configurar_pagina()
+    recoger_trabajo()
+
     # Header principal
     st.markdown('<div class="main-header">🧬 SISTEMA DE ANÁLISIS DE ALELOS</div>', unsafe_allow_html=True)
     
@@ -389,27 +257,68 @@ def main():
         st.markdown('</div>', unsafe_allow_html=True)
         
         if uploaded_file is not None:
-            try:
-                # Leer el archivo CSV
-                dict_pacientes = lectura_csv(uploaded_file)
-                st.session_state.pacientes_data = dict_pacientes
-                
-                st.success(f"✅ Archivo cargado correctamente! ({len(dict_pacientes)} pacientes)")
-                
-                st.markdown("### Procesando datos...")
+            from flujo import huella_archivo
 
-                resultados = determinar_genotipo_definitivo(dict_pacientes)
-                resultados_formateados = formatear_genotipos(resultados)
-                fenotipo_resultado = fenotipo(resultados_formateados)
-                resultado_final = recomendacionClinica(fenotipo_resultado)
-
-                st.session_state.resultado = resultado_final
-
-                st.success(f"Datos procesados! Por favor, pasa a la siguiente sección.")
+            try:
+                # El uploader conserva el archivo entre reruns: solo se procesa cuando cambia su contenido
+                huella = huella_archivo(uploaded_file)
+                trabajo = st.session_state.get('trabajo')
+                en_curso = trabajo is not None and trabajo.huella == huella
+                if trabajo is not None and not en_curso:
+                    # Se ha subido otro archivo: el análisis anterior se detiene antes de lanzar el
+                    # nuevo (si tarda, el nuevo se lanza en el rerun que sigue a su final)
+                    en_curso = not cancelar_trabajo()
+                if st.session_state.get('archivo_cargado') != huella and not en_curso \
+                        and st.session_state.get('archivo_interrumpido') != huella:
+                    lote_guardado = almacen().lote_por_huella(huella)
+                    if 'resultado' not in st.session_state and lote_guardado is not None:
+                        # El archivo ya se analizó en una sesión anterior: se reabre desde el almacén
+                        abrir_lote(lote_guardado)
+                        if not st.session_state.huellas.get("provisional"):
+                            st.session_state.analizadas = 0
+                            st.session_state.archivo_cargado = huella
+                    if st.session_state.get('archivo_cargado') != huella:
+                        # El análisis se ejecuta en segundo plano; la página muestra su progreso. Si se
+                        # reabrió un lote con recomendaciones provisionales, solo se recalculan esas muestras
+                        st.session_state.trabajo = lanzar_analisis(uploaded_file, huella, lote_guardado)
+
+                if st.session_state.get('trabajo') is not None:
+                    panel_trabajo()
+                elif st.session_state.get('archivo_interrumpido') == huella:
+                    st.warning(st.session_state.motivo_interrupcion)
+                    if st.button("🔄 Volver a analizar"):
+                        del st.session_state.archivo_interrumpido
+                        st.rerun()
+                elif st.session_state.get('archivo_cargado') == huella:
+                    st.success(f"✅ Archivo cargado correctamente! ({len(st.session_state.resultado)} pacientes)")
+                    st.caption(f"Muestras analizadas en esta carga: {st.session_state.get('analizadas', 0)} (el resto se reutiliza de cargas anteriores)")
+
+                    estadisticas = cpic.CACHE_RECOMENDACIONES.estadisticas()
+                    st.caption(f"Recomendaciones CPIC: {estadisticas['aciertos']} aciertos de caché, {estadisticas['fallos']} consultas")
+
+                    st.success(f"Datos procesados! Por favor, pasa a la siguiente sección.")
                     
             except Exception as e:
                 st.error(f"❌ Error al cargar el archivo: {str(e)}")
         
+        # Lotes de sesiones anteriores guardados en el almacén
+        with st.expander("🗂️ Lotes guardados"):
+            lotes_guardados = almacen().lotes()
+            if lotes_guardados:
+                elegido = st.selectbox(
+                    "Lote", lotes_guardados,
+                    format_func=lambda l: f"{l['nombre']} ({l['pacientes']} pacientes, {l['creado']}"
+                                          f"{', provisional' if l['provisional'] else ''})"
+                )
+                if st.button("📂 Abrir lote"):
+                    abrir_lote(elegido['id'])
+                    st.success(f"✅ Lote {elegido['nombre']} abierto ({len(st.session_state.resultado)} pacientes)")
+            else:
+                st.caption("Todavía no hay lotes guardados.")
+            buscado = st.text_input("Buscar una muestra en todos los lotes", placeholder="Ej: DPD900")
+            if buscado:
+                st.dataframe(almacen().buscar(paciente=buscado.strip()), hide_index=True, use_container_width=True)
+
         # Ejemplo de formato esperado
         with st.expander("📝 ¿Qué formato debe tener el CSV?"):
             st.markdown("""
@@ -428,14 +337,37 @@ def main():
 
     elif page == "📝 Datos del Paciente":
         st.markdown('<div class="sub-header">📝 INFORMACIÓN DE LOS PACIENTES</div>', unsafe_allow_html=True)
+        from buscador import TAMANO_PAGINA, paginas
         
         # Inicializar el almacenamiento de pacientes en session_state si no existe
         if 'pacientes_data' not in st.session_state:
             st.session_state.pacientes_data = {}
         
-        # Selector de paciente
-        pacientes_disponibles = list(st.session_state.resultado.keys())
-        paciente_seleccionado = st.selectbox("Selecciona el paciente *", pacientes_disponibles)
+        # Buscador paginado: solo se construye la página visible, sea cual sea el tamaño del lote
+        indice = indice_pacientes()
+        col_busqueda, col_accionables, col_pendientes = st.columns([3, 1, 1])
+        with col_busqueda:
+            texto = st.text_input("🔎 Buscar por código, nombre o fenotipo", placeholder="Ej: DPD900, García, Poor")
+        with col_accionables:
+            solo_accionables = st.checkbox("Solo fenotipos accionables")
+        with col_pendientes:
+            solo_pendientes = st.checkbox("Solo datos pendientes")
+        encontrados = indice.buscar(texto, solo_accionables, solo_pendientes)
+        if not len(encontrados):
+            st.info("💡 Ningún paciente coincide con la búsqueda")
+            return
+
+        total_paginas = paginas(len(encontrados))
+        # La clave depende de la búsqueda para volver a la primera página cuando cambian los filtros
+        numero_pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, value=1,
+                                        key=f"pagina_{texto}_{solo_accionables}_{solo_pendientes}")
+        tabla_pagina = indice.pagina(encontrados, numero_pagina)
+        st.caption(f"{len(encontrados)} pacientes encontrados; mostrando {len(tabla_pagina)} "
+                   f"a partir del {(numero_pagina - 1) * TAMANO_PAGINA + 1}")
+        st.dataframe(tabla_pagina, hide_index=True, use_container_width=True)
+
+        # Selector de paciente (solo los de la página actual)
+        paciente_seleccionado = st.selectbox("Selecciona el paciente *", tabla_pagina["Paciente"].tolist())
         
         st.markdown(f"### Editando datos para: **{paciente_seleccionado}**")
         
@@ -538,46 +470,26 @@ def main():
                     'direccion': direccion,
                     'observaciones': observaciones
                 }
+                almacen().guardar_paciente(paciente_seleccionado, st.session_state.pacientes_data[paciente_seleccionado])
+                indice.actualizar_datos(paciente_seleccionado, st.session_state.pacientes_data[paciente_seleccionado])
                 st.success(f"✅ Datos de {paciente_seleccionado} guardados correctamente!")
         
         # Mostrar resumen de pacientes con datos guardados
         st.markdown("---")
         st.markdown("### 📋 Resumen de Pacientes")
         
-        pacientes_guardados = st.session_state.pacientes_data.keys()
-        if pacientes_guardados:
-            st.info(f"**Pacientes con datos guardados:** {len(pacientes_guardados)}/{len(pacientes_disponibles)}")
-            
-            # Crear una tabla resumen
-            resumen_data = []
-            for paciente in pacientes_disponibles:
-                tiene_datos = paciente in st.session_state.pacientes_data
-                datos = st.session_state.pacientes_data.get(paciente, {})
-                resumen_data.append({
-                    "Paciente": paciente,
-                    "Nombre": datos.get('nombre', 'No completado'),
-                    "Edad": datos.get('edad', 'No completado'),
-                    "Estado": "✅ Completado" if tiene_datos else "⏳ Pendiente"
-                })
-            
-            # Mostrar tabla resumen
-            df_resumen = pd.DataFrame(resumen_data)
-            st.dataframe(
-                df_resumen, 
-                use_container_width=True,
-                column_config={
-                    "Paciente": "Código Paciente",
-                    "Nombre": "Nombre",
-                    "Edad": "Edad", 
-                    "Estado": "Estado"
-                }
-            )
+        completados = int(indice.con_datos.sum())
+        if completados:
+            st.info(f"**Pacientes con datos guardados:** {completados}/{len(indice)}")
+            st.caption(f"Pacientes con algún fenotipo accionable: {int(indice.accionable.sum())}. "
+                       "Usa los filtros del buscador para ver los pendientes.")
         else:
             st.warning("ℹ️ No hay datos de pacientes guardados todavía. Completa el formulario para guardar la información.")
         
     # Sección 3: Generar Reporte
     elif page == "📄 Generar Reporte":
         st.markdown('<div class="sub-header">📄 GENERAR REPORTES PDF</div>', unsafe_allow_html=True)
+        from informes import DATOS_PACIENTE_VACIOS, empaquetar_zip, generar_informes_en_lote
         
         pacientes_disponibles = list(st.session_state.resultado.keys())
         
@@ -600,55 +512,71 @@ def main():
         
         # Generar PDFs
         if st.button("🖨️ Generar Reportes PDF Seleccionados"):
-            for paciente in pacientes_seleccionados:
-                with st.spinner(f"Generando reporte para {paciente}..."):
-                    try:
-                        # Obtener datos del paciente (si existen)
-                        paciente_data = st.session_state.pacientes_data.get(paciente, {
-                            'nombre': '',
-                            'edad': '',
-                            'sexo': '',
-                            'id_paciente': paciente,
-                            'medico': '',
-                            'fecha_nacimiento': '',
-                            'telefono': '',
-                            'email': '',
-                            'direccion': '',
-                            'observaciones': ''
-                        })
-                        
-                        # Obtener datos genéticos del resultado_final
-                        datos_geneticos = st.session_state.resultado.get(paciente, {})
-                        
-                        pdf = create_pdf(paciente_data, datos_geneticos, paciente)
-                        
-                        # Guardar PDF en bytes
-                        pdf_bytes = pdf.output(dest='S').encode('latin1')
-                        
-                        # Nombre del archivo
-                        nombre_paciente = paciente_data.get('nombre', paciente).replace(' ', '_')
-                        nombre_archivo = f"reporte_{nombre_paciente}_{datetime.now().strftime('%Y%m%d')}.pdf"
-                        
-                        # Botón de descarga individual
-                        col1, col2 = st.columns([3, 1])
-                        with col1:
-                            st.download_button(
-                                label=f"📥 Descargar {paciente} - {paciente_data.get('nombre', 'Sin nombre')}",
-                                data=pdf_bytes,
-                                file_name=nombre_archivo,
-                                mime="application/pdf",
-                                key=f"download_{paciente}"
-                            )
-                        with col2:
-                            st.info(f"Genes: {len(datos_geneticos)}")
-                        
-                    except Exception as e:
-                        st.error(f"❌ Error al generar PDF para {paciente}: {str(e)}")
-            
-            st.success(f"✅ Se generaron {len(pacientes_seleccionados)} reportes correctamente!")
+            tareas_pdf = [
+                (
+                    paciente,
+                    # Datos del paciente (si existen)
+                    st.session_state.pacientes_data.get(paciente, dict(DATOS_PACIENTE_VACIOS, id_paciente=paciente)),
+                    # Datos genéticos del resultado_final
+                    st.session_state.resultado.get(paciente, {})
+                )
+                for paciente in pacientes_seleccionados
+            ]
+
+            barra = st.progress(0.0, text="Generando reportes...")
+            def progreso(completados, total, paciente):
+                barra.progress(completados / total, text=f"Generado {paciente} ({completados}/{total})")
+
+            try:
+                st.session_state.informes = generar_informes_en_lote(tareas_pdf, progreso)
+                if st.session_state.get('lote') is not None:
+                    almacen().guardar_informes(st.session_state.lote, st.session_state.informes)
+            except Exception as e:
+                st.error(f"❌ Error al generar los reportes: {str(e)}")
+                st.session_state.informes = {}
+            barra.empty()
+
+        # Los informes se guardan en la sesión para que las descargas sobrevivan a los reruns
+        informes = st.session_state.get('informes') or {}
+        if informes:
+            generados = {paciente: info for paciente, info in informes.items() if info[1] is not None}
+            for paciente, (_, _, error) in informes.items():
+                if error:
+                    st.error(f"❌ Error al generar PDF para {paciente}: {error}")
+
+            if generados:
+                st.download_button(
+                    label=f"📦 Descargar todos los reportes ({len(generados)}) en ZIP",
+                    data=empaquetar_zip(generados),
+                    file_name=f"reportes_{datetime.now().strftime('%Y%m%d')}.zip",
+                    mime="application/zip",
+                    key="download_zip"
+                )
+
+            for paciente, (nombre_archivo, pdf_bytes, _) in generados.items():
+                paciente_data = st.session_state.pacientes_data.get(paciente, {})
+                # Botón de descarga individual
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.download_button(
+                        label=f"📥 Descargar {paciente} - {paciente_data.get('nombre', 'Sin nombre')}",
+                        data=pdf_bytes,
+                        file_name=nombre_archivo,
+                        mime="application/pdf",
+                        key=f"download_{paciente}"
+                    )
+                with col2:
+                    st.info(f"Genes: {len(st.session_state.resultado.get(paciente, {}))}")
+
+            st.success(f"✅ Se generaron {len(generados)} reportes correctamente!")
 
 if __name__ == "__main__":
     main()
+    # Al final del script, para incluir las etapas ejecutadas en esta misma pasada
+    with st.sidebar:
+        metricas.panel_streamlit()
+    # Con la página ya enviada: módulos y datos de referencia de las demás páginas
+    arranque.precalentar()
 
 
 
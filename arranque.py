@@ -0,0 +1,186 @@
+"""
+Arranque en frío de las aplicaciones de Streamlit.
+
+La primera página solo necesita streamlit, ``cpic`` y el almacén: pandas,
+numpy, fpdf y los datos de referencia (tabla de variantes, reglas de fenotipo
+y tabla de diplotipos de CYP2D6, logos de los informes) se cargan la primera
+vez que una página los usa. Para que ese primer uso no tenga que esperar,
+``precalentar`` los carga en un hilo en segundo plano una vez por proceso; las
+aplicaciones lo llaman al final del script, cuando la página ya está pintada.
+
+Perfil de arranque (línea de comandos)::
+
+    python arranque.py app                  # importación de app.py (python -X importtime)
+    python arranque.py app --pasada         # + primera ejecución completa del script
+    python arranque.py app --precalentar    # + tiempo de cada paso de precalentamiento
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from metricas import instrumentar
+
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+@instrumentar("arranque.analisis", filas=None)
+def _importar_analisis():
+    # pandas, numpy y los módulos del análisis de la matriz y del buscador
+    import buscador  # noqa: F401
+    import flujo  # noqa: F401
+
+
+@instrumentar("arranque.referencia", filas=None)
+def _cargar_referencia():
+    from farmacogenetica import cargar_reglas_fenotipo, indice_fenotipos
+    from genotipado import cargar_tabla_variantes
+
+    cargar_tabla_variantes()
+    for gen in cargar_reglas_fenotipo():
+        indice_fenotipos(gen)
+
+
+@instrumentar("arranque.informes", filas=None)
+def _importar_informes():
+    import informes  # noqa: F401
+
+
+# Pasos de precalentamiento, en el orden en que se ejecutan
+PASOS = {
+    "analisis": _importar_analisis,
+    "referencia": _cargar_referencia,
+    "informes": _importar_informes,
+}
+
+_lanzados = set()
+_cerrojo = threading.Lock()
+
+
+def _ejecutar(pasos, imagenes):
+    for paso in pasos:
+        try:
+            PASOS[paso]()
+        except Exception:
+            pass  # el paso se repetirá (y mostrará su error) cuando una página lo necesite
+    if imagenes:
+        from informes import recurso_imagen
+        for ruta in imagenes:
+            try:
+                recurso_imagen(ruta)
+            except Exception:
+                pass
+
+
+def precalentar(pasos=tuple(PASOS), imagenes=()):
+    """
+    Carga en segundo plano, una sola vez por proceso, los módulos y datos indicados.
+
+    Args:
+        pasos (tuple): Nombres de ``PASOS`` que se ejecutan.
+        imagenes (tuple): Rutas de imágenes que se decodifican con ``informes.recurso_imagen``.
+
+    Returns:
+        threading.Thread: El hilo lanzado, o None si todo estaba ya lanzado.
+    """
+    with _cerrojo:
+        pendientes = [paso for paso in pasos if paso not in _lanzados]
+        imagenes = [ruta for ruta in imagenes if ruta not in _lanzados]
+        if not pendientes and not imagenes:
+            return None
+        _lanzados.update(pendientes + imagenes)
+    hilo = threading.Thread(target=_ejecutar, args=(pendientes, imagenes), name="precalentamiento", daemon=True)
+    hilo.start()
+    return hilo
+
+
+def perfil_importacion(modulo, directorio=DIRECTORIO):
+    """
+    Mide en un intérprete nuevo la importación de un módulo con ``python -X importtime``.
+
+    Returns:
+        list: Tuplas (módulo, segundos propios, segundos acumulados, profundidad) de los
+        módulos importados por ``modulo``, en el orden en que terminaron de importarse.
+    """
+    proceso = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                             cwd=directorio, capture_output=True, text=True)
+    if proceso.returncode:
+        raise RuntimeError(proceso.stderr.strip().splitlines()[-1])
+    filas = []
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith("import time:") or "[us]" in linea:
+            continue
+        propio, acumulado, nombre = linea[len("import time:"):].split("|")
+        profundidad = (len(nombre) - len(nombre.lstrip()) - 1) // 2
+        filas.append((nombre.strip(), int(propio) / 1e6, int(acumulado) / 1e6, profundidad))
+    # La importación de ``modulo`` es la última de profundidad 0; sus dependencias la preceden
+    fin = max(i for i, fila in enumerate(filas) if fila[3] == 0 and fila[0] == modulo)
+    inicio = max((i for i, fila in enumerate(filas[:fin]) if fila[3] == 0), default=-1) + 1
+    return filas[inicio:fin + 1]
+
+
+def primera_pasada(script, directorio=DIRECTORIO, timeout=60):
+    """
+    Mide en un intérprete nuevo la primera ejecución completa de un script de Streamlit.
+
+    Se usa ``streamlit.testing`` (que no importa pandas), así que el tiempo incluye
+    importar el script y todo lo que este cargue hasta pintar la página.
+
+    Returns:
+        float: Segundos.
+    """
+    codigo = ("import time\n"
+              "from streamlit.testing.v1 import AppTest\n"
+              "inicio = time.perf_counter()\n"
+              f"AppTest.from_file({script!r}, default_timeout={timeout}).run()\n"
+              "print(time.perf_counter() - inicio)\n")
+    proceso = subprocess.run([sys.executable, "-c", codigo], cwd=directorio, capture_output=True, text=True)
+    if proceso.returncode:
+        raise RuntimeError(proceso.stderr.strip().splitlines()[-1])
+    return float(proceso.stdout.strip().splitlines()[-1])
+
+
+def informe_importacion(filas, limite=15):
+    """
+    Resume el perfil de ``perfil_importacion`` en texto.
+
+    Args:
+        filas (list): Resultado de ``perfil_importacion``.
+        limite (int): Módulos que se listan en cada tabla.
+    """
+    modulo, _, total, _ = filas[-1]
+    lineas = [f"Importar {modulo}: {total * 1000:.0f} ms ({len(filas) - 1} módulos)", "",
+              "Importaciones directas (tiempo acumulado):"]
+    directas = sorted((f for f in filas if f[3] == 1), key=lambda f: -f[2])
+    lineas += [f"  {acumulado * 1000:8.1f} ms  {nombre}" for nombre, _, acumulado, _ in directas[:limite]]
+    lineas += ["", "Módulos más lentos (tiempo propio):"]
+    propios = sorted(filas[:-1], key=lambda f: -f[1])
+    lineas += [f"  {propio * 1000:8.1f} ms  {nombre}" for nombre, propio, _, _ in propios[:limite]]
+    return "\n".join(lineas)
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Perfil del arranque en frío de una aplicación")
+    parser.add_argument("modulo", nargs="?", default="app", help="Módulo de la aplicación (p. ej. app o Appv2)")
+    parser.add_argument("--limite", type=int, default=15, help="Módulos listados en cada tabla")
+    parser.add_argument("--pasada", action="store_true", help="Medir también la primera ejecución del script")
+    parser.add_argument("--precalentar", action="store_true", help="Medir también cada paso de precalentamiento")
+    args = parser.parse_args(argumentos)
+
+    print(informe_importacion(perfil_importacion(args.modulo), args.limite))
+    if args.pasada:
+        print(f"\nPrimera ejecución de {args.modulo}.py: {primera_pasada(args.modulo + '.py') * 1000:.0f} ms")
+    if args.precalentar:
+        print("\nPrecalentamiento:")
+        for paso, funcion in PASOS.items():
+            inicio = time.perf_counter()
+            funcion()
+            print(f"  {(time.perf_counter() - inicio) * 1000:8.1f} ms  {paso}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
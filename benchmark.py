@@ -0,0 +1,387 @@
+"""
+Banco de pruebas de rendimiento con placas sintéticas y un CPIC simulado.
+
+Genera matrices de genotipos con el formato de ``Genotype Matrix.csv``
+(``Sample/Assay;CYP2D6*3;...``) para varios tamaños de cohorte y mide cada
+etapa del análisis:
+
+    lectura_csv -> determinar_genotipo_definitivo -> fenotipo
+                -> recomendacionClinica -> create_pdf
+
+(y genotipos_en_lote, la lectura con resolución vectorizada que usa el flujo).
+
+Las recomendaciones se consultan a un servidor HTTP local que imita la API de
+CPIC (con una latencia configurable), así que las medidas no dependen de la red
+ni cambian con el contenido de la API real. Los tiempos y el pico de memoria de
+cada etapa se guardan en JSON para comparar entre commits::
+
+    python benchmark.py --tamanos 100 1000 10000 100000 --salida bench.json
+    python benchmark.py --tamanos 1000000 --sin-memoria
+    python benchmark.py --comparar bench_anterior.json bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import cpic
+from farmacogenetica import (cargar_reglas_fenotipo, determinar_genotipo_definitivo, formatear_genotipos, fenotipo,
+                             genotipos_en_lote, indice_fenotipos, recomendacionClinica)
+from genotipado import COLUMNA_MUESTRA, INDETERMINADO, lectura_csv
+from informes import DATOS_PACIENTE_VACIOS, generar_informe
+
+
+TAMANOS = (100, 1000, 10000, 100000)
+TASA_INDETERMINADOS = 0.01      # fracción de llamadas 'UND'
+LATENCIA_CPIC = 0.02            # segundos por respuesta del servidor simulado
+MAX_INFORMES = 200              # los PDF se miden sobre una muestra de pacientes
+FILAS_POR_BLOQUE = 100000       # filas escritas a la vez al generar la placa
+
+# Ensayo -> (alelo de referencia, alelo alternativo) tal y como aparecen en la placa
+ENSAYOS = {
+    "CYP2D6*3": ("T", "_"), "CYP2D6*4": ("C", "T"), "CYP2D6*6": ("A", "_"), "CYP2D6*7": ("T", "G"),
+    "CYP2D6*8": ("C", "A"), "CYP2D6*9": ("CTT", "_"), "CYP2D6*10": ("C", "G"), "CYP2D6*10*4": ("G", "A"),
+    "CYP2D6*12": ("C", "T"), "CYP2D6*14": ("C", "T"), "CYP2D6*15": ("-", "_"), "CYP2D6*17": ("G", "A"),
+    "CYP2D6*19": ("AGTT", "_"), "CYP2D6*29": ("C", "A"), "CYP2D6*41": ("C", "T"), "CYP2D6*56B": ("G", "A"),
+    "CYP2D6*59": ("G", "T"), "DPYD*2A": ("C", "T"), "DPYD*13": ("A", "C"), "DPYD_HapB3": ("C", "T"),
+    "DPYD_D949V": ("T", "A"), "UGT1A1*80": ("C", "T"),
+}
+
+# Gen -> {alelo estrella: (frecuencia, ensayos que lleva en alternativo)}, frecuencias
+# aproximadas de población europea. El resto de haplotipos son *1. Cada paciente
+# recibe dos haplotipos por gen, así que la tasa de heterocigosis de cada ensayo
+# sigue Hardy-Weinberg. *4 lleva también las variantes de *10 y *10*4, que
+# determinar_genotipo_definitivo descarta al ver *4. *56B no figura en la tabla
+# de CYP2D6 de CPIC (fenotipo no lo reconoce), así que su ensayo sale siempre
+# en referencia.
+HAPLOTIPOS = {
+    "CYP2D6": {
+        "*3": (0.015, ("CYP2D6*3",)), "*4": (0.18, ("CYP2D6*4", "CYP2D6*10", "CYP2D6*10*4")),
+        "*6": (0.01, ("CYP2D6*6",)), "*7": (0.001, ("CYP2D6*7",)), "*8": (0.001, ("CYP2D6*8",)),
+        "*9": (0.02, ("CYP2D6*9",)), "*10": (0.02, ("CYP2D6*10",)), "*12": (0.001, ("CYP2D6*12",)),
+        "*14": (0.001, ("CYP2D6*14",)), "*15": (0.001, ("CYP2D6*15",)), "*17": (0.005, ("CYP2D6*17",)),
+        "*19": (0.001, ("CYP2D6*19",)), "*29": (0.002, ("CYP2D6*29",)), "*41": (0.09, ("CYP2D6*41",)),
+        "*59": (0.003, ("CYP2D6*59",)),
+    },
+    "DPYD": {
+        "*2A": (0.005, ("DPYD*2A",)), "*13": (0.001, ("DPYD*13",)),
+        "HapB3": (0.024, ("DPYD_HapB3",)), "D949V": (0.006, ("DPYD_D949V",)),
+    },
+    "UGT1A1": {"*80": (0.33, ("UGT1A1*80",))},
+}
+
+
+def _orden_alelo(alelo):
+    # Orden numérico de la tabla de CYP2D6 ('*4/*10', no '*10/*4')
+    numero = re.match(r"\*?(\d+)", alelo)
+    return (int(numero.group(1)) if numero else float("inf"), alelo)
+
+
+def _haplotipos_gen(generador, haplotipos, filas):
+    """
+    Sortea los dos haplotipos de cada paciente para un gen.
+
+    Returns:
+        tuple: (materno, paterno, alelos) con los índices sorteados sobre
+        ``alelos`` (el primero es *1). Cada par queda ordenado como en la
+        tabla de CYP2D6, que fenotipo consulta literalmente.
+    """
+    alelos = ["*1"] + sorted(haplotipos, key=_orden_alelo)
+    frecuencias = [haplotipos[alelo][0] for alelo in alelos[1:]]
+    probabilidades = [1 - sum(frecuencias)] + frecuencias
+    materno, paterno = generador.choice(len(alelos), size=(2, filas), p=probabilidades)
+    return np.minimum(materno, paterno), np.maximum(materno, paterno), alelos
+
+
+def generar_placa(ruta, muestras, tasa_indeterminados=TASA_INDETERMINADOS, semilla=0):
+    """
+    Escribe una matriz de genotipos sintética.
+
+    Args:
+        ruta (str): Archivo CSV de salida (separador ';').
+        muestras (int): Número de pacientes.
+        tasa_indeterminados (float): Probabilidad de que una llamada sea 'UND'.
+        semilla (int): Semilla del generador, para que la placa sea reproducible.
+
+    Returns:
+        str: La ruta escrita.
+    """
+    generador = np.random.default_rng(semilla)
+    with open(ruta, "w", encoding="utf-8", newline="") as archivo:
+        archivo.write(";".join((COLUMNA_MUESTRA,) + tuple(ENSAYOS)) + "\n")
+        for inicio in range(0, muestras, FILAS_POR_BLOQUE):
+            filas = min(FILAS_POR_BLOQUE, muestras - inicio)
+            columnas = {COLUMNA_MUESTRA: [f"S{i:07d}" for i in range(inicio, inicio + filas)]}
+            for gen, haplotipos in HAPLOTIPOS.items():
+                materno, paterno, alelos = _haplotipos_gen(generador, haplotipos, filas)
+                for ensayo in (e for e in ENSAYOS if e.startswith(gen)):
+                    referencia, alternativo = ENSAYOS[ensayo]
+                    llamadas = np.array([f"{referencia}/{referencia}", f"{referencia}/{alternativo}",
+                                         f"{alternativo}/{referencia}", f"{alternativo}/{alternativo}",
+                                         INDETERMINADO], dtype=object)
+                    # Qué haplotipos llevan el alelo alternativo en este ensayo
+                    lleva = np.array([alelo != "*1" and ensayo in haplotipos[alelo][1] for alelo in alelos])
+                    indices = 2 * lleva[materno] + lleva[paterno]
+                    # Los UND solo sustituyen llamadas de referencia: sobre una variante dejarían
+                    # combinaciones que la tabla de CYP2D6 no reconoce (p. ej. *10*4 sin *10)
+                    indices[(indices == 0) & (generador.random(filas) < tasa_indeterminados)] = 4
+                    columnas[ensayo] = llamadas[indices]
+            pd.DataFrame(columnas)[[COLUMNA_MUESTRA, *ENSAYOS]].to_csv(archivo, sep=";", index=False, header=False)
+    return ruta
+
+
+class _ManejadorCPIC(BaseHTTPRequestHandler):
+    """
+    Responde a /recommendation con una recomendación por (fármaco, clave de búsqueda)
+    y a cualquier otra tabla con una lista vacía.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        parametros = {clave: valores[0] for clave, valores in parse_qs(url.query).items()}
+        filas = []
+        if url.path.rstrip("/").endswith("recommendation") and parametros.get("lookupkey", "").startswith("cs."):
+            drugid = parametros.get("drugid", "").partition(".")[2]
+            lookupkey = json.loads(parametros["lookupkey"][3:])
+            texto = ", ".join(f"{gen} {valor}" for gen, valor in lookupkey.items())
+            filas.append({"drugid": drugid, "lookupkey": lookupkey, "drug": {"name": drugid},
+                          "guideline": {"name": "Synthetic guideline"},
+                          "drugrecommendation": f"Synthetic recommendation for {texto}."})
+        time.sleep(self.server.latencia)
+        with self.server.cerrojo:
+            self.server.peticiones += 1
+        cuerpo = json.dumps(filas).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+class ServidorCPIC:
+    """
+    Servidor HTTP local que imita la API de CPIC para las consultas de recomendaciones.
+
+    Se usa como contexto: al entrar arranca en un puerto libre y configura
+    ``cpic`` para consultarlo; al salir lo detiene y restaura el resolver anterior.
+
+    Args:
+        latencia (float): Segundos de espera antes de cada respuesta.
+    """
+    def __init__(self, latencia=LATENCIA_CPIC):
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), _ManejadorCPIC)
+        self.servidor.latencia = latencia
+        self.servidor.peticiones = 0
+        self.servidor.cerrojo = threading.Lock()
+        self.url = f"http://127.0.0.1:{self.servidor.server_address[1]}/v1/"
+        self._anterior = None
+
+    @property
+    def peticiones(self):
+        return self.servidor.peticiones
+
+    def __enter__(self):
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        self._anterior = cpic.resolver()
+        cpic.configurar_resolver(cpic.ResolverRemoto(self.url))
+        return self
+
+    def __exit__(self, *exc):
+        cpic.configurar_resolver(self._anterior)
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+def _medir(funcion, memoria):
+    """
+    Ejecuta ``funcion()`` y devuelve (resultado, segundos, pico de memoria en MB o None).
+    """
+    if memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    try:
+        resultado = funcion()
+    finally:
+        segundos = time.perf_counter() - inicio
+        pico = None
+        if memoria:
+            pico = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+    return resultado, segundos, pico
+
+
+def _generar_informes(resultados, max_informes):
+    for paciente in list(resultados)[:max_informes]:
+        generar_informe(paciente, dict(DATOS_PACIENTE_VACIOS, id_paciente=paciente), resultados[paciente])
+    return min(len(resultados), max_informes)
+
+
+def medir_placa(ruta, servidor, memoria=True, max_informes=MAX_INFORMES):
+    """
+    Mide cada etapa del análisis sobre una placa.
+
+    Las etapas se encadenan igual que en la aplicación. La caché de
+    recomendaciones se vacía antes de la consulta a CPIC para medir en frío.
+
+    Args:
+        ruta (str): CSV de la placa.
+        servidor (ServidorCPIC): Servidor simulado activo.
+        memoria (bool): Si es True se mide el pico de memoria con tracemalloc
+            (los tiempos salen algo peores que sin medirla).
+        max_informes (int): Número de pacientes para los que se genera el PDF.
+
+    Returns:
+        list: Un dict por etapa con su nombre, segundos, pico de memoria y elementos procesados.
+    """
+    medidas = []
+
+    def etapa(nombre, funcion, elementos=None):
+        resultado, segundos, pico = _medir(funcion, memoria)
+        elementos = len(resultado) if elementos is None else elementos(resultado)
+        medidas.append({"etapa": nombre, "segundos": round(segundos, 6),
+                        "pico_memoria_mb": None if pico is None else round(pico, 3),
+                        "elementos": elementos,
+                        "us_por_elemento": round(segundos / elementos * 1e6, 3) if elementos else None})
+        return resultado
+
+    haplotipos = etapa("lectura_csv", lambda: lectura_csv(ruta))
+    genotipos = etapa("determinar_genotipo_definitivo",
+                      lambda: formatear_genotipos(determinar_genotipo_definitivo(haplotipos)))
+    # Lectura + resolución vectorizada, la ruta que usa el flujo por lotes
+    etapa("genotipos_en_lote", lambda: genotipos_en_lote(pd.read_csv(ruta, sep=";")))
+    fenotipos = etapa("fenotipo", lambda: fenotipo(genotipos))
+    cpic.CACHE_RECOMENDACIONES.vaciar()
+    peticiones = servidor.peticiones
+    resultados = etapa("recomendacionClinica", lambda: recomendacionClinica(fenotipos))
+    medidas[-1]["peticiones_http"] = servidor.peticiones - peticiones
+    etapa("create_pdf", lambda: _generar_informes(resultados, max_informes), elementos=lambda n: n)
+    return medidas
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar(tamanos=TAMANOS, tasa_indeterminados=TASA_INDETERMINADOS, latencia=LATENCIA_CPIC,
+             memoria=True, max_informes=MAX_INFORMES, directorio=None, semilla=0):
+    """
+    Genera una placa por tamaño y mide todas las etapas sobre cada una.
+
+    Args:
+        tamanos (iterable): Número de pacientes de cada placa.
+        tasa_indeterminados (float): Probabilidad de 'UND' por llamada.
+        latencia (float): Latencia del CPIC simulado, en segundos.
+        memoria (bool): Medir el pico de memoria de cada etapa.
+        max_informes (int): Pacientes por placa para los que se genera el PDF.
+        directorio (str): Dónde dejar las placas generadas (por defecto, un temporal que se borra).
+        semilla (int): Semilla de las placas sintéticas.
+
+    Returns:
+        dict: Metadatos de la ejecución y lista de medidas (una por tamaño y etapa).
+    """
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parametros": {"tasa_indeterminados": tasa_indeterminados, "latencia_cpic": latencia,
+                       "memoria": memoria, "max_informes": max_informes, "semilla": semilla},
+        "medidas": [],
+    }
+    temporal = None if directorio else tempfile.TemporaryDirectory(prefix="benchmark_")
+    directorio = directorio or temporal.name
+    os.makedirs(directorio, exist_ok=True)
+    for gen in cargar_reglas_fenotipo():  # la carga de las tablas no cuenta en la primera placa
+        indice_fenotipos(gen)
+    try:
+        with ServidorCPIC(latencia) as servidor:
+            for muestras in tamanos:
+                ruta = os.path.join(directorio, f"placa_{muestras}.csv")
+                inicio = time.perf_counter()
+                generar_placa(ruta, muestras, tasa_indeterminados, semilla)
+                print(f"{muestras} muestras: placa generada en {time.perf_counter() - inicio:.2f} s", file=sys.stderr)
+                for medida in medir_placa(ruta, servidor, memoria, max_informes):
+                    informe["medidas"].append(dict(medida, muestras=muestras))
+                    pico = "" if medida["pico_memoria_mb"] is None else f", pico {medida['pico_memoria_mb']:.1f} MB"
+                    print(f"  {medida['etapa']:<32}{medida['segundos']:>10.3f} s{pico}", file=sys.stderr)
+    finally:
+        if temporal is not None:
+            temporal.cleanup()
+    return informe
+
+
+def comparar(anterior, actual, umbral=0.1):
+    """
+    Compara dos resultados de ``ejecutar`` etapa a etapa.
+
+    Args:
+        anterior (dict): Resultado de referencia.
+        actual (dict): Resultado nuevo.
+        umbral (float): Variación relativa a partir de la cual se marca una etapa.
+
+    Returns:
+        list: (muestras, etapa, segundos antes, segundos ahora, cociente, marca) por cada medida común.
+    """
+    previas = {(m["muestras"], m["etapa"]): m for m in anterior["medidas"]}
+    filas = []
+    for medida in actual["medidas"]:
+        previa = previas.get((medida["muestras"], medida["etapa"]))
+        if previa is None or not previa["segundos"]:
+            continue
+        cociente = medida["segundos"] / previa["segundos"]
+        marca = "peor" if cociente > 1 + umbral else "mejor" if cociente < 1 - umbral else ""
+        filas.append((medida["muestras"], medida["etapa"], previa["segundos"], medida["segundos"], cociente, marca))
+    return filas
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Mide el rendimiento del análisis con placas sintéticas")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=list(TAMANOS), help="Pacientes por placa")
+    parser.add_argument("--und", type=float, default=TASA_INDETERMINADOS, help="Fracción de llamadas UND")
+    parser.add_argument("--latencia", type=float, default=LATENCIA_CPIC, help="Latencia del CPIC simulado (s)")
+    parser.add_argument("--informes", type=int, default=MAX_INFORMES, help="PDF generados por placa")
+    parser.add_argument("--sin-memoria", action="store_true", help="No medir memoria (tiempos más fieles)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--placas", help="Directorio donde conservar las placas generadas")
+    parser.add_argument("--salida", "-o", default="benchmark.json", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", nargs=2, metavar=("ANTERIOR", "ACTUAL"),
+                        help="Compara dos archivos de resultados en lugar de medir")
+    args = parser.parse_args(argumentos)
+
+    if args.comparar:
+        with open(args.comparar[0], encoding="utf-8") as a, open(args.comparar[1], encoding="utf-8") as b:
+            filas = comparar(json.load(a), json.load(b))
+        for muestras, etapa, antes, ahora, cociente, marca in filas:
+            print(f"{muestras:>9} {etapa:<32}{antes:>10.3f} s{ahora:>10.3f} s  x{cociente:.2f} {marca}")
+        return 0
+
+    informe = ejecutar(args.tamanos, args.und, args.latencia, not args.sin_memoria, args.informes,
+                       args.placas, args.semilla)
+    with open(args.salida, "w", encoding="utf-8") as archivo:
+        json.dump(informe, archivo, ensure_ascii=False, indent=2)
+    print(f"Resultados en {args.salida}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
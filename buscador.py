@@ -0,0 +1,111 @@
+"""
+Índice de búsqueda en memoria sobre los pacientes de una cohorte.
+
+Se construye una vez por cohorte a partir de sus arrays de códigos (sin
+recorrer los diccionarios por paciente) y guarda, por cada paciente, el
+código, el nombre del formulario, los fenotipos de cada gen, si alguno es
+accionable y si tiene los datos pendientes. Las búsquedas y los filtros son
+operaciones vectorizadas que devuelven posiciones; la interfaz solo
+construye la página que va a mostrar.
+"""
+import numpy as np
+import pandas as pd
+
+from cohorte import AUSENTE
+from farmacogenetica import FENOTIPO_INDETERMINADO
+
+
+# Fenotipos que no requieren cambiar la prescripción
+FENOTIPOS_NO_ACCIONABLES = ("Normal Metabolizer", FENOTIPO_INDETERMINADO[1])
+
+TAMANO_PAGINA = 25
+
+
+class IndicePacientes:
+    """
+    Índice de una cohorte para buscar, filtrar y paginar pacientes.
+
+    Args:
+        cohorte (Cohorte): Resultados de la carga.
+        pacientes_data (dict): Datos del formulario por paciente.
+    """
+    def __init__(self, cohorte, pacientes_data):
+        self.cohorte = cohorte
+        self.pacientes = np.array([str(p) for p in cohorte.pacientes], dtype=object)
+        self.nombres = np.full(len(self.pacientes), "", dtype=object)
+        self.con_datos = np.zeros(len(self.pacientes), dtype=bool)
+        self.fenotipos = {}
+        self.accionable = np.zeros(len(self.pacientes), dtype=bool)
+        # Se añade un valor al final de cada tabla: es el que toma el código AUSENTE (-1)
+        fenotipos = np.array([r[1] if len(r) > 1 else "" for r in cohorte.resultados.valores] + [""], dtype=object)
+        for gen in cohorte.genes:
+            codigos = cohorte.codigos_resultado[gen]
+            self.fenotipos[gen] = fenotipos[codigos]
+            self.accionable |= (codigos != AUSENTE) & ~np.isin(self.fenotipos[gen], FENOTIPOS_NO_ACCIONABLES + ("",))
+        self._posiciones = {paciente: posicion for posicion, paciente in enumerate(self.pacientes)}
+        self._texto_fenotipos = pd.Series(self.pacientes).str.lower()
+        for gen in self.fenotipos:
+            self._texto_fenotipos += " " + pd.Series(self.fenotipos[gen]).str.lower()
+        for paciente, datos in pacientes_data.items():
+            self.actualizar_datos(paciente, datos)
+
+    def __len__(self):
+        return len(self.pacientes)
+
+    def actualizar_datos(self, paciente, datos):
+        """
+        Refleja en el índice los datos guardados de un paciente (sin reconstruirlo).
+        """
+        posicion = self._posiciones.get(str(paciente))
+        if posicion is not None:
+            self.nombres[posicion] = datos.get('nombre', '') or ''
+            self.con_datos[posicion] = True
+
+    def buscar(self, texto="", solo_accionables=False, solo_pendientes=False):
+        """
+        Devuelve las posiciones de los pacientes que cumplen la búsqueda y los filtros.
+
+        Args:
+            texto (str): Fragmento del código, del nombre o de un fenotipo (sin distinguir mayúsculas).
+            solo_accionables (bool): Solo pacientes con algún fenotipo accionable.
+            solo_pendientes (bool): Solo pacientes sin datos del formulario.
+
+        Returns:
+            numpy.ndarray: Posiciones en la cohorte, en su orden original.
+        """
+        seleccion = np.ones(len(self), dtype=bool)
+        if solo_accionables:
+            seleccion &= self.accionable
+        if solo_pendientes:
+            seleccion &= ~self.con_datos
+        texto = texto.strip().lower()
+        if texto:
+            seleccion &= (self._texto_fenotipos.str.contains(texto, regex=False).to_numpy()
+                          | pd.Series(self.nombres).str.lower().str.contains(texto, regex=False).to_numpy())
+        return np.flatnonzero(seleccion)
+
+    def pagina(self, posiciones, numero, tamano=TAMANO_PAGINA):
+        """
+        Construye la tabla de una página de resultados.
+
+        Args:
+            posiciones (numpy.ndarray): Resultado de ``buscar``.
+            numero (int): Página, empezando en 1.
+            tamano (int): Pacientes por página.
+
+        Returns:
+            pandas.DataFrame: Paciente, Nombre, un fenotipo por gen y Estado.
+        """
+        posiciones = posiciones[(numero - 1) * tamano:numero * tamano]
+        tabla = pd.DataFrame({"Paciente": self.pacientes[posiciones], "Nombre": self.nombres[posiciones]})
+        for gen, fenotipos in self.fenotipos.items():
+            tabla[gen] = fenotipos[posiciones]
+        tabla["Estado"] = np.where(self.con_datos[posiciones], "✅ Completado", "⏳ Pendiente")
+        return tabla
+
+
+def paginas(total, tamano=TAMANO_PAGINA):
+    """
+    Número de páginas necesarias para ``total`` pacientes (al menos una).
+    """
+    return max(1, -(-total // tamano))
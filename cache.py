@@ -0,0 +1,259 @@
+"""
+Cachés en memoria compartidas por todo el proceso.
+
+Todas las sesiones de Streamlit se ejecutan en el mismo proceso, así que una
+caché a nivel de módulo es común a todos los usuarios. Las consultas con
+``obtener_o_calcular`` y ``obtener_o_calcular_lote`` son *single-flight*: si
+varias sesiones piden a la vez una clave que falta, solo una la calcula y las
+demás esperan su resultado en lugar de repetir la consulta.
+
+``CACHE_REFERENCIA`` guarda los datos de referencia (tablas de variantes, de
+diplotipos, reglas de fenotipo, imágenes) de las funciones decoradas con
+``memoizar``.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from metricas import REGISTRO
+
+
+class _Vuelo:
+    # Cálculo en curso de una clave: quienes la piden a la vez esperan a ``listo``
+    def __init__(self):
+        self.listo = threading.Event()
+        self.valor = None
+        self.error = None
+
+
+class CacheTTL:
+    """
+    Caché LRU con caducidad por entrada, límites de tamaño y contadores de aciertos y fallos.
+
+    Args:
+        max_entradas (int): Número máximo de claves; al superarlo se expulsa la menos usada.
+        ttl (float): Segundos que una entrada se considera válida (None = sin caducidad).
+        max_peso (float): Límite de la suma de ``peso(valor)`` de las entradas (None = sin límite).
+        peso (callable): Estima el tamaño de un valor (por defecto, 1 por entrada).
+    """
+    def __init__(self, max_entradas=1024, ttl=3600.0, max_peso=None, peso=None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.max_peso = max_peso
+        self.peso = peso or (lambda valor: 1)
+        self.aciertos = 0
+        self.fallos = 0
+        self.esperas = 0       # fallos resueltos esperando el cálculo de otro hilo
+        self.expulsiones = 0
+        self.caducadas = 0     # valores caducados servidos con obtener_caducado
+        self._datos = OrderedDict()  # clave -> (instante de carga, valor, peso)
+        self._peso_total = 0
+        self._vuelos = {}  # clave -> _Vuelo
+        self._cerrojo = threading.Lock()
+
+    _AUSENTE = object()
+
+    def obtener(self, clave, defecto=None):
+        """
+        Devuelve el valor guardado para la clave, o ``defecto`` si no está o ha caducado.
+        """
+        with self._cerrojo:
+            valor = self._buscar(clave)
+            if valor is self._AUSENTE:
+                self.fallos += 1
+                return defecto
+            self.aciertos += 1
+            return valor
+
+    def obtener_caducado(self, clave, defecto=None):
+        """
+        Devuelve el último valor guardado para la clave aunque haya caducado, o ``defecto``.
+
+        Las entradas caducadas no se borran al consultarlas (solo al expulsarlas
+        por tamaño o con ``purgar``), así que sirven de respaldo cuando no se
+        puede obtener un valor actualizado a tiempo.
+        """
+        with self._cerrojo:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return defecto
+            self.caducadas += self._caducada(entrada[0])
+            return entrada[1]
+
+    def guardar(self, clave, valor):
+        with self._cerrojo:
+            self._guardar(clave, valor)
+
+    def obtener_o_calcular(self, clave, calcular):
+        """
+        Devuelve el valor de la clave, calculándolo con ``calcular()`` si falta.
+
+        Si otro hilo ya está calculando la misma clave, se espera a su resultado
+        (o a su excepción) en lugar de calcularla otra vez.
+        """
+        with self._cerrojo:
+            valor = self._buscar(clave)
+            if valor is not self._AUSENTE:
+                self.aciertos += 1
+                return valor
+            self.fallos += 1
+            vuelo = self._vuelos.get(clave)
+            propio = vuelo is None
+            if propio:
+                vuelo = self._vuelos[clave] = _Vuelo()
+            else:
+                self.esperas += 1
+        if propio:
+            self._calcular(vuelo, clave, calcular)
+        else:
+            vuelo.listo.wait()
+        if vuelo.error is not None:
+            raise vuelo.error
+        return vuelo.valor
+
+    def obtener_o_calcular_lote(self, claves, calcular_lote):
+        """
+        Versión por lotes de ``obtener_o_calcular``.
+
+        Args:
+            claves (iterable): Claves pedidas (las repetidas cuentan una vez).
+            calcular_lote (callable): Recibe la lista de claves que faltan y no está
+                calculando ningún otro hilo, y devuelve {clave: valor} para todas ellas.
+
+        Returns:
+            dict: {clave: valor} para cada clave distinta.
+        """
+        respuestas, propios, ajenos = {}, {}, {}
+        with self._cerrojo:
+            for clave in set(claves):
+                valor = self._buscar(clave)
+                if valor is not self._AUSENTE:
+                    self.aciertos += 1
+                    respuestas[clave] = valor
+                    continue
+                self.fallos += 1
+                if clave in self._vuelos:
+                    self.esperas += 1
+                    ajenos[clave] = self._vuelos[clave]
+                else:
+                    propios[clave] = self._vuelos[clave] = _Vuelo()
+        if propios:
+            try:
+                calculados = calcular_lote(list(propios))
+            except BaseException as e:
+                for clave, vuelo in propios.items():
+                    self._publicar(vuelo, clave, error=e)
+                raise
+            faltan = []
+            for clave, vuelo in propios.items():
+                if clave in calculados:
+                    self._publicar(vuelo, clave, calculados[clave])
+                    respuestas[clave] = calculados[clave]
+                else:
+                    faltan.append(clave)
+                    self._publicar(vuelo, clave, error=KeyError(clave))
+            if faltan:
+                raise KeyError(faltan[0])
+        for clave, vuelo in ajenos.items():
+            vuelo.listo.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            respuestas[clave] = vuelo.valor
+        return respuestas
+
+    def vaciar(self):
+        with self._cerrojo:
+            self._datos.clear()
+            self._peso_total = 0
+
+    def purgar(self):
+        """
+        Elimina las entradas caducadas.
+
+        Returns:
+            int: Número de entradas eliminadas.
+        """
+        with self._cerrojo:
+            caducadas = [clave for clave, (instante, _, _) in self._datos.items() if self._caducada(instante)]
+            for clave in caducadas:
+                self._peso_total -= self._datos.pop(clave)[2]
+            return len(caducadas)
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: Aciertos, fallos, esperas a otro cálculo, expulsiones, valores caducados
+            servidos y número de entradas actuales.
+        """
+        with self._cerrojo:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "esperas": self.esperas,
+                    "expulsiones": self.expulsiones, "caducadas": self.caducadas, "entradas": len(self._datos)}
+
+    def _buscar(self, clave):
+        # Con el cerrojo tomado: valor vigente de la clave o _AUSENTE (y la marca como usada).
+        # Una entrada caducada cuenta como ausente, pero se conserva para obtener_caducado
+        entrada = self._datos.get(clave, self._AUSENTE)
+        if entrada is self._AUSENTE or self._caducada(entrada[0]):
+            return self._AUSENTE
+        self._datos.move_to_end(clave)
+        return entrada[1]
+
+    def _guardar(self, clave, valor):
+        # Con el cerrojo tomado: guarda y expulsa las menos usadas hasta cumplir los límites
+        anterior = self._datos.pop(clave, None)
+        if anterior is not None:
+            self._peso_total -= anterior[2]
+        peso = self.peso(valor)
+        self._datos[clave] = (time.monotonic(), valor, peso)
+        self._peso_total += peso
+        while len(self._datos) > 1 and (len(self._datos) > self.max_entradas
+                                        or (self.max_peso is not None and self._peso_total > self.max_peso)):
+            self._peso_total -= self._datos.popitem(last=False)[1][2]
+            self.expulsiones += 1
+
+    def _calcular(self, vuelo, clave, calcular):
+        try:
+            valor = calcular()
+        except BaseException as e:
+            self._publicar(vuelo, clave, error=e)
+        else:
+            self._publicar(vuelo, clave, valor)
+
+    def _publicar(self, vuelo, clave, valor=None, error=None):
+        # Guarda el valor (los errores no se guardan) y despierta a quienes esperaban la clave
+        with self._cerrojo:
+            if error is None:
+                self._guardar(clave, valor)
+            self._vuelos.pop(clave, None)
+        vuelo.valor, vuelo.error = valor, error
+        vuelo.listo.set()
+
+    def _caducada(self, instante):
+        return self.ttl is not None and time.monotonic() - instante > self.ttl
+
+    def __len__(self):
+        return len(self._datos)
+
+
+# Datos de referencia: pocos, grandes y sin caducidad (cambian solo con el archivo de origen)
+CACHE_REFERENCIA = CacheTTL(max_entradas=512, ttl=None)
+REGISTRO.registrar_cache("referencia", CACHE_REFERENCIA)
+
+
+def memoizar(cache=CACHE_REFERENCIA):
+    """
+    Decorador que guarda el resultado de la función por argumentos en una caché compartida.
+
+    Sustituye a ``functools.lru_cache`` cuando varias sesiones pueden pedir el
+    mismo valor a la vez: el cálculo es single-flight y la caché tiene límites.
+    """
+    def decorador(funcion):
+        nombre = f"{funcion.__module__}.{funcion.__qualname__}"
+
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            clave = (nombre, args, tuple(sorted(kwargs.items())))
+            return cache.obtener_o_calcular(clave, lambda: funcion(*args, **kwargs))
+        return envoltura
+    return decorador
@@ -0,0 +1,131 @@
+"""
+Cliente HTTP compartido para las APIs de CPIC y PharmGKB.
+
+Todas las consultas del proceso usan la misma sesión de ``requests``:
+
+- Conexiones persistentes (keep-alive) reutilizadas desde un pool.
+- Tiempo de espera en cada petición.
+- Reintentos con espera exponencial ante errores de red, 429 y 5xx.
+- Limitador de tasa en el cliente para no saturar la API.
+- Un pool de hilos acotado para lanzar en paralelo consultas independientes.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from metricas import REGISTRO
+
+
+MAX_CONCURRENCIA = 8
+TIEMPO_ESPERA = (3.05, 15)      # (conexión, lectura) en segundos
+REINTENTOS = 3
+ESPERA_BASE_REINTENTO = 0.5     # 0.5 s, 1 s, 2 s...
+PETICIONES_POR_SEGUNDO = 10
+
+
+class LimitadorTasa:
+    """
+    Cubeta de fichas: permite ráfagas de hasta ``capacidad`` peticiones y una
+    media de ``tasa`` peticiones por segundo.
+    """
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = tasa
+        self.capacidad = capacidad or tasa
+        self._fichas = self.capacidad
+        self._ultimo = time.monotonic()
+        self._cerrojo = threading.Lock()
+
+    def esperar(self):
+        """
+        Bloquea hasta que haya una ficha disponible y la consume.
+        """
+        while True:
+            with self._cerrojo:
+                ahora = time.monotonic()
+                self._fichas = min(self.capacidad, self._fichas + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) / self.tasa
+            time.sleep(espera)
+
+
+class ClienteHTTP:
+    """
+    Sesión HTTP con pool de conexiones, reintentos, límite de tasa y concurrencia acotada.
+    """
+    def __init__(self, max_concurrencia=MAX_CONCURRENCIA, tiempo_espera=TIEMPO_ESPERA,
+                 reintentos=REINTENTOS, peticiones_por_segundo=PETICIONES_POR_SEGUNDO):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.tiempo_espera = tiempo_espera
+        self.sesion = requests.Session()
+        reintento = Retry(total=reintentos, backoff_factor=ESPERA_BASE_REINTENTO,
+                          status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(["GET"]),
+                          respect_retry_after_header=True)
+        adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=max_concurrencia, max_retries=reintento)
+        self.sesion.mount("https://", adaptador)
+        self.sesion.mount("http://", adaptador)
+        self._limitador = LimitadorTasa(peticiones_por_segundo)
+        self._hilos = ThreadPoolExecutor(max_workers=max_concurrencia, thread_name_prefix="cliente-http")
+
+    def get_json(self, url, params=None, tiempo_espera=None, aceptar_error=False):
+        """
+        Realiza una petición GET y devuelve el JSON de la respuesta.
+
+        Con ``aceptar_error`` una respuesta de error con cuerpo JSON se devuelve igual que
+        una correcta (PharmGKB responde así cuando no hay resultados: ``{"status": ...}``).
+
+        Raises:
+            requests.HTTPError: Si la respuesta final (tras los reintentos) es un error
+                (y, con ``aceptar_error``, su cuerpo no es JSON).
+        """
+        self._limitador.esperar()
+        inicio = time.perf_counter()
+        codigo = None
+        try:
+            response = self.sesion.get(url, params=params, timeout=tiempo_espera or self.tiempo_espera)
+            codigo = response.status_code
+        except Exception as e:
+            codigo = type(e).__name__
+            raise
+        finally:
+            # La latencia incluye los reintentos, pero no la espera del limitador
+            REGISTRO.registrar_peticion(urlparse(url).netloc, time.perf_counter() - inicio, codigo)
+        if aceptar_error and not response.ok:
+            try:
+                return response.json()
+            except ValueError:
+                pass
+        response.raise_for_status()
+        return response.json()
+
+    def mapear(self, funcion, elementos):
+        """
+        Aplica ``funcion`` a cada elemento en el pool de hilos y devuelve los resultados en orden.
+        """
+        elementos = list(elementos)
+        # Desde un hilo del propio pool se ejecuta en serie para no bloquearlo esperando a sí mismo
+        if len(elementos) <= 1 or threading.current_thread().name.startswith("cliente-http"):
+            return [funcion(elemento) for elemento in elementos]
+        return list(self._hilos.map(funcion, elementos))
+
+
+_cliente = None
+_cerrojo_cliente = threading.Lock()
+
+
+def cliente():
+    """
+    Devuelve el cliente HTTP compartido por todo el proceso (se crea la primera vez).
+    """
+    global _cliente
+    if _cliente is None:
+        with _cerrojo_cliente:
+            if _cliente is None:
+                _cliente = ClienteHTTP()
+    return _cliente
@@ -0,0 +1,254 @@
+"""
+Representación compacta de los resultados de una cohorte.
+
+En lugar de un diccionario por paciente con listas de cadenas por gen, la
+cohorte guarda:
+
+- Un índice con los códigos de los pacientes.
+- Por cada gen, un array (n, 2) int16 con los códigos de los dos alelos y un
+  array int16 con el código del resultado (score, fenotipo y recomendaciones).
+- Tablas internadas con los valores distintos de alelos y de resultados, que
+  se comparten entre todos los pacientes ('*1', 'Normal Metabolizer'...).
+
+Para el resto de la aplicación se comporta como el diccionario de siempre:
+``cohorte[paciente]`` devuelve ``{gen: [genotipo, score, fenotipo, recomendacion...]}``
+y admite ``keys()``, ``items()``, ``get()``, ``len()`` e ``in``.
+"""
+import threading
+from collections.abc import ItemsView, Mapping
+
+import numpy as np
+import pandas as pd
+
+
+AUSENTE = -1  # código de un gen sin resultado para un paciente
+
+_cerrojo_internado = threading.Lock()
+
+
+class Internado:
+    """
+    Tabla de valores distintos: cada valor se guarda una vez y se referencia por su código.
+    """
+    def __init__(self, valores=()):
+        self.valores = []
+        self._codigos = {}
+        for valor in valores:
+            self.codigo(valor)
+
+    def codigo(self, valor):
+        """
+        Devuelve el código del valor, añadiéndolo a la tabla si no estaba.
+
+        Las tablas de la cohorte de la sesión se amplían desde los hilos de los
+        análisis en segundo plano: los valores nuevos se añaden con el cerrojo
+        tomado, y a la lista antes que al índice, para que quien lea un código
+        encuentre siempre su valor.
+        """
+        codigo = self._codigos.get(valor)
+        if codigo is None:
+            with _cerrojo_internado:
+                codigo = self._codigos.get(valor)
+                if codigo is None:
+                    self.valores.append(valor)
+                    codigo = self._codigos[valor] = len(self.valores) - 1
+        return codigo
+
+    def __getitem__(self, codigo):
+        return self.valores[codigo]
+
+    def __len__(self):
+        return len(self.valores)
+
+
+class _Filas(ItemsView):
+    # Recorre los pacientes por posición; la vista de cada combinación distinta de
+    # códigos se formatea una vez y a cada paciente se le entrega una copia
+    def __iter__(self):
+        cohorte = self._mapping
+        if not len(cohorte):
+            return
+        codigos = np.hstack([cohorte.codigos_alelos[gen] for gen in cohorte.genes]
+                            + [cohorte.codigos_resultado[gen][:, None] for gen in cohorte.genes])
+        _, primeras, inversa = np.unique(codigos, axis=0, return_index=True, return_inverse=True)
+        plantillas = [cohorte.fila(posicion) for posicion in primeras]
+        for paciente, k in zip(cohorte.pacientes, inversa.ravel().tolist()):
+            yield paciente, {gen: list(info) for gen, info in plantillas[k].items()}
+
+
+class Cohorte(Mapping):
+    """
+    Resultados de todos los pacientes de una placa, guardados en arrays por gen.
+
+    Los pacientes son únicos: si un código se repite, como al asignar en un
+    diccionario, el paciente conserva la posición de su primera aparición y
+    toma los códigos de la última.
+
+    Args:
+        pacientes (iterable): Códigos de los pacientes, en orden.
+        alelos (Internado): Tabla de alelos compartida por todos los genes.
+        resultados (Internado): Tabla de tuplas (score, fenotipo, recomendaciones...).
+        codigos_alelos (dict): {gen: array (n, 2) int16 con los alelos de cada paciente}.
+        codigos_resultado (dict): {gen: array (n,) int16 con el resultado de cada paciente}.
+    """
+    def __init__(self, pacientes, alelos, resultados, codigos_alelos, codigos_resultado):
+        pacientes = pd.Index(pacientes)
+        if not pacientes.is_unique:
+            # Última fila de cada paciente, en el orden de su primera aparición
+            ultimas = pd.Series(np.arange(len(pacientes)), index=pacientes).groupby(level=0, sort=False).last()
+            pacientes, filas = ultimas.index, ultimas.to_numpy()
+            codigos_alelos = {gen: codigos[filas] for gen, codigos in codigos_alelos.items()}
+            codigos_resultado = {gen: codigos[filas] for gen, codigos in codigos_resultado.items()}
+        self.pacientes = pacientes
+        self.alelos = alelos
+        self.resultados = resultados
+        self.codigos_alelos = codigos_alelos
+        self.codigos_resultado = codigos_resultado
+
+    @property
+    def genes(self):
+        return list(self.codigos_alelos)
+
+    def __len__(self):
+        return len(self.pacientes)
+
+    def __iter__(self):
+        return iter(self.pacientes)
+
+    def __contains__(self, paciente):
+        return paciente in self.pacientes
+
+    def __getitem__(self, paciente):
+        if paciente not in self.pacientes:
+            raise KeyError(paciente)
+        return self.fila(self.pacientes.get_loc(paciente))
+
+    def items(self):
+        return _Filas(self)
+
+    def fila(self, posicion):
+        """
+        Devuelve la vista {gen: [genotipo, score, fenotipo, recomendacion...]} del paciente en esa posición.
+        """
+        genes = {}
+        for gen, alelos in self.codigos_alelos.items():
+            materno, paterno = alelos[posicion]
+            if materno == AUSENTE:
+                continue
+            genes[gen] = [f"{self.alelos[materno]}/{self.alelos[paterno]}"]
+            codigo = self.codigos_resultado[gen][posicion]
+            if codigo != AUSENTE:
+                genes[gen].extend(self.resultados[codigo])
+        return genes
+
+    def tabla(self, gen):
+        """
+        Devuelve un DataFrame con una fila por paciente para un gen (útil para filtrar y resumir).
+
+        Returns:
+            pandas.DataFrame: Columnas Paciente, Genotipo, Score, Fenotipo y Recomendacion.
+        """
+        # Se añade un valor vacío al final de cada tabla: es el que toma el código AUSENTE (-1)
+        alelos = np.array(self.alelos.valores + [""], dtype=object)
+        codigos = self.codigos_alelos[gen]
+        genotipos = np.char.add(np.char.add(alelos[codigos[:, 0]].astype(str), "/"), alelos[codigos[:, 1]].astype(str))
+        # Una fila por resultado distinto; los pacientes la referencian por su código
+        distintos = pd.DataFrame(
+            [(r[0] if len(r) > 0 else None, r[1] if len(r) > 1 else None, " ".join(str(x) for x in r[2:]))
+             for r in self.resultados.valores] + [(None, None, "")],
+            columns=["Score", "Fenotipo", "Recomendacion"])
+        tabla = distintos.iloc[self.codigos_resultado[gen]].reset_index(drop=True)
+        tabla.insert(0, "Genotipo", np.where(codigos[:, 0] == AUSENTE, None, genotipos))
+        tabla.insert(0, "Paciente", self.pacientes)
+        return tabla
+
+    def repartir(self, pacientes, posiciones):
+        """
+        Crea una cohorte en la que cada paciente recibe la fila de esta cohorte indicada en ``posiciones``.
+
+        Sirve para calcular una vez cada firma de llamadas distinta y copiar después
+        sus códigos a todos los pacientes que la comparten.
+        """
+        return Cohorte(pacientes, self.alelos, self.resultados,
+                       {gen: codigos[posiciones] for gen, codigos in self.codigos_alelos.items()},
+                       {gen: codigos[posiciones] for gen, codigos in self.codigos_resultado.items()})
+
+    def actualizar(self, otra):
+        """
+        Devuelve una cohorte con los pacientes de ``otra`` añadidos o sustituidos.
+
+        Los pacientes que ya estaban conservan su posición y toman los códigos de
+        ``otra``; los nuevos se añaden al final. Ambas cohortes deben compartir las
+        tablas internadas.
+        """
+        posiciones = self.pacientes.get_indexer(otra.pacientes)
+        existentes = posiciones >= 0
+        genes = list(dict.fromkeys(self.genes + otra.genes))
+
+        def fusionar(atributo, forma):
+            fusionados = {}
+            for gen in genes:
+                propios = getattr(self, atributo).get(gen)
+                propios = (np.full((len(self),) + forma, AUSENTE, dtype=np.int16) if propios is None
+                           else propios.copy())
+                ajenos = getattr(otra, atributo).get(gen)
+                propios[posiciones[existentes]] = AUSENTE if ajenos is None else ajenos[existentes]
+                fusionados[gen] = propios
+            return fusionados
+        base = Cohorte(self.pacientes, self.alelos, self.resultados,
+                       fusionar("codigos_alelos", (2,)), fusionar("codigos_resultado", ()))
+        nuevos = np.flatnonzero(~existentes)
+        if not len(nuevos):
+            return base
+        return Cohorte.concatenar([base, otra.repartir(otra.pacientes[nuevos], nuevos)])
+
+    def memoria(self):
+        """
+        Returns:
+            int: Bytes aproximados que ocupan los arrays, el índice y las tablas internadas.
+        """
+        arrays = sum(a.nbytes for a in self.codigos_alelos.values()) + sum(a.nbytes for a in self.codigos_resultado.values())
+        return arrays + self.pacientes.memory_usage(deep=True) + len(self.alelos) * 64 + len(self.resultados) * 256
+
+    @classmethod
+    def desde_resultados(cls, resultado, alelos=None, resultados=None):
+        """
+        Construye la cohorte a partir del diccionario {paciente: {gen: [genotipo, score, fenotipo, ...]}}.
+
+        Args:
+            resultado (dict): Resultados tal y como los devuelve recomendacionClinica.
+            alelos (Internado): Tabla de alelos a reutilizar (por defecto, una nueva).
+            resultados (Internado): Tabla de resultados a reutilizar (por defecto, una nueva).
+        """
+        alelos = Internado() if alelos is None else alelos
+        resultados = Internado() if resultados is None else resultados
+        pacientes = list(resultado)
+        genes = list(dict.fromkeys(gen for genes in resultado.values() for gen in genes))
+        codigos_alelos = {gen: np.full((len(pacientes), 2), AUSENTE, dtype=np.int16) for gen in genes}
+        codigos_resultado = {gen: np.full(len(pacientes), AUSENTE, dtype=np.int16) for gen in genes}
+        for posicion, paciente in enumerate(pacientes):
+            for gen, info in resultado[paciente].items():
+                materno, _, paterno = str(info[0]).partition("/")
+                codigos_alelos[gen][posicion] = (alelos.codigo(materno), alelos.codigo(paterno))
+                codigos_resultado[gen][posicion] = resultados.codigo(tuple(info[1:]))
+        return cls(pacientes, alelos, resultados, codigos_alelos, codigos_resultado)
+
+    @classmethod
+    def concatenar(cls, partes):
+        """
+        Une varias cohortes (p. ej. los lotes de un mismo archivo) en una sola.
+
+        Las partes deben compartir las tablas internadas (ver ``flujo.lotes_resultado``).
+        """
+        partes = list(partes)
+        if not partes:
+            return cls([], Internado(), Internado(), {}, {})
+        genes = list(dict.fromkeys(gen for parte in partes for gen in parte.genes))
+
+        def unir(atributo, forma):
+            return {gen: np.concatenate([getattr(p, atributo)[gen] if gen in getattr(p, atributo)
+                                         else np.full((len(p),) + forma, AUSENTE, dtype=np.int16) for p in partes])
+                    for gen in genes}
+        pacientes = partes[0].pacientes.append([p.pacientes for p in partes[1:]]) if len(partes) > 1 else partes[0].pacientes
+        return cls(pacientes, partes[0].alelos, partes[0].resultados,
+                   unir("codigos_alelos", (2,)), unir("codigos_resultado", ()))
@@ -0,0 +1,525 @@
+"""
+Acceso a la base de conocimiento de CPIC (api.cpicpgx.org).
+
+Todas las consultas a CPIC pasan por un *resolver* intercambiable:
+
+- ``ResolverRemoto`` consulta la API en línea.
+- ``ResolverLocal`` responde desde una copia local en SQLite con las tablas
+  allele, drug, diplotype, recommendation y guideline, indexadas por las
+  columnas que usa la aplicación.
+
+Las respuestas de ambos tienen la misma forma que el JSON de la API, así que
+las funciones de la aplicación no necesitan saber de dónde vienen los datos.
+
+Sincronización (línea de comandos)::
+
+    python cpic.py importar volcado.json        # carga un volcado {tabla: [filas]}
+    python cpic.py sincronizar --genes CYP2D6 DPYD UGT1A1   # descarga desde la API
+"""
+import argparse
+import functools
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as PlazoAgotado
+
+from cache import CacheTTL
+from cliente_http import cliente
+from metricas import REGISTRO, instrumentar
+
+
+URL_API = "https://api.cpicpgx.org/v1/"
+RUTA_BASE_LOCAL = os.environ.get("CPIC_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cpic.sqlite"))
+
+# Recomendaciones ya resueltas, por (drugid, gen, valor de la clave de búsqueda); compartida por
+# todas las sesiones y limitada también por el número total de filas de recomendación guardadas
+CACHE_RECOMENDACIONES = CacheTTL(max_entradas=1024, ttl=6 * 3600, max_peso=50000, peso=len)
+REGISTRO.registrar_cache("recomendaciones_cpic", CACHE_RECOMENDACIONES)
+
+# Presupuesto de tiempo (segundos) de las consultas de recomendaciones de cada lote (CPIC_PLAZO).
+# Si se agota, se sirven las últimas recomendaciones conocidas y la consulta sigue en segundo plano.
+PLAZO_LOTE = float(os.environ.get("CPIC_PLAZO", "10"))
+
+# Máximo de claves de recomendación consultándose a la vez (también las que siguen en segundo
+# plano tras agotar el plazo de su lote); las que no caben se sirven caducadas sin consultarlas
+MAX_REVALIDANDO = int(os.environ.get("CPIC_MAX_REVALIDANDO", "256"))
+
+# Panel de genes cuyos alelos se precargan al arrancar (CPIC_PANEL="GEN1,GEN2,...")
+PANEL_GENES = tuple(os.environ.get("CPIC_PANEL", "CYP2D6,CYP2C19,CYP2C9,DPYD,UGT1A1,TPMT,NUDT15,SLCO1B1").split(","))
+INTERVALO_REFRESCO_ALELOS = 24 * 3600
+
+TABLAS = ("allele", "drug", "diplotype", "recommendation", "guideline")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS allele (genesymbol TEXT, name TEXT, datos TEXT);
+CREATE INDEX IF NOT EXISTS allele_gen ON allele (genesymbol);
+
+CREATE TABLE IF NOT EXISTS drug (drugid TEXT PRIMARY KEY, name TEXT, guidelineid INTEGER, datos TEXT);
+CREATE INDEX IF NOT EXISTS drug_nombre ON drug (name);
+
+CREATE TABLE IF NOT EXISTS diplotype (genesymbol TEXT, diplotype TEXT, datos TEXT);
+CREATE INDEX IF NOT EXISTS diplotype_clave ON diplotype (genesymbol, diplotype);
+
+CREATE TABLE IF NOT EXISTS recommendation (id INTEGER, drugid TEXT, guidelineid INTEGER, lookupkey TEXT, datos TEXT);
+CREATE INDEX IF NOT EXISTS recommendation_farmaco ON recommendation (drugid);
+
+CREATE TABLE IF NOT EXISTS guideline (id INTEGER PRIMARY KEY, name TEXT, url TEXT, datos TEXT);
+"""
+
+
+class ResolverRemoto:
+    """
+    Resuelve las consultas contra la API en línea de CPIC.
+    """
+    def __init__(self, url_api=URL_API):
+        self.url_api = url_api
+
+    def consultar(self, tabla, parametros):
+        return cliente().get_json(self.url_api + tabla, params=parametros)
+
+    def alelos(self, gen):
+        return self.consultar("allele", {"genesymbol": f"eq.{gen}"})
+
+    def farmacos(self, nombre):
+        return self.consultar("drug", {"name": f"eq.{nombre}"})
+
+    def farmacos_con_guia(self, nombre):
+        return self.consultar("drug", {"name": f"eq.{nombre}", "select": "drugid,name,guideline_for_drug(*)"})
+
+    def diplotipos(self, gen, diplotipo):
+        return self.consultar("diplotype", {"genesymbol": f"eq.{gen}", "diplotype": f"eq.{diplotipo}"})
+
+    def recomendaciones(self, drugid, gen, valor):
+        return self.consultar("recommendation", {
+            "select": "drug(name),guideline(name),*",
+            "drugid": f"eq.{drugid}",
+            "lookupkey": "cs." + json.dumps({gen: valor}, ensure_ascii=False, separators=(",", ":")),
+        })
+
+    # Consultas por lote: una sola petición con filtros in.(...) de PostgREST
+
+    def diplotipos_en_lote(self, pares):
+        resultado = {par: [] for par in pares}
+        if pares:
+            filas = self.consultar("diplotype", {"genesymbol": filtro_in(gen for gen, _ in pares),
+                                                 "diplotype": filtro_in(diplotipo for _, diplotipo in pares)})
+            for fila in filas:  # el filtro cruza genes y diplotipos: se descartan los pares no pedidos
+                par = (fila.get("genesymbol"), fila.get("diplotype"))
+                if par in resultado:
+                    resultado[par].append(fila)
+        return resultado
+
+    def farmacos_con_guia_en_lote(self, nombres):
+        resultado = {nombre: [] for nombre in nombres}
+        if nombres:
+            for fila in self.consultar("drug", {"name": filtro_in(nombres), "select": "drugid,name,guideline_for_drug(*)"}):
+                resultado.setdefault(fila["name"], []).append(fila)
+        return resultado
+
+    def recomendaciones_de_farmacos(self, drugids):
+        if not drugids:
+            return []
+        return self.consultar("recommendation", {"select": "drug(name),guideline(name),*", "drugid": filtro_in(drugids)})
+
+
+class ResolverLocal:
+    """
+    Resuelve las consultas desde la copia local de CPIC en SQLite.
+    """
+    def __init__(self, ruta=RUTA_BASE_LOCAL):
+        self.ruta = ruta
+        self._local = threading.local()  # una conexión por hilo (Streamlit usa varios)
+
+    def conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta)
+            conexion.executescript(ESQUEMA)
+            self._local.conexion = conexion
+        return conexion
+
+    def _filas(self, sql, parametros):
+        return [json.loads(fila[0]) for fila in self.conexion().execute(sql, parametros)]
+
+    def alelos(self, gen):
+        return self._filas("SELECT datos FROM allele WHERE genesymbol = ?", (gen,))
+
+    def farmacos(self, nombre):
+        return self._filas("SELECT datos FROM drug WHERE name = ?", (nombre,))
+
+    def farmacos_con_guia(self, nombre):
+        filas = self.conexion().execute(
+            "SELECT d.drugid, d.name, g.datos FROM drug d LEFT JOIN guideline g ON g.id = d.guidelineid WHERE d.name = ?",
+            (nombre,))
+        return [{"drugid": drugid, "name": name, "guideline_for_drug": json.loads(guia) if guia else None}
+                for drugid, name, guia in filas]
+
+    def diplotipos(self, gen, diplotipo):
+        return self._filas("SELECT datos FROM diplotype WHERE genesymbol = ? AND diplotype = ?", (gen, diplotipo))
+
+    def recomendaciones(self, drugid, gen, valor):
+        return self._recomendaciones("r.drugid = ? AND json_extract(r.lookupkey, ?) = ?", (drugid, '$."' + gen + '"', valor))
+
+    def diplotipos_en_lote(self, pares):
+        return {par: self.diplotipos(*par) for par in pares}
+
+    def farmacos_con_guia_en_lote(self, nombres):
+        return {nombre: self.farmacos_con_guia(nombre) for nombre in nombres}
+
+    def recomendaciones_de_farmacos(self, drugids):
+        drugids = list(drugids)
+        if not drugids:
+            return []
+        return self._recomendaciones(f"r.drugid IN ({', '.join('?' * len(drugids))})", drugids)
+
+    def _recomendaciones(self, condicion, parametros):
+        filas = self.conexion().execute(
+            "SELECT r.datos, d.name, g.name FROM recommendation r "
+            "LEFT JOIN drug d ON d.drugid = r.drugid LEFT JOIN guideline g ON g.id = r.guidelineid "
+            "WHERE " + condicion, parametros)
+        resultado = []
+        for datos, nombre_farmaco, nombre_guia in filas:
+            fila = json.loads(datos)
+            fila["drug"] = {"name": nombre_farmaco}
+            fila["guideline"] = {"name": nombre_guia}
+            resultado.append(fila)
+        return resultado
+
+    def importar(self, volcado):
+        """
+        Reemplaza el contenido de las tablas presentes en el volcado.
+
+        Args:
+            volcado (dict): {tabla: [filas tal y como las devuelve la API]}.
+
+        Returns:
+            dict: Número de filas importadas por tabla.
+        """
+        columnas = {
+            "allele": lambda f: (f.get("genesymbol"), f.get("name")),
+            "drug": lambda f: (f.get("drugid"), f.get("name"), f.get("guidelineid")),
+            "diplotype": lambda f: (f.get("genesymbol"), f.get("diplotype")),
+            "recommendation": lambda f: (f.get("id"), f.get("drugid"), f.get("guidelineid"), json.dumps(f.get("lookupkey") or {})),
+            "guideline": lambda f: (f.get("id"), f.get("name"), f.get("url")),
+        }
+        conexion = self.conexion()
+        importadas = {}
+        with conexion:
+            for tabla, filas in volcado.items():
+                if tabla not in columnas:
+                    continue
+                conexion.execute(f"DELETE FROM {tabla}")
+                valores = [columnas[tabla](fila) + (json.dumps(fila, ensure_ascii=False),) for fila in filas]
+                if valores:
+                    huecos = ", ".join("?" * len(valores[0]))
+                    conexion.executemany(f"INSERT OR REPLACE INTO {tabla} VALUES ({huecos})", valores)
+                importadas[tabla] = len(valores)
+        return importadas
+
+
+def filtro_in(valores):
+    """
+    Construye un filtro ``in.(...)`` de PostgREST con los valores distintos entre comillas.
+
+    Los alelos contienen caracteres reservados ('*', '/', '(', ',', '.'), por eso
+    cada valor va entre comillas dobles con '\\' y '"' escapados.
+    """
+    distintos = sorted({str(valor) for valor in valores})
+    return "in.(" + ",".join('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in distintos) + ")"
+
+
+_resolver = None
+_AUSENTE = object()
+_cerrojo_global = threading.Lock()
+
+
+def resolver():
+    """
+    Devuelve el resolver activo.
+
+    Si no se ha configurado ninguno, se usa la copia local cuando existe el
+    archivo indicado por CPIC_DB (por defecto cpic.sqlite) y la API en otro caso.
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = ResolverLocal() if os.path.exists(RUTA_BASE_LOCAL) else ResolverRemoto()
+    return _resolver
+
+
+def configurar_resolver(nuevo):
+    """
+    Sustituye el resolver activo (p. ej. ResolverLocal('otra.sqlite') o ResolverRemoto()).
+    """
+    global _resolver
+    _resolver = nuevo
+    CACHE_RECOMENDACIONES.vaciar()
+
+
+_revalidacion = None
+_revalidando = set()  # claves con una consulta en curso en los hilos de revalidación
+
+
+def _hilos_revalidacion():
+    # Hilos propios: desde los del cliente HTTP ``mapear`` se ejecutaría en serie
+    global _revalidacion
+    with _cerrojo_global:
+        if _revalidacion is None:
+            _revalidacion = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cpic-revalidacion")
+    return _revalidacion
+
+
+@instrumentar("cpic.recomendaciones_en_lote")
+def recomendaciones_en_lote(claves, plazo=None, caducadas=None):
+    """
+    Resuelve las recomendaciones de un lote completo con un tiempo máximo.
+
+    Las claves repetidas se consultan una sola vez, las ya resueltas se sirven
+    desde CACHE_RECOMENDACIONES y las que otra sesión está consultando en ese
+    momento se esperan en lugar de pedirlas de nuevo a la API.
+
+    Si las consultas que faltan no terminan dentro del plazo, esas claves se
+    responden con el último valor conocido en la caché (aunque haya caducado) o
+    sin recomendación si nunca se obtuvo, y la consulta continúa en segundo
+    plano para actualizar la caché. Mientras tanto, los lotes siguientes no
+    vuelven a consultar esas claves: las sirven también caducadas. Como mucho
+    hay MAX_REVALIDANDO claves consultándose a la vez. Si la consulta falla
+    (ver ``_errores_consulta``) se responde igual que si se hubiera agotado el plazo.
+
+    Args:
+        claves (iterable): Tuplas (drugid, gen, valor), con repeticiones.
+        plazo (float): Segundos como máximo para todo el lote (por defecto, PLAZO_LOTE).
+        caducadas (set): Si se indica, se añaden las claves que no se pudieron actualizar a tiempo.
+
+    Returns:
+        dict: {clave: filas de recomendación} para cada clave distinta.
+    """
+    activo = resolver()
+    claves = set(claves)
+    limite = time.monotonic() + (PLAZO_LOTE if plazo is None else plazo)
+
+    def consultar(pendientes):
+        with _cerrojo_global:
+            nuevas = [clave for clave in pendientes if clave not in _revalidando]
+            nuevas = nuevas[:max(0, MAX_REVALIDANDO - len(_revalidando))]
+            _revalidando.update(nuevas)
+        if not nuevas:
+            raise PlazoAgotado()
+        # Las claves que faltan son independientes: se consultan en paralelo. Si no terminan a
+        # tiempo, la consulta sigue en segundo plano y, cuando termine, actualiza la caché
+        futuro = _hilos_revalidacion().submit(
+            lambda: dict(zip(nuevas, cliente().mapear(lambda clave: activo.recomendaciones(*clave), nuevas))))
+        futuro.add_done_callback(functools.partial(_guardar_revalidadas, nuevas))
+        respuestas = futuro.result(timeout=max(0.0, limite - time.monotonic()))
+        if len(nuevas) < len(pendientes):
+            # Otras claves siguen pendientes de una consulta anterior (o no caben en la cola)
+            for clave, filas in respuestas.items():
+                CACHE_RECOMENDACIONES.guardar(clave, filas)
+            raise PlazoAgotado()
+        return respuestas
+
+    try:
+        return CACHE_RECOMENDACIONES.obtener_o_calcular_lote(claves, consultar)
+    except _errores_consulta():
+        respuestas = {}
+        for clave in claves:
+            filas = CACHE_RECOMENDACIONES.obtener(clave, _AUSENTE)
+            if filas is _AUSENTE:
+                filas = CACHE_RECOMENDACIONES.obtener_caducado(clave, [])
+                if caducadas is not None:
+                    caducadas.add(clave)
+            respuestas[clave] = filas
+        return respuestas
+
+
+def _errores_consulta():
+    # Fallos que se atienden como un plazo agotado: CPIC caído o con errores HTTP, o la copia
+    # local ilegible. requests se importa aquí para no cargarlo al importar cpic
+    import requests
+
+    return PlazoAgotado, requests.RequestException, sqlite3.Error
+
+
+def _guardar_revalidadas(claves, futuro):
+    # Fin de una consulta de revalidación: las respuestas (también las que llegan
+    # después del plazo de su lote) se guardan y las claves pueden volver a consultarse
+    try:
+        if not futuro.cancelled() and futuro.exception() is None:
+            for clave, filas in futuro.result().items():
+                CACHE_RECOMENDACIONES.guardar(clave, filas)
+    finally:
+        with _cerrojo_global:
+            _revalidando.difference_update(claves)
+
+
+class CatalogoAlelos:
+    """
+    Catálogo de alelos por gen, compartido por todas las sesiones del proceso.
+
+    Al crearse precarga en segundo plano los genes del panel y después los
+    refresca periódicamente, de modo que abrir un selector de alelos no
+    requiere ninguna consulta a la red.
+    """
+    def __init__(self, panel=PANEL_GENES, intervalo_refresco=INTERVALO_REFRESCO_ALELOS):
+        self.panel = tuple(panel)
+        self.intervalo_refresco = intervalo_refresco
+        self._alelos = {}
+        self._cerrojo = threading.Lock()
+        self._hilo = threading.Thread(target=self._refrescar_periodicamente, name="catalogo-alelos", daemon=True)
+        self._hilo.start()
+
+    @staticmethod
+    def _consultar(gen):
+        # Nombres únicos y ordenados, como se muestran en los selectores
+        return sorted({alelo["name"] for alelo in resolver().alelos(gen)})
+
+    def alelos(self, gen):
+        """
+        Devuelve la lista ordenada de alelos del gen (vacía si no se indica gen).
+        """
+        if not gen:
+            return []
+        lista = self._alelos.get(gen)
+        if lista is None:
+            lista = self._consultar(gen)  # gen fuera del panel: se consulta una vez y queda guardado
+            with self._cerrojo:
+                self._alelos[gen] = lista
+        return lista
+
+    def precargar(self, genes):
+        """
+        Consulta en paralelo los alelos de los genes indicados y los guarda.
+        """
+        genes = [gen for gen in genes if gen]
+        for gen, lista in zip(genes, cliente().mapear(self._consultar, genes)):
+            with self._cerrojo:
+                self._alelos[gen] = lista
+
+    def _refrescar_periodicamente(self):
+        while True:
+            try:
+                self.precargar(sorted(set(self.panel) | set(self._alelos)))
+            except Exception:
+                pass  # sin red: se conservan las listas anteriores y se reintenta en el siguiente ciclo
+            time.sleep(self.intervalo_refresco)
+
+
+_catalogo = None
+
+
+def catalogo_alelos():
+    """
+    Devuelve el catálogo de alelos del proceso (se crea y precarga la primera vez).
+    """
+    global _catalogo
+    with _cerrojo_global:
+        if _catalogo is None:
+            _catalogo = CatalogoAlelos()
+    return _catalogo
+
+
+@instrumentar("cpic.recomendaciones_panel")
+def recomendaciones_panel(farmacos, seleccion):
+    """
+    Resuelve la matriz fármaco x gen completa con un número fijo de consultas.
+
+    En lugar de encadenar diplotipo, ID de fármaco, recomendación y guía para
+    cada par, se piden de una vez todos los diplotipos, todos los fármacos (con
+    su guía) y todas las recomendaciones de esos fármacos, y el cruce se hace
+    en memoria.
+
+    Args:
+        farmacos (list): Nombres de los fármacos.
+        seleccion (list): Tuplas (gen, alelo1, alelo2).
+
+    Returns:
+        dict: {farmaco: {gen: [fenotipo, recomendación, guía, url de la guía] o []}}.
+    """
+    resultado = {farmaco: {} for farmaco in farmacos}
+    if not seleccion:
+        return resultado
+
+    activo = resolver()
+    pares = [(gen, alelo1 + "/" + alelo2) for gen, alelo1, alelo2 in seleccion]
+    diplotipos = activo.diplotipos_en_lote(pares)
+    farmacos_cpic = activo.farmacos_con_guia_en_lote(list(farmacos))
+    drugids = {filas[0]["drugid"] for filas in farmacos_cpic.values() if filas}
+    por_farmaco = {}
+    for fila in activo.recomendaciones_de_farmacos(sorted(drugids)):
+        por_farmaco.setdefault(fila["drugid"], []).append(fila)
+
+    for farmaco in farmacos:
+        filas_farmaco = farmacos_cpic.get(farmaco) or []
+        drugid = filas_farmaco[0]["drugid"] if filas_farmaco else ""
+        for (gen, _, _), par in zip(seleccion, pares):
+            lista = []
+            fenotipo = diplotipos[par]
+            if fenotipo:
+                # Igual que el filtro lookupkey=cs.{...}: se compara la primera clave del diplotipo
+                clave, valor = next(iter(fenotipo[0]["lookupkey"].items()))
+                datos = [fila for fila in por_farmaco.get(drugid, []) if (fila.get("lookupkey") or {}).get(clave) == valor]
+                if datos:
+                    url = next((fila["guideline_for_drug"]["url"] for fila in filas_farmaco
+                                if fila.get("guideline_for_drug") and fila["guideline_for_drug"]["id"] == datos[0]["guidelineid"]), None)
+                    lista = [fenotipo[0]["generesult"],
+                             datos[0]["drugrecommendation"].encode("latin-1", "ignore").decode("latin-1"),
+                             datos[0]["guideline"]["name"], url]
+            resultado[farmaco][gen] = lista
+    return resultado
+
+
+def descargar_volcado(genes=None, tamano_pagina=10000, url_api=URL_API):
+    """
+    Descarga las tablas de CPIC desde la API, paginando con limit/offset.
+
+    Args:
+        genes (list): Si se indica, las tablas allele y diplotype se limitan a estos genes.
+        tamano_pagina (int): Filas por petición.
+
+    Returns:
+        dict: {tabla: [filas]}.
+    """
+    volcado = {}
+    for tabla in TABLAS:
+        parametros = {}
+        if genes and tabla in ("allele", "diplotype"):
+            parametros["genesymbol"] = "in.(" + ",".join(genes) + ")"
+        filas = []
+        while True:
+            pagina = cliente().get_json(url_api + tabla, params=dict(parametros, limit=tamano_pagina, offset=len(filas)))
+            filas.extend(pagina)
+            if len(pagina) < tamano_pagina:
+                break
+        volcado[tabla] = filas
+    return volcado
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Gestión de la copia local de CPIC")
+    parser.add_argument("--base", default=RUTA_BASE_LOCAL, help="Archivo SQLite de destino")
+    ordenes = parser.add_subparsers(dest="orden", required=True)
+    importar = ordenes.add_parser("importar", help="Importa un volcado JSON {tabla: [filas]}")
+    importar.add_argument("volcado")
+    sincronizar = ordenes.add_parser("sincronizar", help="Descarga las tablas desde api.cpicpgx.org")
+    sincronizar.add_argument("--genes", nargs="*", help="Limitar alelos y diplotipos a estos genes")
+    sincronizar.add_argument("--guardar", help="Guardar también el volcado descargado en este JSON")
+    args = parser.parse_args(argumentos)
+
+    if args.orden == "importar":
+        with open(args.volcado, encoding="utf-8") as archivo:
+            volcado = json.load(archivo)
+    else:
+        volcado = descargar_volcado(args.genes)
+        if args.guardar:
+            with open(args.guardar, "w", encoding="utf-8") as archivo:
+                json.dump(volcado, archivo, ensure_ascii=False)
+
+    for tabla, n in ResolverLocal(args.base).importar(volcado).items():
+        print(f"{tabla}: {n} filas")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
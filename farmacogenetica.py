@@ -0,0 +1,452 @@
+"""
+Determinación de genotipo, fenotipo y recomendación clínica.
+
+Funciones del flujo de análisis que no dependen de Streamlit, para poder
+usarlas tanto desde la aplicación como desde procesos por lotes.
+"""
+import hashlib
+import json
+import os
+import pickle
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import cpic
+from cache import memoizar
+from genotipado import SILVESTRE, mascaras_haplotipos
+from metricas import instrumentar
+
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+RUTA_TABLA_CYP2D6 = os.path.join(DIRECTORIO, "CYP2D6_Diplotype_Phenotype_Table.xlsx")
+RUTA_REGLAS_FENOTIPO = os.path.join(DIRECTORIO, "reglas_fenotipo.json")
+# Tablas de referencia compiladas a formato binario
+DIRECTORIO_CACHE = os.path.join(DIRECTORIO, ".cache")
+
+# Score y fenotipo de los diplotipos que no cubren las reglas (como 'n/a' en CPIC)
+FENOTIPO_INDETERMINADO = ("n/a", "Indeterminate")
+
+
+def _filas_por_gen(por_gen):
+    # Filas de un resultado por lotes {gen: (array de n filas, ...)}: todos los genes tienen n
+    return len(next(iter(por_gen.values()))[0]) if por_gen else 0
+
+
+@instrumentar("determinar_genotipo_definitivo")
+def determinar_genotipo_definitivo(datos_pacientes):
+    """
+    Determina el genotipo definitivo para cada gen de cada paciente
+    """
+    resultados = {}
+    
+    for paciente, genes in datos_pacientes.items():
+        resultados[paciente] = {}
+        
+        for gen, alelos in genes.items():
+            # Recoger todos los alelos únicos, excluyendo *1 cuando hay otros
+            alelos_maternos_unicos = set()
+            alelos_paternos_unicos = set()
+
+            for alelo_materno, alelo_paterno in alelos:
+                # Si ambos son *1, es el caso base (sin mutaciones)
+                if alelo_materno == '*1' and alelo_paterno == '*1':
+                    continue
+                
+                # Añadir alelos no silvestres
+                
+                if alelo_materno != '*1':
+                    alelos_maternos_unicos.add(alelo_materno)
+                if alelo_paterno != '*1':
+                    alelos_paternos_unicos.add(alelo_paterno)
+
+            if gen == "CYP2D6":
+                # Manejo de Variante *10*4 Materno
+                if "*10*4" in alelos_maternos_unicos and "*10" in alelos_maternos_unicos:
+                    alelos_maternos_unicos.remove("*10*4")
+                    if "*4" in alelos_maternos_unicos:
+                        alelos_maternos_unicos.remove("*10")
+                # Manejo de Variante *10*4 Paterno 
+                if "*10*4" in alelos_paternos_unicos and "*10" in alelos_paternos_unicos:
+                    alelos_paternos_unicos.remove("*10*4")
+                    if "*4" in alelos_paternos_unicos:
+                        alelos_paternos_unicos.remove("*10")
+                #Manejo si estan en alelos distintos
+                if "*10*4" in alelos_paternos_unicos and "*10" in alelos_maternos_unicos:
+                    alelos_paternos_unicos.remove("*10*4")
+                    if "*4" in alelos_maternos_unicos:
+                        alelos_maternos_unicos.remove("*10")
+                if "*10*4" in alelos_maternos_unicos and "*10" in alelos_paternos_unicos:
+                    alelos_maternos_unicos.remove("*10*4")
+                    if "*4" in alelos_paternos_unicos:
+                        alelos_paternos_unicos.remove("*10")
+
+
+            # Manejo de variante *80 como *28
+            if gen == "UGT1A1":
+                if alelos_maternos_unicos:
+                    alelos_maternos_unicos = list(alelos_maternos_unicos)
+                    alelos_maternos_unicos[0] = "*28"
+                    alelos_maternos_unicos = set(alelos_maternos_unicos)
+                if alelos_paternos_unicos:
+                    alelos_paternos_unicos = list(alelos_paternos_unicos)
+                    alelos_paternos_unicos[0] = "*28"
+                    alelos_paternos_unicos = set(alelos_paternos_unicos)
+
+            # Si no hay mutaciones, el genotipo es *1/*1
+            if not alelos_maternos_unicos and not alelos_paternos_unicos:
+                resultados[paciente][gen] = ('*1', '*1')
+            # Si hay una mutación, es heterocigoto *1/mutación
+            elif alelos_maternos_unicos and not alelos_paternos_unicos:
+                mutacion = list(alelos_maternos_unicos)[0]
+                resultados[paciente][gen] = ('*1', mutacion)
+            # Si hay dos mutaciones, es heterocigoto mutación1/mutación2
+            elif not alelos_maternos_unicos and alelos_paternos_unicos:
+                mutacion = list(alelos_paternos_unicos)[0]
+                resultados[paciente][gen] = ('*1', mutacion)
+            elif alelos_maternos_unicos and alelos_paternos_unicos:
+
+                mutacion_materna = list(alelos_maternos_unicos)[0]
+                mutacion_paterna = list(alelos_paternos_unicos)[0]
+                resultados[paciente][gen] = (mutacion_materna, mutacion_paterna)
+
+    return resultados
+
+# Función para formatear el resultado como string
+@instrumentar("formatear_genotipos")
+def formatear_genotipos(resultados):
+    formateados = {}
+    for paciente, genes in resultados.items():
+        formateados[paciente] = {}
+        for gen, alelos in genes.items():
+            formateados[paciente][gen] = f"{alelos[0]}/{alelos[1]}"
+    return formateados
+
+# Reglas entre alelos de un mismo gen: (variante, alelo base, alelo absorbente).
+# Si la variante aparece con el alelo base se descarta la variante, y si además
+# está el absorbente se descarta también el base (*10*4 + *10 -> *10; + *4 -> *4).
+REGLAS_ABSORCION = {"CYP2D6": [("*10*4", "*10", "*4")]}
+
+# Alelos que solo se informan si el haplotipo no lleva ningún otro: la variante
+# que define *10 (100C>T) también forma parte de *4 y de otros alelos más específicos
+PRECEDENCIA_BAJA = {"CYP2D6": ("*10",)}
+
+# Alelos que se informan con otro nombre
+RENOMBRAR_ALELOS = {"UGT1A1": {"*80": "*28"}}
+
+def _bit(etiquetas, alelo):
+    """
+    Bit de la máscara que corresponde a un alelo (0 si el gen no tiene ese ensayo).
+    """
+    return np.int64(1) << np.int64(etiquetas.index(alelo) - 1) if alelo in etiquetas else np.int64(0)
+
+def _primer_alelo(mascara):
+    """
+    Código (1 + columna) del bit más bajo de cada máscara; 0 si está vacía.
+    """
+    bajo = mascara & -mascara
+    return np.where(bajo > 0, np.log2(np.maximum(bajo, 1)).astype(np.int16) + 1, 0).astype(np.int16)
+
+@instrumentar("resolver_diplotipos", filas=_filas_por_gen)
+def resolver_diplotipos(mascaras):
+    """
+    Equivalente vectorizado de determinar_genotipo_definitivo para toda la cohorte.
+
+    Aplica las reglas de REGLAS_ABSORCION como operaciones sobre las máscaras de
+    bits de los dos haplotipos, en el mismo orden que la función original
+    (materno, paterno, variante paterna con base materna y al revés). Si un
+    haplotipo conserva más de un alelo, la función original tomaba uno
+    arbitrario del conjunto; aquí se descartan los de PRECEDENCIA_BAJA y se
+    elige el de la primera columna de la cabecera.
+
+    Args:
+        mascaras (dict): {gen: (máscara materna, máscara paterna, etiquetas)} de mascaras_haplotipos.
+
+    Returns:
+        dict: {gen: (códigos (n, 2) int16, etiquetas)}; el código 0 es *1 y el código k
+        es ``etiquetas[k]``, ya con los alelos de RENOMBRAR_ALELOS renombrados.
+    """
+    diplotipos = {}
+    for gen, (materna, paterna, etiquetas) in mascaras.items():
+        haplotipos = {"M": materna.copy(), "P": paterna.copy()}
+        for variante, base, absorbente in REGLAS_ABSORCION.get(gen, []):
+            bit_variante, bit_base, bit_absorbente = (_bit(etiquetas, a) for a in (variante, base, absorbente))
+            for origen, destino in (("M", "M"), ("P", "P"), ("P", "M"), ("M", "P")):
+                aplica = ((haplotipos[origen] & bit_variante) != 0) & ((haplotipos[destino] & bit_base) != 0)
+                haplotipos[origen] = np.where(aplica, haplotipos[origen] & ~bit_variante, haplotipos[origen])
+                aplica &= (haplotipos[destino] & bit_absorbente) != 0
+                haplotipos[destino] = np.where(aplica, haplotipos[destino] & ~bit_base, haplotipos[destino])
+
+        bits_baja = np.int64(0)
+        for alelo in PRECEDENCIA_BAJA.get(gen, ()):
+            bits_baja |= _bit(etiquetas, alelo)
+        for lado in haplotipos:
+            especificos = haplotipos[lado] & ~bits_baja
+            haplotipos[lado] = np.where(especificos != 0, especificos, haplotipos[lado])
+        materno, paterno = _primer_alelo(haplotipos["M"]), _primer_alelo(haplotipos["P"])
+        # Un solo haplotipo con variante: *1/variante; los dos: materno/paterno
+        codigos = np.stack([np.where((materno > 0) & (paterno > 0), materno, 0),
+                            np.where(paterno > 0, paterno, materno)], axis=1).astype(np.int16)
+        renombrar = RENOMBRAR_ALELOS.get(gen, {})
+        diplotipos[gen] = (codigos, [renombrar.get(etiqueta, etiqueta) for etiqueta in etiquetas])
+    return diplotipos
+
+def diplotipos_formateados(pacientes, diplotipos):
+    """
+    Convierte la salida de resolver_diplotipos en {paciente: {gen: 'alelo1/alelo2'}},
+    la misma forma que formatear_genotipos(determinar_genotipo_definitivo(...)).
+    """
+    formateados = {paciente: {} for paciente in pacientes}
+    for gen, (codigos, etiquetas) in diplotipos.items():
+        nombres = np.array(etiquetas, dtype=object)
+        genotipos = nombres[codigos[:, 0]] + "/" + nombres[codigos[:, 1]]
+        for paciente, genotipo in zip(pacientes, genotipos.tolist()):
+            formateados[paciente][gen] = genotipo
+    return formateados
+
+def genotipos_en_lote(df):
+    """
+    Matriz de genotipos -> {paciente: {gen: 'alelo1/alelo2'}} sin pasar por los haplotipos por paciente.
+    """
+    pacientes, mascaras = mascaras_haplotipos(df)
+    return diplotipos_formateados(pacientes, resolver_diplotipos(mascaras))
+
+def _hash_archivo(ruta):
+    """
+    Devuelve el SHA-256 del contenido de un archivo.
+    """
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(1 << 16), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+def _leer_tabla_excel(ruta):
+    """
+    Lee la hoja de diplotipos con openpyxl (lento: solo al reconstruir la caché).
+    """
+    df = pd.read_excel(ruta)
+    return dict(zip(df.iloc[:, 0], zip(df.iloc[:, 1], df.iloc[:, 2])))
+
+@memoizar()
+@instrumentar("cargar_diccionario_CYP2D6")
+def cargar_diccionario_CYP2D6(ruta=RUTA_TABLA_CYP2D6, directorio_cache=DIRECTORIO_CACHE):
+    """
+    Carga la tabla diplotipo -> (score, fenotipo) de CYP2D6.
+
+    El Excel solo se lee cuando cambia su contenido: el diccionario se guarda
+    compilado en un archivo binario cuyo nombre lleva el hash del libro. El
+    resultado queda en memoria para todo el proceso (todas las sesiones de
+    Streamlit lo comparten).
+
+    Args:
+        ruta (str): Libro Excel con la tabla de diplotipos.
+        directorio_cache (str): Carpeta donde se guarda la tabla compilada.
+
+    Returns:
+        dict: {diplotipo: (score, fenotipo)}.
+    """
+    huella = _hash_archivo(ruta)
+    prefijo = os.path.splitext(os.path.basename(ruta))[0] + "_"
+    ruta_cache = os.path.join(directorio_cache, f"{prefijo}{huella}.pickle")
+
+    if os.path.exists(ruta_cache):
+        try:
+            with open(ruta_cache, "rb") as archivo:
+                return pickle.load(archivo)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass  # Caché corrupta: se reconstruye
+
+    diccionario = _leer_tabla_excel(ruta)
+
+    # Escritura atómica; si la carpeta no es escribible se sigue sin caché
+    try:
+        os.makedirs(directorio_cache, exist_ok=True)
+        temporal = f"{ruta_cache}.{os.getpid()}.tmp"
+        with open(temporal, "wb") as archivo:
+            pickle.dump(diccionario, archivo, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, ruta_cache)
+        # Borrar las versiones compiladas de libros anteriores
+        for nombre in os.listdir(directorio_cache):
+            if nombre.startswith(prefijo) and nombre.endswith(".pickle") and nombre != os.path.basename(ruta_cache):
+                os.remove(os.path.join(directorio_cache, nombre))
+    except OSError:
+        pass
+
+    return diccionario
+
+@memoizar()
+def cargar_reglas_fenotipo(ruta=RUTA_REGLAS_FENOTIPO):
+    """
+    Carga las reglas de asignación de fenotipo de cada gen.
+
+    Args:
+        ruta (str): JSON con, por gen, {"tabla": libro Excel diplotipo -> (score, fenotipo)}
+            o {"copias": {número de alelos distintos de *1: [score, fenotipo]}}.
+
+    Returns:
+        dict: Las reglas. Se comparten entre llamadas, no deben modificarse.
+    """
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+def clave_canonica(alelo1, alelo2):
+    """
+    Clave de un diplotipo independiente del orden de los alelos ('*4/*1' y '*1/*4' dan la misma).
+    """
+    return (alelo1, alelo2) if alelo1 <= alelo2 else (alelo2, alelo1)
+
+@memoizar()
+def indice_fenotipos(gen, ruta_reglas=RUTA_REGLAS_FENOTIPO):
+    """
+    Construye el índice clave canónica -> (score, fenotipo) de un gen a partir de sus reglas.
+
+    Returns:
+        tuple: (índice {clave canónica: (score, fenotipo)} o None, reglas por número de
+        copias {n: (score, fenotipo)} o None).
+    """
+    reglas = cargar_reglas_fenotipo(ruta_reglas).get(gen, {})
+    if "copias" in reglas:
+        return None, {int(n): tuple(fila) for n, fila in reglas["copias"].items()}
+    indice = {}
+    if "tabla" in reglas:
+        for diplotipo, fila in cargar_diccionario_CYP2D6(os.path.join(DIRECTORIO, reglas["tabla"])).items():
+            alelo1, _, alelo2 = str(diplotipo).partition("/")
+            indice.setdefault(clave_canonica(alelo1, alelo2), tuple(fila))
+    return indice, None
+
+def fenotipo_diplotipo(gen, alelo1, alelo2, ruta_reglas=RUTA_REGLAS_FENOTIPO):
+    """
+    Devuelve (score, fenotipo) de un diplotipo; FENOTIPO_INDETERMINADO si las reglas no lo cubren.
+    """
+    indice, copias = indice_fenotipos(gen, ruta_reglas)
+    if copias is not None:
+        return copias.get((alelo1 != SILVESTRE) + (alelo2 != SILVESTRE), FENOTIPO_INDETERMINADO)
+    return indice.get(clave_canonica(alelo1, alelo2), FENOTIPO_INDETERMINADO)
+
+@lru_cache(maxsize=256)
+def _matriz_fenotipos(gen, etiquetas, ruta_reglas):
+    """
+    Precalcula la fila de fenotipo de cada par de etiquetas de un gen.
+
+    Returns:
+        tuple: (matriz (k, k) int16 con el código de fila de cada par, filas [(score, fenotipo)]).
+    """
+    filas, codigos = [], {}
+    matriz = np.zeros((len(etiquetas), len(etiquetas)), dtype=np.int16)
+    for i, alelo1 in enumerate(etiquetas):
+        for j, alelo2 in enumerate(etiquetas):
+            fila = fenotipo_diplotipo(gen, alelo1, alelo2, ruta_reglas)
+            if fila not in codigos:
+                codigos[fila] = len(filas)
+                filas.append(fila)
+            matriz[i, j] = codigos[fila]
+    return matriz, filas
+
+@instrumentar("fenotipos_en_lote", filas=_filas_por_gen)
+def fenotipos_en_lote(diplotipos, ruta_reglas=RUTA_REGLAS_FENOTIPO):
+    """
+    Asigna score y fenotipo a toda la cohorte con una sola indexación por gen.
+
+    Args:
+        diplotipos (dict): {gen: (códigos (n, 2), etiquetas)} de resolver_diplotipos.
+
+    Returns:
+        dict: {gen: (códigos de fila (n,) int16, filas [(score, fenotipo)])}.
+    """
+    fenotipos = {}
+    for gen, (codigos, etiquetas) in diplotipos.items():
+        matriz, filas = _matriz_fenotipos(gen, tuple(etiquetas), ruta_reglas)
+        fenotipos[gen] = (matriz[codigos[:, 0], codigos[:, 1]], filas)
+    return fenotipos
+
+def fenotipos_formateados(claves, diplotipos):
+    """
+    Resultado de fenotipo() calculado con fenotipos_en_lote: {clave: {gen: [genotipo, score, fenotipo]}}.
+
+    Args:
+        claves (list): Identificador de cada fila de los diplotipos (pacientes o firmas).
+        diplotipos (dict): Salida de resolver_diplotipos.
+    """
+    resultado = diplotipos_formateados(claves, diplotipos)
+    for gen, (codigos, filas) in fenotipos_en_lote(diplotipos).items():
+        for clave, codigo in zip(claves, codigos.tolist()):
+            resultado[clave][gen] = [resultado[clave][gen], *filas[codigo]]
+    return resultado
+
+@instrumentar("fenotipo")
+def fenotipo(genotipo):
+    """
+    Añade score y fenotipo a los genotipos formateados.
+
+    Los genotipos repetidos se resuelven una sola vez contra el índice de su gen.
+
+    Args:
+        genotipo (dict): {paciente: {gen: 'alelo1/alelo2'}}.
+
+    Returns:
+        dict: {paciente: {gen: [genotipo, score, fenotipo]}}.
+    """
+    resueltos = {}
+    Sol = {}
+    for nombre, genes in genotipo.items():
+        Sol[nombre] = {}
+        for gen, diplotipo in genes.items():
+            fila = resueltos.get((gen, diplotipo))
+            if fila is None:
+                alelo1, _, alelo2 = diplotipo.partition("/")
+                fila = resueltos[(gen, diplotipo)] = fenotipo_diplotipo(gen, alelo1, alelo2)
+            Sol[nombre][gen] = [diplotipo, *fila]
+    return Sol
+
+
+# Fármaco consultado en CPIC para cada gen
+FARMACO_POR_GEN = {"CYP2D6": "RxNorm:10324", "DPYD": "RxNorm:51499", "UGT1A1": "RxNorm:51499"}
+
+# Marcas que se añaden a la recomendación cuando CPIC no responde dentro del plazo del lote
+AVISO_CADUCADA = "[Recomendación de CPIC no actualizada: se muestra la última conocida]"
+AVISO_SIN_RESPUESTA = "[CPIC no respondió a tiempo: recomendación pendiente]"
+AVISOS_CPIC = (AVISO_CADUCADA, AVISO_SIN_RESPUESTA)
+
+
+@instrumentar("recomendacionClinica")
+def recomendacionClinica(fenotipo):
+    resultado = fenotipo # Los resultados se añaden a la lista de cada paciente y gen.
+    # Clave de búsqueda (fármaco, gen, score) de cada paciente y gen
+    claves = {}
+    for paciente in fenotipo:
+        for gen in fenotipo[paciente]:
+            if gen in FARMACO_POR_GEN:
+                claves[(paciente, gen)] = (FARMACO_POR_GEN[gen], gen, str(fenotipo[paciente][gen][1]))
+    # El lote se reduce a sus claves distintas: cada una se consulta una sola vez
+    caducadas = set()
+    respuestas = cpic.recomendaciones_en_lote(claves.values(), caducadas=caducadas)
+
+    for (paciente, gen), clave in claves.items():
+        lookupkey = [clave[1], clave[2]] # Clave de búsqueda del fenotipo.
+        if gen == "DPYD":
+            if float(lookupkey[1])==2.0:
+                resultado[paciente][gen].append("Based on genotype, there is no indication to change dose or therapy. Use label-recommended dosage and administration.")
+            elif float(lookupkey[1])>=1.0:
+                resultado[paciente][gen].append("Reduce starting dose by 50% followed by titration of dose based on toxicity or therapeutic drug monitoring (if available). Patients with the c.[2846A>T];[2846A>T] genotype may require >50% reduction in starting dose.")
+            elif float(lookupkey[1])==0.5:
+                resultado[paciente][gen].append("Avoid use of 5- fluorouracil or 5-fluorouracil prodrug-based regimens. In the event, based on clinical advice, alternative agents are not considered a suitable therapeutic option, 5-fluorouracil should be administered at a strongly reduced dose with early therapeutic drug monitoring.")
+            elif float(lookupkey[1])== 0.0:
+                resultado[paciente][gen].append("Avoid use of 5-fluorouracil or 5-fluorouracil prodrug-based regimens.")
+        elif gen == "UGT1A1":
+            if fenotipo[paciente][gen][0] == "*1/*1":
+                resultado[paciente][gen].append("The guideline does not provide a recommendation for irinotecan in normal metabolizers.")
+            elif fenotipo[paciente][gen][0] == "*1/*28":
+                resultado[paciente][gen].append("NO action is needed for this gene-drug interaction.")
+            elif fenotipo[paciente][gen][0] == "*28/*28":
+                resultado[paciente][gen].append("Start with 70% of the normal dose If the patient tolerates this initial dose, the dose can be increased, guided by the neutrophil count.")
+        datos = respuestas[clave] # Recomendaciones de CPIC para la clave.
+        if len(datos) != 0: # Verifica si se encontraron recomendaciones.
+            texto = datos[0]['drugrecommendation'].encode('latin-1','ignore').decode('latin-1') # Decodifica caracteres especiales.
+            if clave in caducadas: # Sin respuesta a tiempo: se marca que es la última conocida.
+                texto = f"{texto} {AVISO_CADUCADA}"
+            resultado[paciente][gen].append(texto) # Agrega la recomendación del fármaco a la lista.
+        elif clave in caducadas:
+            resultado[paciente][gen].append(AVISO_SIN_RESPUESTA)
+    return resultado # Devuelve la lista con los resultados.
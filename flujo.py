@@ -0,0 +1,353 @@
+"""
+Procesamiento en flujo de matrices de genotipos muy grandes.
+
+En lugar de cargar todo el CSV y mantener a la vez ``datos_dict``,
+``dict_pacientes``, ``resultados``, el diccionario formateado y ``Sol``, la
+matriz se lee por lotes de filas y cada lote atraviesa una cadena de
+generadores:
+
+    lectura -> firmas -> diplotipos -> fenotipo -> recomendación -> reparto -> sumidero
+
+Solo hay un lote en memoria en cada momento, así que el consumo máximo
+depende del tamaño del lote y no del número de pacientes del archivo.
+
+Dentro de cada lote, los pacientes con exactamente las mismas llamadas en
+todos los ensayos comparten firma: genotipo, fenotipo y recomendación se
+calculan una vez por firma distinta y después se copian (como códigos de una
+Cohorte) a todos los pacientes que la comparten.
+
+``analizar_incremental`` reutiliza los resultados de una carga anterior: si el
+archivo es idéntico no se recalcula nada y, si no, solo se analizan las
+muestras nuevas o cuyas llamadas han cambiado; el resto se copian de la carga
+anterior. Devuelve solo las muestras del archivo. Las muestras con
+recomendaciones provisionales (CPIC no respondió dentro del plazo) no guardan
+huella y el resultado se marca como provisional, así que se vuelven a calcular
+en la siguiente carga aunque el archivo sea el mismo.
+"""
+import csv
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from cohorte import Cohorte, Internado
+from genotipado import COLUMNA_MUESTRA, firmas_filas, mascaras_haplotipos
+from farmacogenetica import fenotipos_formateados, recomendacionClinica, resolver_diplotipos, AVISOS_CPIC
+from metricas import instrumentar
+
+
+TAMANO_LOTE = 5000
+
+# Etapas de analizar_incremental que se notifican a ``progreso`` (en pacientes)
+ETAPAS_ANALISIS = ("lectura", "huellas", "diplotipos", "fenotipos", "recomendaciones")
+
+
+def _sin_progreso(etapa, pacientes):
+    pass
+
+
+def leer_lotes(path, tamano_lote=TAMANO_LOTE):
+    """
+    Lee la matriz de genotipos por bloques de filas.
+
+    Args:
+        path (str o archivo): Ruta o archivo con la matriz (separador ';').
+        tamano_lote (int): Número de pacientes por lote.
+
+    Yields:
+        pandas.DataFrame: Un bloque de la matriz con su cabecera.
+    """
+    with pd.read_csv(path, sep=';', chunksize=tamano_lote) as lector:
+        for df in lector:
+            yield df
+
+
+@instrumentar("analizar_lote")
+def analizar_lote(df, recomendar=True, alelos=None, resultados=None, firmas=None, progreso=_sin_progreso):
+    """
+    Calcula los resultados de un bloque de la matriz una sola vez por firma de llamadas.
+
+    Args:
+        df (pandas.DataFrame): Bloque de la matriz con la columna 'Sample/Assay'.
+        recomendar (bool): Si es False se omite la consulta de recomendaciones a CPIC.
+        alelos (Internado): Tabla de alelos compartida entre lotes.
+        resultados (Internado): Tabla de resultados compartida entre lotes.
+        firmas (tuple): Resultado de ``firmas_filas(df)`` si ya se ha calculado.
+        progreso (callable): Se llama con (etapa, pacientes) al terminar cada etapa.
+
+    Returns:
+        Cohorte: Resultados de todos los pacientes del bloque.
+    """
+    representantes, inversa = firmas if firmas is not None else firmas_filas(df)
+    _, mascaras = mascaras_haplotipos(df.iloc[representantes])
+    diplotipos = resolver_diplotipos(mascaras)
+    progreso("diplotipos", len(df))
+    por_firma = fenotipos_formateados(list(range(len(representantes))), diplotipos)
+    progreso("fenotipos", len(df))
+    if recomendar:
+        por_firma = recomendacionClinica(por_firma)
+    progreso("recomendaciones", len(df))
+    return Cohorte.desde_resultados(por_firma, alelos, resultados).repartir(df[COLUMNA_MUESTRA].tolist(), inversa)
+
+
+def lotes_resultado(path, tamano_lote=TAMANO_LOTE, recomendar=True):
+    """
+    Encadena todas las etapas sobre el archivo.
+
+    Args:
+        path (str o archivo): Matriz de genotipos.
+        tamano_lote (int): Número de pacientes por lote.
+        recomendar (bool): Si es False se omite la consulta de recomendaciones a CPIC.
+
+    Yields:
+        Cohorte: Resultados de cada lote; se usa como el diccionario
+        {paciente: {gen: [genotipo, score, fenotipo, recomendacion...]}}. Todos
+        los lotes comparten las tablas internadas, así que pueden concatenarse.
+    """
+    alelos, resultados = Internado(), Internado()
+    for df in leer_lotes(path, tamano_lote):
+        yield analizar_lote(df, recomendar, alelos, resultados)
+
+
+def procesar_en_flujo(path, sumidero, tamano_lote=TAMANO_LOTE, recomendar=True):
+    """
+    Procesa el archivo completo entregando cada lote de resultados al sumidero.
+
+    Args:
+        path (str o archivo): Matriz de genotipos.
+        sumidero (callable): Función que recibe el diccionario de resultados de cada lote.
+        tamano_lote (int): Número de pacientes por lote.
+        recomendar (bool): Si es False se omite la consulta de recomendaciones a CPIC.
+
+    Returns:
+        int: Número total de pacientes procesados.
+    """
+    total = 0
+    for lote in lotes_resultado(path, tamano_lote, recomendar):
+        sumidero(lote)
+        total += len(lote)
+    return total
+
+
+def analizar(path, recomendar=True):
+    """
+    Ejecuta el flujo completo y devuelve todos los resultados en memoria.
+
+    Args:
+        path (str o archivo): Matriz de genotipos.
+        recomendar (bool): Si es False se omite la consulta de recomendaciones a CPIC.
+
+    Returns:
+        dict: {paciente: {gen: [genotipo, score, fenotipo, recomendacion...]}}.
+    """
+    resultado = {}
+    procesar_en_flujo(path, lambda lote: resultado.update(lote.items()), recomendar=recomendar)
+    return resultado
+
+
+def analizar_cohorte(path, tamano_lote=TAMANO_LOTE, recomendar=True):
+    """
+    Ejecuta el flujo completo y guarda los resultados en una Cohorte compacta.
+
+    Los lotes ya salen del flujo como arrays y se concatenan sin pasar por
+    diccionarios por paciente.
+
+    Args:
+        path (str o archivo): Matriz de genotipos.
+        tamano_lote (int): Número de pacientes por lote.
+        recomendar (bool): Si es False se omite la consulta de recomendaciones a CPIC.
+
+    Returns:
+        Cohorte: Resultados de todos los pacientes.
+    """
+    return Cohorte.concatenar(lotes_resultado(path, tamano_lote, recomendar))
+
+
+def huella_archivo(path):
+    """
+    Calcula el SHA-256 del contenido del archivo sin alterar su posición de lectura.
+
+    Args:
+        path (str o archivo): Ruta, archivo subido de Streamlit o archivo binario abierto.
+
+    Returns:
+        str: Huella hexadecimal del contenido.
+    """
+    huella = hashlib.sha256()
+    if hasattr(path, "getvalue"):
+        huella.update(path.getvalue())
+    elif hasattr(path, "read"):
+        posicion = path.tell()
+        for bloque in iter(lambda: path.read(1 << 20), b""):
+            huella.update(bloque)
+        path.seek(posicion)
+    else:
+        with open(path, "rb") as archivo:
+            for bloque in iter(lambda: archivo.read(1 << 20), b""):
+                huella.update(bloque)
+    return huella.hexdigest()
+
+
+def huellas_filas(df, firmas=None):
+    """
+    Calcula la huella BLAKE2b de 128 bits de las llamadas de cada muestra.
+
+    Solo se codifica una fila por firma distinta (ver ``firmas_filas``); el
+    resto de pacientes con la misma firma reciben la misma huella.
+
+    Args:
+        df (pandas.DataFrame): Bloque de la matriz con la columna 'Sample/Assay'.
+        firmas (tuple): Resultado de ``firmas_filas(df)`` si ya se ha calculado.
+
+    Returns:
+        pandas.DataFrame: Columnas h1 y h2 (uint64) indexadas por muestra.
+    """
+    representantes, inversa = firmas if firmas is not None else firmas_filas(df)
+    llamadas = df.drop(columns=COLUMNA_MUESTRA).iloc[representantes].astype(str).to_numpy()
+    digestos = b"".join(hashlib.blake2b("\x1f".join(fila).encode("utf-8"), digest_size=16).digest() for fila in llamadas)
+    distintas = np.frombuffer(digestos, dtype=np.uint64).reshape(-1, 2)[inversa]
+    return pd.DataFrame({"h1": distintas[:, 0], "h2": distintas[:, 1]},
+                        index=pd.Index(df[COLUMNA_MUESTRA].to_numpy(), name=COLUMNA_MUESTRA))
+
+
+def _huella_cabecera(df):
+    return hashlib.sha256("\x1f".join(map(str, df.columns)).encode("utf-8")).hexdigest()
+
+
+def analizar_incremental(path, previo=None, huellas=None, tamano_lote=TAMANO_LOTE, recomendar=True,
+                         progreso=_sin_progreso):
+    """
+    Analiza el archivo reutilizando los resultados de una carga anterior.
+
+    Las muestras se comparan por la huella de sus llamadas: solo se calculan
+    las nuevas y las que han cambiado, y las demás se copian de ``previo``. El
+    resultado contiene solo las muestras del archivo, en su orden; las de
+    ``previo`` que no aparecen en él no se incluyen (para conservarlas en la
+    sesión, ``previo.actualizar(cohorte)``). Si cambian los ensayos de la
+    cabecera se recalculan todas.
+
+    Args:
+        path (str o archivo): Matriz de genotipos.
+        previo (Cohorte): Resultados de la carga anterior (None = primera carga).
+        huellas (dict): Huellas devueltas junto a ``previo``.
+        tamano_lote (int): Número de pacientes por lote.
+        recomendar (bool): Si es False se omite la consulta de recomendaciones a CPIC.
+        progreso (callable): Se llama con (etapa, pacientes) al terminar cada etapa de
+            cada lote (ver ETAPAS_ANALISIS); si lanza una excepción el análisis se interrumpe.
+
+    Returns:
+        tuple: (cohorte, huellas, calculados): los resultados de las muestras del
+        archivo, sus huellas para la próxima carga y el número de muestras analizadas.
+        ``huellas["provisional"]`` indica si alguna muestra tiene recomendaciones provisionales.
+    """
+    archivo = huella_archivo(path)
+    if previo is not None and huellas and huellas["archivo"] == archivo and not huellas.get("provisional"):
+        muestras = huellas["filas"].index
+        return previo.repartir(muestras, previo.pacientes.get_indexer(muestras)), huellas, 0
+
+    if previo is None:
+        alelos, resultados = Internado(), Internado()
+        filas_previas = None
+    else:
+        alelos, resultados = previo.alelos, previo.resultados
+        filas_previas = huellas["filas"] if huellas else None
+    partes, filas, vistas, cabecera, provisionales, copiadas = [], [], set(), None, [], 0
+    for df in leer_lotes(path, tamano_lote):
+        df = df.drop_duplicates(COLUMNA_MUESTRA, keep="last")
+        progreso("lectura", len(df))
+        cabecera = _huella_cabecera(df)
+        firmas = firmas_filas(df)
+        huellas_lote = huellas_filas(df, firmas)
+        progreso("huellas", len(df))
+        cambiadas = np.ones(len(df), dtype=bool)
+        if filas_previas is not None and huellas["cabecera"] == cabecera:
+            cambiadas = _cambiadas(filas_previas, huellas_lote)
+        muestras = huellas_lote.index.to_numpy(dtype=object)
+        copiar = ~cambiadas
+        if not vistas.isdisjoint(muestras):
+            # Una muestra que ya apareció en un lote anterior del archivo se compara
+            # con esa aparición y no con la carga previa (y, si no cambia, ya está en ``partes``)
+            repetidas = np.fromiter((muestra in vistas for muestra in muestras), dtype=bool, count=len(muestras))
+            hechas = pd.concat(filas)
+            cambiadas[repetidas] = _cambiadas(hechas[~hechas.index.duplicated(keep="last")], huellas_lote[repetidas])
+            copiar = ~cambiadas & ~repetidas
+        vistas.update(muestras)
+        filas.append(huellas_lote)
+        if not cambiadas.all():
+            # Las muestras sin cambios cuentan como hechas en el resto de etapas
+            for etapa in ETAPAS_ANALISIS[2:]:
+                progreso(etapa, int((~cambiadas).sum()))
+            if copiar.any():
+                partes.append(previo.repartir(huellas_lote.index[copiar], previo.pacientes.get_indexer(muestras[copiar])))
+                copiadas += int(copiar.sum())
+            df, firmas = df[cambiadas], None
+        if len(df):
+            parte = analizar_lote(df, recomendar, alelos, resultados, firmas, progreso)
+            provisionales.extend(_pacientes_con_avisos(parte))
+            partes.append(parte)
+
+    calculados = sum(len(parte) for parte in partes) - copiadas
+    # Como en un diccionario, la última aparición de cada muestra sustituye a las
+    # anteriores (Cohorte conserva la última fila de cada paciente repetido)
+    cohorte = Cohorte.concatenar(partes) if partes else Cohorte([], alelos, resultados, {}, {})
+    filas = pd.concat(filas) if filas else pd.DataFrame({"h1": [], "h2": []}, dtype="uint64")
+    if filas.index.has_duplicates:
+        orden = filas.index[~filas.index.duplicated()]
+        filas = filas[~filas.index.duplicated(keep="last")].reindex(orden)
+    if copiadas:
+        # Las copiadas se añadieron delante de las calculadas de su lote: se recupera el orden del archivo
+        cohorte = cohorte.repartir(filas.index, cohorte.pacientes.get_indexer(filas.index))
+    if provisionales:
+        # Sin huella, las muestras con recomendaciones provisionales se recalculan en la próxima carga
+        filas = filas.drop(provisionales, errors="ignore")
+    return cohorte, {"archivo": archivo, "cabecera": cabecera, "filas": filas,
+                     "provisional": bool(provisionales)}, calculados
+
+
+def _cambiadas(conocidas, huellas_lote):
+    # Máscara de las muestras del lote cuya huella no coincide con la conocida (o no la tienen)
+    anteriores = conocidas.reindex(huellas_lote.index)
+    return ~((anteriores["h1"] == huellas_lote["h1"]) & (anteriores["h2"] == huellas_lote["h2"])).to_numpy()
+
+
+def _pacientes_con_avisos(cohorte):
+    # Pacientes con alguna recomendación marcada como caducada o pendiente de CPIC
+    codigos = [codigo for codigo, valor in enumerate(cohorte.resultados.valores)
+               if any(aviso in str(campo) for campo in valor for aviso in AVISOS_CPIC)]
+    if not codigos:
+        return []
+    marcados = np.zeros(len(cohorte.pacientes), dtype=bool)
+    for gen in cohorte.genes:
+        marcados |= np.isin(cohorte.codigos_resultado[gen], codigos)
+    return list(np.asarray(cohorte.pacientes)[marcados])
+
+
+def sumidero_jsonl(archivo):
+    """
+    Crea un sumidero que escribe una línea JSON por paciente.
+
+    Args:
+        archivo: Archivo de texto abierto para escritura.
+    """
+    def escribir(lote):
+        for paciente, genes in lote.items():
+            archivo.write(json.dumps({"paciente": paciente, "genes": genes}, ensure_ascii=False, default=str) + "\n")
+    return escribir
+
+
+def sumidero_csv(archivo):
+    """
+    Crea un sumidero que escribe una fila por paciente y gen (separador ';').
+
+    Args:
+        archivo: Archivo de texto abierto para escritura (con newline='').
+    """
+    escritor = csv.writer(archivo, delimiter=';')
+    escritor.writerow(["Paciente", "Gen", "Genotipo", "Score", "Fenotipo", "Recomendacion"])
+
+    def escribir(lote):
+        for paciente, genes in lote.items():
+            for gen, info in genes.items():
+                escritor.writerow([paciente, gen] + list(info[:3]) + [" ".join(str(r) for r in info[3:])])
+    return escribir
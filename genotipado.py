@@ -0,0 +1,297 @@
+"""
+Lectura vectorizada de la matriz de genotipos.
+
+La matriz tiene una fila por paciente y una columna por ensayo
+(``Sample/Assay;CYP2D6*3;CYP2D6*4;...``). Cada llamada se parte una sola vez
+por columna y se compara contra la tabla de variantes con operaciones de
+NumPy, en lugar de recorrer celda a celda.
+
+Las definiciones de las variantes se leen de ``tabla_variantes.json``: para
+añadir un gen o un alelo basta con editar ese archivo.
+"""
+import json
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from cache import memoizar
+from metricas import instrumentar
+
+
+RUTA_TABLA_VARIANTES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tabla_variantes.json")
+
+COLUMNA_MUESTRA = "Sample/Assay"
+INDETERMINADO = "UND"
+SILVESTRE = "*1"
+
+# Vocabulario de alelos (nucleótidos, inserciones, deleciones) compartido por todo el proceso
+_VOCABULARIO_ALELOS = {}
+_cerrojo_vocabulario = threading.Lock()
+
+
+def codigo_alelo(alelo):
+    """
+    Devuelve el código entero de un alelo, asignándole uno nuevo si no lo tenía.
+
+    Los análisis se ejecutan en varios hilos: la asignación de códigos nuevos se
+    hace con el cerrojo tomado para que dos alelos nunca compartan código.
+    """
+    codigo = _VOCABULARIO_ALELOS.get(alelo)
+    if codigo is None:
+        with _cerrojo_vocabulario:
+            codigo = _VOCABULARIO_ALELOS.setdefault(alelo, len(_VOCABULARIO_ALELOS))
+    return codigo
+
+
+@memoizar()
+def cargar_tabla_variantes(ruta=RUTA_TABLA_VARIANTES):
+    """
+    Carga la tabla con las variantes y sus mutaciones asociadas.
+
+    Args:
+        ruta (str): Archivo JSON con la forma {gen: {variante: [alelos alternativos]}}.
+
+    Returns:
+        dict: La tabla de variantes. Se comparte entre llamadas, no debe modificarse.
+    """
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+
+def separar_ensayo(columna):
+    """
+    Separa el nombre de un ensayo en gen, separador y variante.
+
+    Args:
+        columna (str): Nombre de la columna, p. ej. 'CYP2D6*10*4' o 'DPYD_HapB3'.
+
+    Returns:
+        tuple: (gen, separador, variante), p. ej. ('CYP2D6', '*', '10*4').
+    """
+    if "*" in columna:
+        separador = "*"
+    elif "_" in columna:
+        separador = "_"
+    else:
+        raise ValueError(f"El ensayo '{columna}' no tiene el formato GEN*variante o GEN_variante")
+    gen, variante = columna.split(separador, 1)
+    return gen, separador, variante
+
+
+class IndiceVariantes:
+    """
+    Definición compilada de los ensayos de una cabecera concreta.
+
+    Para cada columna guarda su gen, su alelo estrella y el conjunto de alelos
+    alternativos codificado como enteros, de modo que al procesar la matriz no
+    hay que volver a partir nombres de columna.
+    """
+    def __init__(self, ensayos, tabla):
+        self.ensayos = ensayos
+        self.definiciones = {}   # columna -> (gen, alelo estrella, códigos alternativos)
+        self.columnas = {}       # gen -> [columnas en orden de cabecera]
+        self.etiquetas = {}      # gen -> ['*1', alelo de la columna 0, alelo de la columna 1, ...]
+        for columna in ensayos:
+            gen, separador, variante = separar_ensayo(columna)
+            if gen not in tabla or variante not in tabla[gen]:
+                raise ValueError(f"Ensayo desconocido '{columna}': añádelo a tabla_variantes.json")
+            alternativos = np.array([codigo_alelo(alelo) for alelo in tabla[gen][variante]], dtype=np.int16)
+            alelo_estrella = f"{separador}{variante}"
+            self.definiciones[columna] = (gen, alelo_estrella, alternativos)
+            self.columnas.setdefault(gen, []).append(columna)
+            self.etiquetas.setdefault(gen, [SILVESTRE]).append(alelo_estrella)
+
+
+@memoizar()
+def indice_variantes(ensayos, ruta_tabla=RUTA_TABLA_VARIANTES):
+    """
+    Devuelve el índice de variantes para una cabecera, construyéndolo solo la primera vez.
+
+    Args:
+        ensayos (tuple): Nombres de las columnas de ensayo, en orden.
+        ruta_tabla (str): Archivo con la tabla de variantes.
+
+    Returns:
+        IndiceVariantes: El índice compilado.
+    """
+    return IndiceVariantes(ensayos, cargar_tabla_variantes(ruta_tabla))
+
+
+@lru_cache(maxsize=4096)
+def _codificar_llamada(llamada):
+    """
+    Convierte una llamada 'A/B' en el par de códigos (materno, paterno); 'UND' es (-1, -1).
+    """
+    if llamada == INDETERMINADO:
+        return -1, -1
+    materno, _, paterno = llamada.partition("/")
+    return codigo_alelo(materno), codigo_alelo(paterno)
+
+
+def _haplotipos_columna(llamadas, alternativos):
+    """
+    Marca, para una columna completa, qué haplotipos llevan el alelo alternativo.
+
+    Args:
+        llamadas (pandas.Series): Llamadas 'A/B' de un ensayo para todos los pacientes.
+        alternativos (numpy.ndarray): Códigos de los alelos que definen la variante.
+
+    Returns:
+        tuple: Dos arrays booleanos (materno, paterno).
+    """
+    # Cada columna tiene muy pocas llamadas distintas: se codifica solo cada valor único
+    codigos, unicos = pd.factorize(llamadas.astype(str))
+    pares = np.array([_codificar_llamada(llamada) for llamada in unicos], dtype=np.int16).reshape(-1, 2)
+    materno = np.isin(pares[:, 0], alternativos)
+    paterno = np.isin(pares[:, 1], alternativos)
+    return materno[codigos], paterno[codigos]
+
+
+def _detecciones_gen(df, indice, gen):
+    """
+    Marca qué variantes de un gen lleva cada haplotipo.
+
+    Returns:
+        tuple: Dos arrays booleanos (n, columnas del gen), materno y paterno.
+    """
+    columnas = indice.columnas[gen]
+    maternos = np.zeros((len(df), len(columnas)), dtype=bool)
+    paternos = np.zeros((len(df), len(columnas)), dtype=bool)
+    for k, columna in enumerate(columnas):
+        maternos[:, k], paternos[:, k] = _haplotipos_columna(df[columna], indice.definiciones[columna][2])
+    return maternos, paternos
+
+
+def _pares_unicos(codigos_maternos, codigos_paternos, base):
+    """
+    Codifica cada par (materno, paterno) como un entero y elimina los repetidos por fila.
+
+    Returns:
+        numpy.ndarray: Matriz ordenada por fila con -1 en las posiciones repetidas.
+    """
+    pares = np.sort(codigos_maternos * base + codigos_paternos, axis=1)
+    repetidos = np.zeros(pares.shape, dtype=bool)
+    repetidos[:, 1:] = pares[:, 1:] == pares[:, :-1]
+    pares[repetidos] = -1
+    return pares
+
+
+@instrumentar("parsear_matriz")
+def parsear_matriz(df, ruta_tabla=RUTA_TABLA_VARIANTES):
+    """
+    Convierte la matriz de genotipos en los haplotipos detectados por paciente y gen.
+
+    Args:
+        df (pandas.DataFrame): Matriz leída del CSV, con la columna 'Sample/Assay'.
+        ruta_tabla (str): Archivo con la tabla de variantes.
+
+    Returns:
+        dict: {paciente: {gen: [(alelo_materno, alelo_paterno), ...]}} sin pares repetidos.
+    """
+    pacientes = df[COLUMNA_MUESTRA].tolist()
+    indice = indice_variantes(tuple(c for c in df.columns if c != COLUMNA_MUESTRA), ruta_tabla)
+
+    dict_pacientes = {paciente: {} for paciente in pacientes}
+
+    for gen in indice.columnas:
+        # Código 0 = *1; código k = alelo de la columna k-1
+        etiquetas = indice.etiquetas[gen]
+        base = len(etiquetas)
+        maternos, paternos = _detecciones_gen(df, indice, gen)
+        columnas = np.arange(1, maternos.shape[1] + 1, dtype=np.int16)
+        codigos_maternos = np.where(maternos, columnas, 0).astype(np.int16)
+        codigos_paternos = np.where(paternos, columnas, 0).astype(np.int16)
+
+        pares = _pares_unicos(codigos_maternos, codigos_paternos, base)
+
+        # Las filas se repiten mucho: se decodifica una vez cada patrón distinto
+        decodificados = {}
+        for paciente, fila in zip(pacientes, pares):
+            clave = fila.tobytes()
+            haplotipos = decodificados.get(clave)
+            if haplotipos is None:
+                haplotipos = tuple((etiquetas[c // base], etiquetas[c % base]) for c in fila.tolist() if c >= 0)
+                decodificados[clave] = haplotipos
+            dict_pacientes[paciente][gen] = list(haplotipos)
+
+    return dict_pacientes
+
+
+def firmas_filas(df):
+    """
+    Agrupa los pacientes cuya fila de llamadas es idéntica en todos los ensayos.
+
+    Cada columna se factoriza a enteros y la fila se combina en una clave exacta
+    (sin colisiones posibles), así que dos pacientes comparten firma solo si
+    todas sus llamadas coinciden.
+
+    Args:
+        df (pandas.DataFrame): Matriz con la columna 'Sample/Assay'.
+
+    Returns:
+        tuple: (representantes, inversa): posición de la primera fila de cada firma
+        distinta y, para cada fila, el índice de su firma en ``representantes``.
+    """
+    ensayos = [c for c in df.columns if c != COLUMNA_MUESTRA]
+    codigos = np.zeros((len(df), len(ensayos)), dtype=np.int64)
+    cardinalidades = []
+    for k, columna in enumerate(ensayos):
+        valores, unicos = pd.factorize(df[columna])  # NaN -> -1
+        codigos[:, k] = valores + 1
+        cardinalidades.append(len(unicos) + 1)
+    if np.prod(np.array(cardinalidades, dtype=float)) < 2.0 ** 62:
+        # Base mixta: la clave identifica la fila de forma exacta
+        pesos = np.cumprod([1] + cardinalidades[:-1]).astype(np.int64)
+        inversa, _ = pd.factorize(codigos @ pesos)
+    else:
+        _, inversa = np.unique(codigos, axis=0, return_inverse=True)
+        inversa = inversa.reshape(-1)
+    representantes = np.zeros(inversa.max() + 1 if len(inversa) else 0, dtype=np.int64)
+    representantes[inversa[::-1]] = np.arange(len(inversa) - 1, -1, -1)  # la primera aparición gana
+    return representantes, inversa
+
+
+@instrumentar("mascaras_haplotipos", filas=lambda resultado: len(resultado[0]))
+def mascaras_haplotipos(df, ruta_tabla=RUTA_TABLA_VARIANTES):
+    """
+    Codifica los alelos detectados en cada haplotipo como una máscara de bits.
+
+    El bit k de la máscara de un gen indica que el haplotipo lleva el alelo de
+    la columna k de ese gen, es decir, ``etiquetas[k + 1]`` (la etiqueta 0 es *1).
+
+    Args:
+        df (pandas.DataFrame): Matriz leída del CSV, con la columna 'Sample/Assay'.
+        ruta_tabla (str): Archivo con la tabla de variantes.
+
+    Returns:
+        tuple: (pacientes, {gen: (máscara materna, máscara paterna, etiquetas)}) con
+        máscaras int64 de longitud n.
+    """
+    pacientes = df[COLUMNA_MUESTRA].tolist()
+    indice = indice_variantes(tuple(c for c in df.columns if c != COLUMNA_MUESTRA), ruta_tabla)
+    mascaras = {}
+    for gen in indice.columnas:
+        if len(indice.columnas[gen]) > 63:
+            raise ValueError(f"El gen {gen} tiene más de 63 ensayos y no cabe en una máscara de 64 bits")
+        maternos, paternos = _detecciones_gen(df, indice, gen)
+        bits = np.left_shift(np.int64(1), np.arange(maternos.shape[1], dtype=np.int64))
+        mascaras[gen] = (maternos @ bits, paternos @ bits, indice.etiquetas[gen])
+    return pacientes, mascaras
+
+
+@instrumentar("lectura_csv")
+def lectura_csv(path):
+    """
+    Lee el archivo CSV con los datos de cada paciente y obtiene sus haplotipos.
+
+    Args:
+        path (str o archivo): Ruta o archivo subido con la matriz de genotipos (separador ';').
+
+    Returns:
+        dict: {paciente: {gen: [(alelo_materno, alelo_paterno), ...]}}.
+    """
+    df = pd.read_csv(path, sep=';')
+    return parsear_matriz(df)
@@ -0,0 +1,330 @@
+"""
+Generación de los informes PDF de farmacogenética.
+
+Los informes de un lote se renderizan en un pool de procesos (fpdf es Python
+puro y ocupa la CPU), de modo que el tiempo total escala con los núcleos
+disponibles y el hilo de Streamlit solo recibe el progreso y los bytes.
+"""
+import io
+import multiprocessing
+import os
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from fpdf import FPDF
+
+from cache import memoizar
+from metricas import instrumentar
+
+
+# Datos por defecto de un paciente sin formulario rellenado
+DATOS_PACIENTE_VACIOS = {
+    'nombre': '',
+    'edad': '',
+    'sexo': '',
+    'id_paciente': '',
+    'medico': '',
+    'fecha_nacimiento': '',
+    'telefono': '',
+    'email': '',
+    'direccion': '',
+    'observaciones': ''
+}
+
+
+@memoizar()
+def recurso_imagen(ruta):
+    """
+    Decodifica una imagen una sola vez por proceso.
+
+    fpdf vuelve a leer y separar el canal alfa de cada PNG en cada documento
+    (unos 150 ms para HUBU.png). Aquí se hace una vez y los datos se
+    recomprimen al nivel máximo de zlib, lo que además reduce el PDF.
+
+    Returns:
+        dict: Información de la imagen en el formato interno de fpdf (sin índice 'i').
+    """
+    if ruta.lower().endswith((".jpg", ".jpeg")):
+        return FPDF()._parsejpg(ruta)
+    info = FPDF()._parsepng(ruta)
+    if info.get("f") == "FlateDecode":
+        info["data"] = zlib.compress(zlib.decompress(info["data"]), 9)
+        if "smask" in info:
+            info["smask"] = zlib.compress(zlib.decompress(info["smask"]), 9)
+    return info
+
+
+class PlantillaPDF(FPDF):
+    """
+    FPDF con recursos estáticos compartidos entre documentos.
+
+    - Las imágenes se toman de ``recurso_imagen``, decodificadas una vez por proceso.
+    - La cabecera y el pie de página se definen en ``cabecera()`` y ``pie()``. Se
+      dibujan una sola vez por disposición de página y estado gráfico, y en
+      las páginas y documentos siguientes se reutilizan las instrucciones ya
+      generadas, así que por paciente solo se maqueta el texto variable.
+    """
+    # Atributos de estado que la cabecera o el pie pueden modificar
+    _ESTADO = ("x", "y", "lasth", "font_family", "font_style", "underline", "font_size_pt", "font_size",
+               "unifontsubset", "color_flag", "text_color", "draw_color", "fill_color", "line_width", "ws")
+    _MAX_FRAGMENTOS = 256
+    _fragmentos = {}
+
+    def cabecera(self):
+        """Cabecera de cada página; se redefine en las subclases."""
+
+    def pie(self):
+        """Pie de cada página; se redefine en las subclases (puede usar page_no())."""
+
+    def header(self):
+        self._reproducir(self.cabecera, None)
+
+    def footer(self):
+        self._reproducir(self.pie, self.page_no())
+
+    def image(self, name, *args, **kwargs):
+        if name not in self.images:
+            self._registrar_imagen(name)
+        return super().image(name, *args, **kwargs)
+
+    def _registrar_imagen(self, name, indice=None):
+        info = dict(recurso_imagen(name))  # copia: fpdf anota en ella el número de objeto de cada documento
+        info["i"] = indice or len(self.images) + 1
+        self.images[name] = info
+        if "smask" in info and self.pdf_version < "1.4":
+            self.pdf_version = "1.4"
+
+    def _clave_estado(self, metodo, extra):
+        return (type(self), metodo.__name__, extra, self.w, self.h, self.k,
+                self.l_margin, self.t_margin, self.r_margin, self.b_margin, self.auto_page_break,
+                tuple(getattr(self, atributo, None) for atributo in self._ESTADO),
+                tuple((clave, fuente["i"]) for clave, fuente in self.fonts.items()),
+                tuple((nombre, info["i"]) for nombre, info in self.images.items()))
+
+    def _reproducir(self, metodo, extra):
+        clave = self._clave_estado(metodo, extra)
+        fragmento = self._fragmentos.get(clave)
+
+        if fragmento is None:
+            # Primera vez con este estado: se dibuja de verdad y se guarda lo generado
+            inicio = len(self.pages[self.page])
+            fuentes_antes, imagenes_antes = set(self.fonts), set(self.images)
+            metodo()
+            clave_fuente = next((k for k, f in self.fonts.items() if f is self.current_font), None)
+            fragmento = (self.pages[self.page][inicio:],
+                         {k: dict(f) for k, f in self.fonts.items() if k not in fuentes_antes},
+                         {n: i["i"] for n, i in self.images.items() if n not in imagenes_antes},
+                         {atributo: getattr(self, atributo, None) for atributo in self._ESTADO},
+                         clave_fuente)
+            if len(self._fragmentos) >= self._MAX_FRAGMENTOS:
+                self._fragmentos.clear()
+            self._fragmentos[clave] = fragmento
+            return
+
+        instrucciones, fuentes, imagenes, estado, clave_fuente = fragmento
+        self.pages[self.page] += instrucciones
+        for k, fuente in fuentes.items():
+            self.fonts[k] = dict(fuente)
+        for nombre, indice in imagenes.items():
+            self._registrar_imagen(nombre, indice)
+        for atributo, valor in estado.items():
+            setattr(self, atributo, valor)
+        if clave_fuente is not None:
+            self.current_font = self.fonts[clave_fuente]
+
+
+def create_pdf(paciente_data, datos_geneticos, paciente_codigo):
+    pdf = FPDF()
+    pdf.add_page()
+    
+    # Header
+    pdf.set_font('Arial', 'B', 16)
+    pdf.cell(0, 10, 'INFORME DE FARMACOGENÉTICA', 0, 1, 'C')
+    pdf.set_font('Arial', 'I', 10)
+    pdf.cell(0, 10, f'Fecha: {datetime.now().strftime("%d/%m/%Y")}', 0, 1, 'C')
+    pdf.ln(10)
+    
+    # Datos del paciente
+    pdf.set_font('Arial', 'B', 14)
+    pdf.cell(0, 10, 'DATOS DEL PACIENTE', 0, 1)
+    pdf.ln(5)
+    
+    pdf.set_font('Arial', '', 12)
+    info_lines = [
+        f"Nombre: {paciente_data.get('nombre', 'No especificado')}",
+        f"Edad: {paciente_data.get('edad', 'No especificado')}",
+        f"Sexo: {paciente_data.get('sexo', 'No especificado')}",
+        f"ID Paciente: {paciente_data.get('id_paciente', paciente_codigo)}",
+        f"Médico: {paciente_data.get('medico', 'No especificado')}",
+        f"Fecha de Nacimiento: {paciente_data.get('fecha_nacimiento', 'No especificada')}"
+    ]
+    
+    for line in info_lines:
+        pdf.cell(0, 8, line, 0, 1)
+    
+    pdf.ln(10)
+    
+    # Resultados genéticos
+    pdf.set_font('Arial', 'B', 14)
+    pdf.cell(0, 10, 'RESULTADOS GENÉTICOS', 0, 1)
+    pdf.ln(5)
+    
+    if datos_geneticos:
+        for gen, info in datos_geneticos.items():
+            pdf.set_font('Arial', 'B', 12)
+            pdf.cell(0, 8, f"Gen: {gen}", 0, 1)
+            
+            pdf.set_font('Arial', '', 10)
+            pdf.cell(0, 6, f"Genotipo: {info[0]}", 0, 1)
+            pdf.cell(0, 6, f"Score: {info[1]}", 0, 1)
+            pdf.cell(0, 6, f"Fenotipo: {info[2]}", 0, 1)
+            
+            # Recomendación clínica (puede ser larga, usar multi_cell)
+            pdf.set_font('Arial', 'B', 10)
+            pdf.cell(0, 6, "Recomendación clínica:", 0, 1)
+            pdf.set_font('Arial', '', 9)
+            
+            # Dividir texto largo en líneas
+            recomendacion = info[3] if len(info) > 3 else 'Sin recomendación disponible'
+            # Ajustar el ancho de línea para que quepa en la página
+            pdf.multi_cell(0, 5, recomendacion)
+            
+            pdf.ln(5)
+    else:
+        pdf.set_font('Arial', 'I', 12)
+        pdf.cell(0, 10, 'No hay datos genéticos disponibles', 0, 1)
+    
+    # Información adicional si existe
+    if paciente_data.get('observaciones'):
+        pdf.ln(5)
+        pdf.set_font('Arial', 'B', 12)
+        pdf.cell(0, 8, "Observaciones clínicas:", 0, 1)
+        pdf.set_font('Arial', '', 10)
+        pdf.multi_cell(0, 6, paciente_data.get('observaciones', ''))
+    
+    return pdf
+
+
+def nombre_archivo_informe(paciente, paciente_data):
+    """
+    Nombre del archivo PDF de un paciente: reporte_<nombre>_<AAAAMMDD>.pdf
+    """
+    nombre_paciente = paciente_data.get('nombre', paciente).replace(' ', '_')
+    return f"reporte_{nombre_paciente}_{datetime.now().strftime('%Y%m%d')}.pdf"
+
+
+@instrumentar("generar_informe", filas=lambda informe: 1)
+def generar_informe(paciente, paciente_data, datos_geneticos):
+    """
+    Renderiza el informe de un paciente.
+
+    Args:
+        paciente (str): Código del paciente.
+        paciente_data (dict): Datos del formulario del paciente.
+        datos_geneticos (dict): {gen: [genotipo, score, fenotipo, recomendacion]}.
+
+    Returns:
+        tuple: (paciente, nombre del archivo, bytes del PDF).
+    """
+    pdf = create_pdf(paciente_data, datos_geneticos, paciente)
+    return paciente, nombre_archivo_informe(paciente, paciente_data), pdf.output(dest='S').encode('latin1')
+
+
+def _generar_informe_seguro(trabajo):
+    paciente = trabajo[0]
+    try:
+        return generar_informe(*trabajo) + (None,)
+    except Exception as e:
+        return paciente, None, None, str(e)
+
+
+def _generar_bloque(trabajos):
+    # Cada proceso recibe un bloque de pacientes para repartir el coste de la comunicación
+    return [_generar_informe_seguro(trabajo) for trabajo in trabajos]
+
+
+# Por debajo de este número de informes se renderiza en el propio proceso
+UMBRAL_PARALELO = 64
+PACIENTES_POR_BLOQUE = 16
+
+_pool = None
+
+
+def _pool_procesos():
+    """
+    Pool de procesos reutilizado entre lotes (arrancar los procesos solo se paga una vez).
+
+    Se usa 'spawn' porque el servidor de Streamlit tiene varios hilos y
+    duplicarlo con fork no es seguro.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+@instrumentar("generar_informes_en_lote")
+def generar_informes_en_lote(trabajos, progreso=None):
+    """
+    Genera los informes de un lote de pacientes, en paralelo si el lote es grande.
+
+    Args:
+        trabajos (list): Tuplas (paciente, paciente_data, datos_geneticos).
+        progreso (callable): Opcional; se llama con (completados, total, último paciente) a medida que avanzan.
+
+    Returns:
+        dict: {paciente: (nombre del archivo, bytes del PDF, error)}, en el orden de los trabajos.
+              Si un informe falla, los bytes son None y error contiene el mensaje.
+    """
+    global _pool
+    trabajos = list(trabajos)
+    total = len(trabajos)
+    resultados = {}
+
+    def recoger(bloque):
+        for paciente, nombre, datos, error in bloque:
+            resultados[paciente] = (nombre, datos, error)
+        if progreso and bloque:
+            progreso(len(resultados), total, bloque[-1][0])
+
+    if total < UMBRAL_PARALELO or (os.cpu_count() or 1) == 1:
+        for inicio in range(0, total, PACIENTES_POR_BLOQUE):
+            recoger(_generar_bloque(trabajos[inicio:inicio + PACIENTES_POR_BLOQUE]))
+    else:
+        try:
+            pool = _pool_procesos()
+            futuros = [pool.submit(_generar_bloque, trabajos[inicio:inicio + PACIENTES_POR_BLOQUE])
+                       for inicio in range(0, total, PACIENTES_POR_BLOQUE)]
+            for futuro in as_completed(futuros):
+                recoger(futuro.result())
+        except BrokenProcessPool:
+            _pool = None  # el siguiente lote crea un pool nuevo
+            raise
+
+    return {trabajo[0]: resultados[trabajo[0]] for trabajo in trabajos}
+
+
+def empaquetar_zip(informes):
+    """
+    Empaqueta los informes generados en un único archivo ZIP.
+
+    Args:
+        informes (dict): {paciente: (nombre del archivo, bytes del PDF, error)}.
+
+    Returns:
+        bytes: Contenido del ZIP. Los nombres repetidos se distinguen con el código del paciente.
+    """
+    buffer = io.BytesIO()
+    usados = set()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archivo_zip:
+        for paciente, (nombre, datos, error) in informes.items():
+            if datos is None:
+                continue
+            if nombre in usados:
+                nombre = f"{paciente}_{nombre}"
+            usados.add(nombre)
+            archivo_zip.writestr(nombre, datos)
+    return buffer.getvalue()
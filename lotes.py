@@ -0,0 +1,251 @@
+"""
+Procesamiento por lotes sin navegador.
+
+Ejecuta el flujo completo genotipo -> fenotipo -> recomendación -> informe
+sobre uno o varios CSV de placa (o directorios con CSV), repartiendo los
+archivos entre varios procesos::
+
+    python lotes.py placas/ --salida resultados/ --formato csv --pdf
+
+Por cada archivo de entrada se crea ``<salida>/<nombre>.<formato>`` (y
+``<salida>/<nombre>_pdf/`` con un informe por paciente si se pide ``--pdf``).
+Al terminar se escribe ``<salida>/resumen.json`` con el resultado de cada archivo
+y, con ``--metricas``, los tiempos por etapa, la latencia HTTP y las cachés en el
+formato de texto de Prometheus (sumando los de todos los procesos).
+
+Códigos de salida: 0 si todos los archivos se procesaron, 1 si alguno falló,
+2 si no se encontró ningún archivo de entrada.
+
+Desde Python, ``procesar_archivo`` y ``procesar_archivos`` ofrecen lo mismo, y
+``flujo.analizar`` devuelve los resultados de un archivo en memoria.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from flujo import TAMANO_LOTE, procesar_en_flujo, sumidero_csv, sumidero_jsonl
+from metricas import REGISTRO, diferencia_caches, exportar_prometheus
+
+
+FORMATOS = ("json", "jsonl", "csv", "parquet")
+
+EXIT_OK = 0
+EXIT_FALLOS = 1
+EXIT_SIN_ENTRADAS = 2
+
+
+def _sumidero_json(archivo):
+    # Un único objeto {paciente: genes} escrito de forma incremental
+    archivo.write("{")
+    primero = [True]
+
+    def escribir(lote):
+        for paciente, genes in lote.items():
+            archivo.write(("\n" if primero[0] else ",\n") + json.dumps(str(paciente), ensure_ascii=False)
+                          + ": " + json.dumps(genes, ensure_ascii=False, default=str))
+            primero[0] = False
+
+    def cerrar():
+        archivo.write("\n}\n")
+    return escribir, cerrar
+
+
+def _sumidero_parquet(ruta):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("El formato parquet necesita pyarrow (pip install pyarrow)")
+    escritor = [None]
+
+    def escribir(lote):
+        filas = {"paciente": [], "gen": [], "genotipo": [], "score": [], "fenotipo": [], "recomendacion": []}
+        for paciente, genes in lote.items():
+            for gen, info in genes.items():
+                filas["paciente"].append(str(paciente))
+                filas["gen"].append(gen)
+                filas["genotipo"].append(str(info[0]))
+                filas["score"].append(str(info[1]))
+                filas["fenotipo"].append(str(info[2]))
+                filas["recomendacion"].append(" ".join(str(r) for r in info[3:]))
+        tabla = pa.table(filas)
+        if escritor[0] is None:
+            escritor[0] = pq.ParquetWriter(ruta, tabla.schema)
+        escritor[0].write_table(tabla)
+
+    def cerrar():
+        if escritor[0] is not None:
+            escritor[0].close()
+    return escribir, cerrar
+
+
+def abrir_sumidero(formato, ruta):
+    """
+    Abre el archivo de salida y devuelve (escribir, cerrar) para el formato pedido.
+    """
+    if formato == "parquet":
+        return _sumidero_parquet(ruta)
+    archivo = open(ruta, "w", encoding="utf-8", newline="" if formato == "csv" else None)
+    if formato == "json":
+        escribir, cerrar_json = _sumidero_json(archivo)
+
+        def cerrar():
+            cerrar_json()
+            archivo.close()
+        return escribir, cerrar
+    escribir = sumidero_csv(archivo) if formato == "csv" else sumidero_jsonl(archivo)
+    return escribir, archivo.close
+
+
+def _escritor_pdf(directorio):
+    from informes import DATOS_PACIENTE_VACIOS, generar_informe
+    os.makedirs(directorio, exist_ok=True)
+    errores = []
+
+    def escribir(lote):
+        for paciente, genes in lote.items():
+            try:
+                _, _, datos = generar_informe(paciente, dict(DATOS_PACIENTE_VACIOS, id_paciente=paciente), genes)
+                with open(os.path.join(directorio, f"{paciente}.pdf"), "wb") as archivo:
+                    archivo.write(datos)
+            except Exception as e:
+                errores.append(f"{paciente}: {e}")
+    return escribir, errores
+
+
+def procesar_archivo(ruta, salida, formato="csv", pdf=False, tamano_lote=TAMANO_LOTE, recomendar=True):
+    """
+    Procesa un CSV de placa completo y escribe sus resultados.
+
+    Args:
+        ruta (str): CSV con la matriz de genotipos.
+        salida (str): Directorio de salida.
+        formato (str): 'json', 'jsonl', 'csv' o 'parquet'.
+        pdf (bool): Si es True se genera además un informe PDF por paciente.
+        tamano_lote (int): Pacientes por lote (limita la memoria usada).
+        recomendar (bool): Si es False no se consultan recomendaciones a CPIC.
+
+    Returns:
+        dict: Resumen del archivo (pacientes, segundos, salida, errores de PDF y error si lo hubo).
+    """
+    inicio = time.perf_counter()
+    nombre = os.path.splitext(os.path.basename(ruta))[0]
+    destino = os.path.join(salida, f"{nombre}.{formato}")
+    resumen = {"archivo": ruta, "salida": destino, "pacientes": 0, "segundos": 0.0, "error": None}
+    try:
+        escribir, cerrar = abrir_sumidero(formato, destino)
+        try:
+            sumideros = [escribir]
+            if pdf:
+                escribir_pdf, errores_pdf = _escritor_pdf(os.path.join(salida, f"{nombre}_pdf"))
+                sumideros.append(escribir_pdf)
+            resumen["pacientes"] = procesar_en_flujo(ruta, lambda lote: [s(lote) for s in sumideros],
+                                                     tamano_lote, recomendar)
+        finally:
+            cerrar()
+        if pdf:
+            resumen["pdf_errores"] = errores_pdf
+    except Exception as e:
+        resumen["error"] = f"{type(e).__name__}: {e}"
+    resumen["segundos"] = round(time.perf_counter() - inicio, 3)
+    return resumen
+
+
+def _procesar_archivo_medido(ruta, salida, **opciones):
+    # En un proceso del pool: devuelve también sus métricas para sumarlas en el principal.
+    # El proceso puede reutilizarse y sus cachés no se vacían: de ellas se envía solo lo de esta tarea
+    REGISTRO.vaciar()
+    antes = REGISTRO.instantanea()["caches"]
+    resumen = procesar_archivo(ruta, salida, **opciones)
+    medidas = REGISTRO.instantanea()
+    medidas["caches"] = diferencia_caches(medidas["caches"], antes)
+    return resumen, medidas
+
+
+def buscar_entradas(rutas):
+    """
+    Expande directorios a los CSV que contienen; devuelve las rutas sin repetir y ordenadas.
+    """
+    archivos = set()
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            archivos.update(glob.glob(os.path.join(ruta, "*.csv")))
+        elif os.path.isfile(ruta):
+            archivos.add(ruta)
+    return sorted(archivos)
+
+
+def procesar_archivos(rutas, salida, procesos=None, **opciones):
+    """
+    Procesa varios archivos en paralelo, uno por proceso.
+
+    Args:
+        rutas (list): CSV a procesar.
+        salida (str): Directorio de salida.
+        procesos (int): Número de procesos (por defecto, uno por núcleo).
+        **opciones: Se pasan a procesar_archivo (formato, pdf, tamano_lote, recomendar).
+
+    Returns:
+        list: Resumen de cada archivo, en el orden de ``rutas``.
+    """
+    os.makedirs(salida, exist_ok=True)
+    procesos = min(procesos or os.cpu_count() or 1, len(rutas)) or 1
+    if procesos == 1:
+        return [procesar_archivo(ruta, salida, **opciones) for ruta in rutas]
+    resumenes = {}
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = {pool.submit(_procesar_archivo_medido, ruta, salida, **opciones): ruta for ruta in rutas}
+        for futuro in as_completed(futuros):
+            resumenes[futuros[futuro]], medidas = futuro.result()
+            REGISTRO.combinar(medidas)
+    return [resumenes[ruta] for ruta in rutas]
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Procesa placas de genotipado sin interfaz gráfica")
+    parser.add_argument("entradas", nargs="+", help="CSV de placa o directorios que los contienen")
+    parser.add_argument("--salida", "-o", default="resultados", help="Directorio de salida")
+    parser.add_argument("--formato", "-f", choices=FORMATOS, default="csv")
+    parser.add_argument("--pdf", action="store_true", help="Generar un informe PDF por paciente")
+    parser.add_argument("--procesos", "-p", type=int, help="Procesos en paralelo (por defecto, uno por núcleo)")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE, help="Pacientes por lote")
+    parser.add_argument("--sin-recomendaciones", action="store_true", help="No consultar CPIC")
+    parser.add_argument("--metricas", help="Archivo donde exportar las métricas en formato Prometheus")
+    args = parser.parse_args(argumentos)
+
+    rutas = buscar_entradas(args.entradas)
+    if not rutas:
+        print("No se encontró ningún CSV de entrada", file=sys.stderr)
+        return EXIT_SIN_ENTRADAS
+
+    inicio = time.perf_counter()
+    resumenes = procesar_archivos(rutas, args.salida, args.procesos, formato=args.formato, pdf=args.pdf,
+                                  tamano_lote=args.lote, recomendar=not args.sin_recomendaciones)
+    fallidos = [r for r in resumenes if r["error"]]
+    resumen = {
+        "archivos": len(resumenes),
+        "correctos": len(resumenes) - len(fallidos),
+        "fallidos": len(fallidos),
+        "pacientes": sum(r["pacientes"] for r in resumenes),
+        "segundos": round(time.perf_counter() - inicio, 3),
+        "detalle": resumenes,
+    }
+    with open(os.path.join(args.salida, "resumen.json"), "w", encoding="utf-8") as archivo:
+        json.dump(resumen, archivo, ensure_ascii=False, indent=2)
+    if args.metricas:
+        with open(args.metricas, "w", encoding="utf-8") as archivo:
+            archivo.write(exportar_prometheus())
+
+    for r in resumenes:
+        estado = f"ERROR {r['error']}" if r["error"] else f"{r['pacientes']} pacientes"
+        print(f"{r['archivo']}: {estado} ({r['segundos']} s)")
+    print(f"{resumen['correctos']}/{resumen['archivos']} archivos, {resumen['pacientes']} pacientes en {resumen['segundos']} s")
+    return EXIT_FALLOS if fallidos else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""
+Instrumentación ligera del análisis: tiempos por etapa, contadores y latencia HTTP.
+
+Cada función del flujo se decora con ``instrumentar`` y acumula en el registro
+del proceso su número de llamadas, el tiempo de reloj (incluye el de las
+funciones que llama) y las filas procesadas. El cliente HTTP anota la latencia
+de cada petición en un histograma y las cachés registradas aportan sus aciertos
+y fallos.
+
+El registro se consulta desde la barra lateral de Streamlit (``panel_streamlit``)
+o se exporta en el formato de texto de Prometheus (``exportar_prometheus``) en
+los procesos sin interfaz.
+"""
+import bisect
+import threading
+import time
+from functools import wraps
+
+
+PREFIJO = "farmacogenetica"
+
+# Límites superiores (segundos) de los cubos del histograma de latencia HTTP
+CUBOS_LATENCIA = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Campos de las estadísticas de una caché que son valores actuales y no contadores:
+# no se suman entre procesos
+INDICADORES_CACHE = ("entradas",)
+
+
+class Registro:
+    """
+    Acumula las medidas de todo el proceso. Es seguro entre hilos.
+    """
+    def __init__(self, cubos=CUBOS_LATENCIA):
+        self.cubos = tuple(cubos)
+        self._cerrojo = threading.Lock()
+        self._caches = {}
+        self.vaciar()
+
+    def vaciar(self):
+        with self._cerrojo:
+            self._etapas = {}      # etapa -> {llamadas, segundos, maximo, filas, errores}
+            self._latencias = {}   # destino -> {cubos, suma, cuenta}
+            self._respuestas = {}  # (destino, código) -> número de respuestas
+            self._caches_externas = {}  # nombre -> estadísticas sumadas de otros procesos
+
+    def registrar_etapa(self, etapa, segundos, filas=0, error=False):
+        with self._cerrojo:
+            medida = self._etapas.setdefault(etapa, {"llamadas": 0, "segundos": 0.0, "maximo": 0.0,
+                                                     "filas": 0, "errores": 0})
+            medida["llamadas"] += 1
+            medida["segundos"] += segundos
+            medida["maximo"] = max(medida["maximo"], segundos)
+            medida["filas"] += filas
+            medida["errores"] += bool(error)
+
+    def registrar_peticion(self, destino, segundos, codigo):
+        """
+        Anota una petición HTTP: su latencia y el código de respuesta (o el tipo de error).
+        """
+        with self._cerrojo:
+            histograma = self._latencias.setdefault(destino, {"cubos": [0] * len(self.cubos), "suma": 0.0, "cuenta": 0})
+            indice = bisect.bisect_left(self.cubos, segundos)
+            if indice < len(self.cubos):
+                histograma["cubos"][indice] += 1
+            histograma["suma"] += segundos
+            histograma["cuenta"] += 1
+            self._respuestas[(destino, str(codigo))] = self._respuestas.get((destino, str(codigo)), 0) + 1
+
+    def registrar_cache(self, nombre, cache):
+        """
+        Incluye en las métricas una caché con método ``estadisticas()`` (p. ej. CacheTTL).
+        """
+        self._caches[nombre] = cache
+
+    def instantanea(self):
+        """
+        Returns:
+            dict: Copia de todas las medidas: etapas, latencias (cubos no acumulados),
+            respuestas HTTP y estadísticas de las cachés registradas.
+        """
+        with self._cerrojo:
+            instantanea = {
+                "etapas": {etapa: dict(medida) for etapa, medida in self._etapas.items()},
+                "latencias": {destino: {"cubos": list(h["cubos"]), "suma": h["suma"], "cuenta": h["cuenta"]}
+                              for destino, h in self._latencias.items()},
+                "respuestas": [[destino, codigo, n] for (destino, codigo), n in self._respuestas.items()],
+            }
+            externas = {nombre: dict(e) for nombre, e in self._caches_externas.items()}
+        instantanea["caches"] = externas
+        for nombre, cache in self._caches.items():
+            propias = cache.estadisticas()
+            instantanea["caches"][nombre] = {campo: propias[campo] + externas.get(nombre, {}).get(campo, 0)
+                                             for campo in propias}
+        return instantanea
+
+    def combinar(self, instantanea):
+        """
+        Suma al registro las medidas de otro proceso (una ``instantanea()`` suya).
+        """
+        with self._cerrojo:
+            for etapa, otra in instantanea["etapas"].items():
+                medida = self._etapas.setdefault(etapa, {"llamadas": 0, "segundos": 0.0, "maximo": 0.0,
+                                                         "filas": 0, "errores": 0})
+                for campo in ("llamadas", "segundos", "filas", "errores"):
+                    medida[campo] += otra[campo]
+                medida["maximo"] = max(medida["maximo"], otra["maximo"])
+            for destino, otro in instantanea["latencias"].items():
+                histograma = self._latencias.setdefault(destino, {"cubos": [0] * len(self.cubos), "suma": 0.0, "cuenta": 0})
+                histograma["cubos"] = [a + b for a, b in zip(histograma["cubos"], otro["cubos"])]
+                histograma["suma"] += otro["suma"]
+                histograma["cuenta"] += otro["cuenta"]
+            for destino, codigo, n in instantanea["respuestas"]:
+                self._respuestas[(destino, codigo)] = self._respuestas.get((destino, codigo), 0) + n
+            for nombre, otras in instantanea["caches"].items():
+                externas = self._caches_externas.setdefault(nombre, {})
+                for campo, valor in otras.items():
+                    if campo not in INDICADORES_CACHE:
+                        externas[campo] = externas.get(campo, 0) + valor
+
+
+def diferencia_caches(despues, antes):
+    """
+    Contadores de cada caché entre dos ``instantanea()["caches"]`` (sin los indicadores).
+
+    Sirve para enviar a ``combinar`` solo lo contado durante una tarea en un proceso
+    que se reutiliza: las cachés no se vacían entre tareas.
+    """
+    return {nombre: {campo: valor - antes.get(nombre, {}).get(campo, 0)
+                     for campo, valor in estadisticas.items() if campo not in INDICADORES_CACHE}
+            for nombre, estadisticas in despues.items()}
+
+
+REGISTRO = Registro()
+
+
+def instrumentar(etapa, filas=len, registro=None):
+    """
+    Decorador que mide el tiempo, las llamadas y las filas de una función del flujo.
+
+    Args:
+        etapa (str): Nombre de la etapa en las métricas.
+        filas (callable): Cuenta las filas procesadas a partir del resultado (None = no contar).
+        registro (Registro): Registro donde se anota (por defecto, REGISTRO).
+    """
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            destino = registro or REGISTRO
+            inicio = time.perf_counter()
+            try:
+                resultado = funcion(*args, **kwargs)
+            except Exception:
+                destino.registrar_etapa(etapa, time.perf_counter() - inicio, error=True)
+                raise
+            try:
+                n = filas(resultado) if filas else 0
+            except TypeError:
+                n = 0
+            destino.registrar_etapa(etapa, time.perf_counter() - inicio, n)
+            return resultado
+        return envoltura
+    return decorador
+
+
+def _etiquetas(**valores):
+    # Los valores de las etiquetas escapan '\\', '"' y los saltos de línea
+    escapados = (str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for valor in valores.values())
+    return "{" + ",".join(f'{clave}="{valor}"' for clave, valor in zip(valores, escapados)) + "}"
+
+
+def exportar_prometheus(registro=None):
+    """
+    Devuelve las métricas en el formato de texto de exposición de Prometheus.
+    """
+    registro = registro or REGISTRO
+    datos = registro.instantanea()
+    lineas = []
+
+    def metrica(nombre, tipo, ayuda, muestras):
+        lineas.append(f"# HELP {PREFIJO}_{nombre} {ayuda}")
+        lineas.append(f"# TYPE {PREFIJO}_{nombre} {tipo}")
+        for sufijo, etiquetas, valor in muestras:
+            lineas.append(f"{PREFIJO}_{nombre}{sufijo}{etiquetas} {valor}")
+
+    etapas = sorted(datos["etapas"].items())
+    metrica("etapa_segundos", "summary", "Tiempo de reloj acumulado por etapa del análisis.",
+            [m for etapa, medida in etapas for m in (("_sum", _etiquetas(etapa=etapa), medida["segundos"]),
+                                                     ("_count", _etiquetas(etapa=etapa), medida["llamadas"]))])
+    metrica("etapa_segundos_max", "gauge", "Llamada más lenta de cada etapa.",
+            [("", _etiquetas(etapa=etapa), medida["maximo"]) for etapa, medida in etapas])
+    metrica("etapa_filas_total", "counter", "Filas (pacientes, informes...) procesadas por etapa.",
+            [("", _etiquetas(etapa=etapa), medida["filas"]) for etapa, medida in etapas])
+    metrica("etapa_errores_total", "counter", "Llamadas de cada etapa que terminaron con excepción.",
+            [("", _etiquetas(etapa=etapa), medida["errores"]) for etapa, medida in etapas])
+
+    muestras = []
+    for destino, histograma in sorted(datos["latencias"].items()):
+        acumulado = 0
+        for limite, n in zip(registro.cubos, histograma["cubos"]):
+            acumulado += n
+            muestras.append(("_bucket", _etiquetas(destino=destino, le=f"{limite:g}"), acumulado))
+        muestras.append(("_bucket", _etiquetas(destino=destino, le="+Inf"), histograma["cuenta"]))
+        muestras.append(("_sum", _etiquetas(destino=destino), histograma["suma"]))
+        muestras.append(("_count", _etiquetas(destino=destino), histograma["cuenta"]))
+    metrica("http_peticion_segundos", "histogram", "Latencia de las peticiones HTTP a APIs externas.", muestras)
+    metrica("http_respuestas_total", "counter", "Respuestas HTTP por destino y código (o tipo de error).",
+            [("", _etiquetas(destino=destino, codigo=codigo), n) for destino, codigo, n in sorted(datos["respuestas"])])
+
+    caches = sorted(datos["caches"].items())
+    metrica("cache_aciertos_total", "counter", "Consultas servidas desde caché.",
+            [("", _etiquetas(cache=nombre), e["aciertos"]) for nombre, e in caches])
+    metrica("cache_fallos_total", "counter", "Consultas que no estaban en caché.",
+            [("", _etiquetas(cache=nombre), e["fallos"]) for nombre, e in caches])
+    metrica("cache_esperas_total", "counter", "Fallos servidos esperando el cálculo en curso de otra sesión.",
+            [("", _etiquetas(cache=nombre), e.get("esperas", 0)) for nombre, e in caches])
+    metrica("cache_expulsiones_total", "counter", "Entradas expulsadas por los límites de tamaño.",
+            [("", _etiquetas(cache=nombre), e.get("expulsiones", 0)) for nombre, e in caches])
+    metrica("cache_caducadas_total", "counter", "Valores caducados servidos porque no se pudo actualizar a tiempo.",
+            [("", _etiquetas(cache=nombre), e.get("caducadas", 0)) for nombre, e in caches])
+    metrica("cache_entradas", "gauge", "Entradas guardadas en cada caché.",
+            [("", _etiquetas(cache=nombre), e["entradas"]) for nombre, e in caches if "entradas" in e])
+    return "\n".join(lineas) + "\n"
+
+
+def percentil_latencia(histograma, cubos, fraccion):
+    """
+    Estima un percentil a partir de los cubos del histograma (devuelve el límite del cubo).
+    """
+    objetivo = fraccion * histograma["cuenta"]
+    acumulado = 0
+    for limite, n in zip(cubos, histograma["cubos"]):
+        acumulado += n
+        if acumulado >= objetivo:
+            return limite
+    return float("inf")
+
+
+def panel_streamlit(registro=None):
+    """
+    Muestra las métricas en el contenedor activo de Streamlit (p. ej. ``with st.sidebar:``).
+    """
+    import streamlit as st
+
+    registro = registro or REGISTRO
+    datos = registro.instantanea()
+    with st.expander("⏱️ Rendimiento"):
+        if datos["etapas"]:
+            # Tabla en markdown: el panel se pinta en cada pasada y st.dataframe obligaría a importar pandas
+            filas = ["| Etapa | Llamadas | Total (s) | Media (ms) | Filas |", "|:--|--:|--:|--:|--:|"]
+            filas += [f"| {etapa} | {m['llamadas']} | {m['segundos']:.3f} | {m['segundos'] / m['llamadas'] * 1000:.1f} "
+                      f"| {m['filas']} |"
+                      for etapa, m in sorted(datos["etapas"].items(), key=lambda e: -e[1]["segundos"])]
+            st.markdown("\n".join(filas))
+        else:
+            st.caption("Todavía no se ha medido ninguna etapa.")
+        for destino, histograma in sorted(datos["latencias"].items()):
+            if histograma["cuenta"]:
+                st.caption(f"HTTP {destino}: {histograma['cuenta']} peticiones, "
+                           f"media {histograma['suma'] / histograma['cuenta'] * 1000:.0f} ms, "
+                           f"p95 ≤ {percentil_latencia(histograma, registro.cubos, 0.95) * 1000:g} ms")
+        for nombre, estadisticas in sorted(datos["caches"].items()):
+            st.caption(f"Caché {nombre}: {estadisticas['aciertos']} aciertos, {estadisticas['fallos']} fallos "
+                       f"({estadisticas.get('esperas', 0)} esperando a otra sesión), {estadisticas.get('entradas', 0)} entradas")
+        st.download_button("Descargar métricas (Prometheus)", exportar_prometheus(registro),
+                           file_name="metricas.prom", mime="text/plain", key="descargar_metricas")
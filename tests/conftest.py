@@ -0,0 +1,84 @@
+"""
+Utilidades comunes de las pruebas: los módulos de la aplicación están en la raíz
+del repositorio y los datos de ejemplo en ``tests/datos``.
+"""
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+DIRECTORIO_PRUEBAS = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIO_DATOS = os.path.join(DIRECTORIO_PRUEBAS, "datos")
+sys.path.insert(0, os.path.dirname(DIRECTORIO_PRUEBAS))
+
+
+def _valores_in(argumento):
+    # '("a","b\"c")' -> ['a', 'b"c'] (inversa de cpic.filtro_in)
+    return [re.sub(r"\\(.)", r"\1", valor) for valor in re.findall(r'"((?:[^"\\]|\\.)*)"', argumento)]
+
+
+def _cumple(valor, filtro):
+    operador, _, argumento = filtro.partition(".")
+    if operador == "eq":
+        return str(valor) == argumento
+    if operador == "in":
+        return str(valor) in _valores_in(argumento)
+    if operador == "cs":
+        return json.loads(argumento).items() <= (valor or {}).items()
+    raise ValueError(f"Filtro no soportado: {filtro}")
+
+
+class _ManejadorVolcado(BaseHTTPRequestHandler):
+    """
+    Imita la API PostgREST de CPIC sobre un volcado {tabla: [filas]}: filtros eq., in. y cs.
+    y los ``select`` con tablas embebidas que usa ``cpic.ResolverRemoto``.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        tabla = url.path.rstrip("/").rsplit("/", 1)[-1]
+        parametros = {clave: valores[0] for clave, valores in parse_qs(url.query).items()}
+        seleccion = parametros.pop("select", None)
+        volcado = self.server.volcado
+        filas = [fila for fila in volcado.get(tabla, [])
+                 if all(_cumple(fila.get(columna), filtro) for columna, filtro in parametros.items())]
+        guias = {guia["id"]: guia for guia in volcado.get("guideline", [])}
+        farmacos = {farmaco["drugid"]: farmaco for farmaco in volcado.get("drug", [])}
+        if seleccion == "drug(name),guideline(name),*":
+            filas = [dict(fila, drug={"name": farmacos.get(fila["drugid"], {}).get("name")},
+                          guideline={"name": guias.get(fila.get("guidelineid"), {}).get("name")}) for fila in filas]
+        elif seleccion == "drugid,name,guideline_for_drug(*)":
+            filas = [{"drugid": fila["drugid"], "name": fila["name"],
+                      "guideline_for_drug": guias.get(fila.get("guidelineid"))} for fila in filas]
+        cuerpo = json.dumps(filas).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+@pytest.fixture(scope="session")
+def volcado_cpic():
+    with open(os.path.join(DIRECTORIO_DATOS, "cpic_volcado.json"), encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+
+@pytest.fixture(scope="session")
+def servidor_cpic(volcado_cpic):
+    """
+    URL base de un servidor HTTP local que sirve el volcado de ejemplo como la API de CPIC.
+    """
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _ManejadorVolcado)
+    servidor.volcado = volcado_cpic
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{servidor.server_address[1]}/v1/"
+    servidor.shutdown()
+    servidor.server_close()
@@ -0,0 +1,36 @@
+"""
+Lotes guardados en el almacén SQLite.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import DIRECTORIO_PRUEBAS
+import almacen
+import flujo
+
+RUTA_MATRIZ = os.path.join(os.path.dirname(DIRECTORIO_PRUEBAS), "Genotype Matrix.csv")
+
+
+@pytest.fixture
+def almacen_vacio(tmp_path):
+    return almacen.AlmacenResultados(str(tmp_path / "resultados.sqlite"))
+
+
+def test_lote_provisional_se_actualiza_con_la_misma_huella(almacen_vacio):
+    cohorte, huellas, _ = flujo.analizar_incremental(RUTA_MATRIZ, recomendar=False)
+    # Como si CPIC no hubiera respondido: muestras sin huella y lote provisional
+    provisionales = dict(huellas, filas=huellas["filas"].iloc[:0], provisional=True)
+    lote = almacen_vacio.guardar_lote("matriz.csv", cohorte, provisionales)
+    reabierto, huellas_reabiertas = almacen_vacio.cargar_lote(lote)
+    assert huellas_reabiertas["archivo"] == huellas["archivo"] and huellas_reabiertas["provisional"]
+    assert len(reabierto) == len(cohorte)
+
+    # La siguiente carga del mismo archivo recalcula y reemplaza el lote en lugar de añadir otro
+    cohorte, huellas, calculados = flujo.analizar_incremental(RUTA_MATRIZ, reabierto, huellas_reabiertas,
+                                                              recomendar=False)
+    assert calculados == len(cohorte) and not huellas["provisional"]
+    assert almacen_vacio.guardar_lote("matriz.csv", cohorte, huellas) == lote
+    assert [(l["id"], l["provisional"]) for l in almacen_vacio.lotes()] == [(lote, 0)]
+    assert len(almacen_vacio.cargar_lote(lote)[1]["filas"]) == len(cohorte)
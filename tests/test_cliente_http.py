@@ -0,0 +1,45 @@
+"""
+Respuestas de error del cliente HTTP compartido.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import cliente_http
+
+
+class _ManejadorError(BaseHTTPRequestHandler):
+    # /json: PharmGKB sin resultados (404 con su 'status'); cualquier otra ruta: 404 sin cuerpo JSON
+    def do_GET(self):
+        cuerpo = json.dumps({"status": "fail", "data": []}).encode() if self.path == "/json" else b"Not Found"
+        self.send_response(404)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+@pytest.fixture
+def url_servidor():
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _ManejadorError)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{servidor.server_address[1]}"
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def test_error_http_lanza_httperror(url_servidor):
+    with pytest.raises(requests.HTTPError):
+        cliente_http.ClienteHTTP(reintentos=0).get_json(url_servidor + "/json")
+
+
+def test_aceptar_error_devuelve_el_cuerpo_json(url_servidor):
+    cliente = cliente_http.ClienteHTTP(reintentos=0)
+    assert cliente.get_json(url_servidor + "/json", aceptar_error=True) == {"status": "fail", "data": []}
+    with pytest.raises(requests.HTTPError):
+        cliente.get_json(url_servidor + "/texto", aceptar_error=True)
@@ -0,0 +1,31 @@
+"""
+Tablas internadas y cohortes compactas.
+"""
+import sys
+import threading
+
+from cohorte import Internado
+
+
+def test_internado_asigna_codigos_unicos_desde_varios_hilos():
+    # Cambios de hilo muy frecuentes para que las asignaciones se crucen
+    intervalo = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for _ in range(20):
+            tabla = Internado()
+            barrera = threading.Barrier(4)
+
+            def internar():
+                barrera.wait()
+                for valor in range(300):
+                    tabla.codigo(valor)
+            hilos = [threading.Thread(target=internar) for _ in range(4)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            assert len(tabla) == 300
+            assert all(tabla[tabla.codigo(valor)] == valor for valor in range(300))
+    finally:
+        sys.setswitchinterval(intervalo)
@@ -0,0 +1,191 @@
+"""
+ResolverLocal (copia en SQLite importada de un volcado) y ResolverRemoto (API)
+deben devolver las mismas filas con la misma forma JSON.
+"""
+import json
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import cliente_http
+import cpic
+
+
+def _normalizar(respuesta):
+    # El orden de las filas no está garantizado: se comparan ordenadas
+    if isinstance(respuesta, dict):
+        return {clave: _normalizar(valor) for clave, valor in respuesta.items()}
+    return sorted(respuesta, key=lambda fila: json.dumps(fila, sort_keys=True))
+
+
+@pytest.fixture
+def local(tmp_path, volcado_cpic):
+    resolver = cpic.ResolverLocal(str(tmp_path / "cpic.sqlite"))
+    resolver.importar(volcado_cpic)
+    return resolver
+
+
+@pytest.fixture
+def remoto(servidor_cpic):
+    return cpic.ResolverRemoto(servidor_cpic)
+
+
+def test_importar_cuenta_filas_por_tabla(tmp_path, volcado_cpic):
+    resolver = cpic.ResolverLocal(str(tmp_path / "cpic.sqlite"))
+    assert resolver.importar(volcado_cpic) == {tabla: len(filas) for tabla, filas in volcado_cpic.items()}
+    # Importar de nuevo reemplaza las tablas en lugar de duplicar filas
+    resolver.importar(volcado_cpic)
+    assert len(resolver.alelos("CYP2D6")) == 2
+
+
+CONSULTAS = [
+    ("alelos", ("CYP2D6",)),
+    ("farmacos", ("codeine",)),
+    ("farmacos_con_guia", ("codeine",)),
+    ("farmacos_con_guia", ("sin guia",)),
+    ("farmacos_con_guia", ("no existe",)),
+    ("diplotipos", ("CYP2D6", "*1/*4")),
+    ("diplotipos", ("CYP2D6", "*2/*2")),
+    ("recomendaciones", ("RxNorm:2670", "CYP2D6", "1.0")),
+    ("recomendaciones", ("RxNorm:4492", "DPYD", "1.0")),
+    ("recomendaciones", ("RxNorm:2670", "CYP2D6", "2.0")),
+    ("diplotipos_en_lote", ([("CYP2D6", "*1/*4"), ("CYP2D6", "*4/*4"), ("DPYD", "*1/*2A"), ("DPYD", "*4/*4")],)),
+    ("diplotipos_en_lote", ([],)),
+    ("farmacos_con_guia_en_lote", (["codeine", "fluorouracil", "no existe"],)),
+    ("recomendaciones_de_farmacos", (["RxNorm:2670", "RxNorm:4492"],)),
+    ("recomendaciones_de_farmacos", ([],)),
+]
+
+
+@pytest.mark.parametrize("metodo, argumentos", CONSULTAS)
+def test_local_y_remoto_devuelven_lo_mismo(local, remoto, metodo, argumentos):
+    assert _normalizar(getattr(local, metodo)(*argumentos)) == _normalizar(getattr(remoto, metodo)(*argumentos))
+
+
+def test_forma_de_las_respuestas(local):
+    recomendacion, = local.recomendaciones("RxNorm:2670", "CYP2D6", "0.0")
+    assert recomendacion["drug"] == {"name": "codeine"}
+    assert recomendacion["guideline"] == {"name": "CPIC Guideline for Codeine and CYP2D6"}
+    assert recomendacion["drugrecommendation"].startswith("Avoid codeine")
+
+    farmaco, = local.farmacos_con_guia("fluorouracil")
+    assert set(farmaco) == {"drugid", "name", "guideline_for_drug"}
+    assert farmaco["guideline_for_drug"]["id"] == 1
+    assert local.farmacos_con_guia("sin guia")[0]["guideline_for_drug"] is None
+
+    lote = local.diplotipos_en_lote([("CYP2D6", "*1/*4"), ("DPYD", "*4/*4")])
+    assert lote[("CYP2D6", "*1/*4")][0]["lookupkey"] == {"CYP2D6": "1.0"}
+    assert lote[("DPYD", "*4/*4")] == []
+    # Caracteres especiales (≥) intactos tras pasar por SQLite
+    assert "≥" in local.recomendaciones("RxNorm:4492", "DPYD", "1.0")[0]["drugrecommendation"]
+
+
+class _ResolverLento:
+    # Las consultas de recomendaciones no responden hasta que se libera el evento
+    def __init__(self):
+        self.liberar = threading.Event()
+        self.consultas = []
+
+    def recomendaciones(self, drugid, gen, valor):
+        self.consultas.append((drugid, gen, valor))
+        self.liberar.wait(10)
+        return [{"drugid": drugid, "gen": gen, "valor": valor}]
+
+
+@pytest.fixture
+def lento():
+    anterior = cpic.resolver()
+    resolver = _ResolverLento()
+    cpic.configurar_resolver(resolver)
+    yield resolver
+    resolver.liberar.set()
+    cpic.configurar_resolver(anterior)
+
+
+def _esperar_revalidaciones():
+    limite = time.monotonic() + 10
+    while cpic._revalidando and time.monotonic() < limite:
+        time.sleep(0.01)
+
+
+CLAVES = [("RxNorm:2670", "CYP2D6", "0.0"), ("RxNorm:2670", "CYP2D6", "1.0"), ("RxNorm:4492", "DPYD", "1.0")]
+
+
+def test_claves_en_revalidacion_no_se_vuelven_a_consultar(lento):
+    for _ in range(5):
+        caducadas = set()
+        respuestas = cpic.recomendaciones_en_lote(CLAVES, plazo=0.05, caducadas=caducadas)
+        assert caducadas == set(CLAVES)
+        assert all(filas == [] for filas in respuestas.values())
+    lento.liberar.set()
+    _esperar_revalidaciones()
+    assert sorted(lento.consultas) == sorted(CLAVES)
+    # Las respuestas que llegaron tarde se sirven desde la caché
+    caducadas = set()
+    respuestas = cpic.recomendaciones_en_lote(CLAVES, plazo=0.05, caducadas=caducadas)
+    assert not caducadas and respuestas[CLAVES[0]][0]["valor"] == "0.0"
+    assert len(lento.consultas) == len(CLAVES)
+
+
+def test_revalidaciones_limitadas(lento, monkeypatch):
+    monkeypatch.setattr(cpic, "MAX_REVALIDANDO", 1)
+    caducadas = set()
+    cpic.recomendaciones_en_lote(CLAVES, plazo=0.05, caducadas=caducadas)
+    assert caducadas == set(CLAVES) and len(cpic._revalidando) == 1
+    lento.liberar.set()
+    _esperar_revalidaciones()
+    assert len(lento.consultas) == 1
+
+
+class _ManejadorCaido(BaseHTTPRequestHandler):
+    # CPIC con errores: 500 o conexión cerrada sin respuesta, según el servidor
+    def do_GET(self):
+        if self.server.modo == "500":
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self.close_connection = True
+
+    def log_message(self, formato, *args):
+        pass
+
+
+class _ResolverRoto:
+    def recomendaciones(self, drugid, gen, valor):
+        raise sqlite3.OperationalError("no such table: recommendation")
+
+
+@pytest.fixture(params=["500", "cerrada", "sqlite"])
+def cpic_caido(request, monkeypatch):
+    # Sin reintentos para que el error llegue enseguida
+    monkeypatch.setattr(cliente_http, "_cliente", cliente_http.ClienteHTTP(reintentos=0))
+    anterior = cpic.resolver()
+    servidor = None
+    if request.param == "sqlite":
+        cpic.configurar_resolver(_ResolverRoto())
+    else:
+        servidor = ThreadingHTTPServer(("127.0.0.1", 0), _ManejadorCaido)
+        servidor.modo = request.param
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        cpic.configurar_resolver(cpic.ResolverRemoto(f"http://127.0.0.1:{servidor.server_address[1]}/v1/"))
+    yield
+    cpic.configurar_resolver(anterior)
+    if servidor is not None:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def test_errores_de_cpic_sirven_lo_ultimo_conocido(cpic_caido, monkeypatch):
+    conocida = [{"drugrecommendation": "Use label-recommended dosage"}]
+    cpic.CACHE_RECOMENDACIONES.guardar(CLAVES[0], conocida)
+    monkeypatch.setattr(cpic.CACHE_RECOMENDACIONES, "ttl", 0.001)
+    time.sleep(0.01)
+    caducadas = set()
+    respuestas = cpic.recomendaciones_en_lote(CLAVES, plazo=5, caducadas=caducadas)
+    assert caducadas == set(CLAVES)
+    assert respuestas == {CLAVES[0]: conocida, CLAVES[1]: [], CLAVES[2]: []}
+    _esperar_revalidaciones()
@@ -0,0 +1,108 @@
+"""
+Resultados de referencia del genotipado y del fenotipo.
+
+Fijan las reglas de absorción (*10*4 + *10 -> *10; + *4 -> *4), la precedencia
+de *10, el renombrado de UGT1A1*80 a *28 y el tratamiento de 'UND', de modo que
+un cambio en resolver_diplotipos o fenotipos_en_lote no pueda alterar en
+silencio una llamada clínica.
+"""
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import DIRECTORIO_DATOS, DIRECTORIO_PRUEBAS
+import farmacogenetica
+import flujo
+import genotipado
+
+RUTA_MATRIZ = os.path.join(os.path.dirname(DIRECTORIO_PRUEBAS), "Genotype Matrix.csv")
+
+# Llamada homocigota de referencia de cada ensayo de la placa de ejemplo
+REFERENCIA = {
+    "CYP2D6*3": "T", "CYP2D6*4": "C", "CYP2D6*6": "A", "CYP2D6*7": "T", "CYP2D6*8": "C", "CYP2D6*9": "CTT",
+    "CYP2D6*10": "C", "CYP2D6*10*4": "G", "CYP2D6*12": "C", "CYP2D6*14": "C", "CYP2D6*15": "-",
+    "CYP2D6*17": "G", "CYP2D6*19": "AGTT", "CYP2D6*29": "C", "CYP2D6*41": "C", "CYP2D6*56B": "G",
+    "CYP2D6*59": "G", "DPYD*2A": "C", "DPYD*13": "A", "DPYD_HapB3": "C", "DPYD_D949V": "T", "UGT1A1*80": "C",
+}
+
+NORMAL = "Normal Metabolizer"
+INTERMEDIO = "Intermediate Metabolizer"
+LENTO = "Poor Metabolizer"
+
+# (llamadas distintas de la referencia, gen, [genotipo, score, fenotipo] esperado).
+# En 'A/B' la primera llamada es la del haplotipo materno.
+CASOS = {
+    "referencia": ({}, "CYP2D6", ["*1/*1", "2.0", NORMAL]),
+    "todo_und": ({ensayo: "UND" for ensayo in REFERENCIA}, "CYP2D6", ["*1/*1", "2.0", NORMAL]),
+    "und_dpyd": ({"DPYD*2A": "UND", "DPYD_HapB3": "UND"}, "DPYD", ["*1/*1", 2.0, NORMAL]),
+    "4_heterocigoto": ({"CYP2D6*4": "C/T"}, "CYP2D6", ["*1/*4", "1.0", INTERMEDIO]),
+    "4_con_variantes_de_10": ({"CYP2D6*4": "C/T", "CYP2D6*10": "C/G", "CYP2D6*10*4": "G/A"},
+                              "CYP2D6", ["*1/*4", "1.0", INTERMEDIO]),
+    "4_con_und_en_10_4": ({"CYP2D6*4": "C/T", "CYP2D6*10": "C/G", "CYP2D6*10*4": "UND"},
+                          "CYP2D6", ["*1/*4", "1.0", INTERMEDIO]),
+    "4_homocigoto": ({"CYP2D6*4": "T/T", "CYP2D6*10": "G/G", "CYP2D6*10*4": "A/A"},
+                     "CYP2D6", ["*4/*4", "0.0", LENTO]),
+    "10_homocigoto_absorbe_10_4": ({"CYP2D6*10": "G/G", "CYP2D6*10*4": "A/A"},
+                                   "CYP2D6", ["*10/*10", "0.5", INTERMEDIO]),
+    "10_heterocigoto": ({"CYP2D6*10": "C/G"}, "CYP2D6", ["*1/*10", "1.25", NORMAL]),
+    "4_y_10_en_trans": ({"CYP2D6*4": "T/C", "CYP2D6*10": "C/G", "CYP2D6*10*4": "G/A"},
+                        "CYP2D6", ["*4/*10", "0.25", INTERMEDIO]),
+    "41_materno_4_paterno": ({"CYP2D6*41": "T/C", "CYP2D6*4": "C/T"}, "CYP2D6", ["*41/*4", "0.25", INTERMEDIO]),
+    "ugt1a1_80_heterocigoto": ({"UGT1A1*80": "C/T"}, "UGT1A1", ["*1/*28", 1.0, INTERMEDIO]),
+    "ugt1a1_80_homocigoto": ({"UGT1A1*80": "T/T"}, "UGT1A1", ["*28/*28", 0.0, LENTO]),
+    "dpyd_2a": ({"DPYD*2A": "C/T"}, "DPYD", ["*1/*2A", 1.0, INTERMEDIO]),
+    "dpyd_hapb3": ({"DPYD_HapB3": "C/T"}, "DPYD", ["*1/_HapB3", 1.0, INTERMEDIO]),
+    "dpyd_2a_y_hapb3": ({"DPYD*2A": "T/C", "DPYD_HapB3": "C/T"}, "DPYD", ["*2A/_HapB3", 0.0, LENTO]),
+}
+
+
+def _matriz(casos):
+    filas = []
+    for nombre, (llamadas, _, _) in casos.items():
+        fila = {"Sample/Assay": nombre}
+        fila.update({ensayo: f"{alelo}/{alelo}" for ensayo, alelo in REFERENCIA.items()})
+        fila.update(llamadas)
+        filas.append(fila)
+    return pd.DataFrame(filas)
+
+
+@pytest.fixture(scope="module")
+def casos_analizados():
+    return flujo.analizar_lote(_matriz(CASOS), recomendar=False)
+
+
+@pytest.mark.parametrize("nombre", list(CASOS))
+def test_casos_limite(casos_analizados, nombre):
+    _, gen, esperado = CASOS[nombre]
+    assert casos_analizados[nombre][gen] == esperado
+
+
+# Con *10*4 = UND la versión original deja {*4, *10} en un haplotipo y elige uno
+# según el orden del conjunto (varía con PYTHONHASHSEED): no sirve de referencia
+NO_DETERMINISTAS_POR_PACIENTE = {"4_con_und_en_10_4"}
+
+
+@pytest.mark.parametrize("nombre", [nombre for nombre in CASOS if nombre not in NO_DETERMINISTAS_POR_PACIENTE])
+def test_casos_limite_como_la_version_por_paciente(casos_analizados, nombre):
+    # En el resto cada haplotipo conserva un solo alelo, así que la versión
+    # original (que elegía uno arbitrario del conjunto) es determinista
+    df = _matriz({nombre: CASOS[nombre]})
+    original = farmacogenetica.fenotipo(farmacogenetica.formatear_genotipos(
+        farmacogenetica.determinar_genotipo_definitivo(genotipado.parsear_matriz(df))))
+    assert original[nombre] == casos_analizados[nombre]
+
+
+def test_matriz_de_ejemplo():
+    with open(os.path.join(DIRECTORIO_DATOS, "genotype_matrix_esperado.json"), encoding="utf-8") as archivo:
+        esperado = json.load(archivo)
+    cohorte = flujo.analizar_lote(pd.read_csv(RUTA_MATRIZ, sep=";"), recomendar=False)
+    assert {str(paciente): genes for paciente, genes in cohorte.items()} == esperado
+
+
+def test_el_resultado_no_depende_del_orden_de_las_filas():
+    df = pd.read_csv(RUTA_MATRIZ, sep=";")
+    directo = dict(flujo.analizar_lote(df, recomendar=False).items())
+    invertido = dict(flujo.analizar_lote(df.iloc[::-1].reset_index(drop=True), recomendar=False).items())
+    assert invertido == directo
@@ -0,0 +1,72 @@
+"""
+Análisis por lotes e incremental de la matriz de genotipos.
+"""
+import io
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import DIRECTORIO_PRUEBAS
+import flujo
+
+RUTA_MATRIZ = os.path.join(os.path.dirname(DIRECTORIO_PRUEBAS), "Genotype Matrix.csv")
+
+
+@pytest.fixture(scope="module")
+def matriz():
+    return pd.read_csv(RUTA_MATRIZ, sep=";")
+
+
+def _archivo(df):
+    return io.BytesIO(df.to_csv(sep=";", index=False).encode("utf-8"))
+
+
+def _con_repetida(matriz):
+    # La primera muestra vuelve a aparecer al final con las llamadas de la sexta
+    repetida = matriz.iloc[[0]].copy()
+    repetida.iloc[0, 1:] = matriz.iloc[5, 1:].to_numpy()
+    return pd.concat([matriz, repetida], ignore_index=True)
+
+
+def test_muestra_repetida_en_otro_lote_gana_la_ultima(matriz):
+    cohorte, huellas, _ = flujo.analizar_incremental(_archivo(_con_repetida(matriz)), tamano_lote=5, recomendar=False)
+    muestra = matriz.iloc[0, 0]
+    assert len(cohorte) == len(matriz)
+    assert huellas["filas"].index.is_unique and len(huellas["filas"]) == len(matriz)
+    esperado = flujo.analizar_lote(matriz.iloc[[5]], recomendar=False)[matriz.iloc[5, 0]]
+    assert cohorte[muestra] == esperado
+
+
+def test_muestra_repetida_se_compara_con_su_aparicion_anterior(matriz):
+    # En la carga previa la muestra ya tenía sus llamadas finales: la primera
+    # aparición en el archivo nuevo cambia y la última vuelve a coincidir
+    con_repetida = _con_repetida(matriz)
+    previo, huellas, _ = flujo.analizar_incremental(_archivo(con_repetida.iloc[1:]), recomendar=False)
+    cohorte, nuevas, _ = flujo.analizar_incremental(_archivo(con_repetida), previo, huellas, tamano_lote=5,
+                                                    recomendar=False)
+    directo, directas, _ = flujo.analizar_incremental(_archivo(con_repetida), tamano_lote=5, recomendar=False)
+    assert dict(cohorte.items()) == dict(directo.items())
+    assert nuevas["filas"].sort_index().equals(directas["filas"].sort_index())
+
+
+def test_carga_incremental_devuelve_solo_las_muestras_del_archivo(matriz):
+    placa_a, placa_b = matriz.iloc[:12], matriz.iloc[12:]
+    previo, huellas, _ = flujo.analizar_incremental(_archivo(placa_a), recomendar=False)
+    cohorte, nuevas, calculados = flujo.analizar_incremental(_archivo(placa_b), previo, huellas, recomendar=False)
+    assert calculados == len(placa_b)
+    assert list(cohorte.pacientes) == list(placa_b["Sample/Assay"])
+    assert list(nuevas["filas"].index) == list(placa_b["Sample/Assay"])
+    assert len(previo.actualizar(cohorte)) == len(matriz)
+
+
+def test_carga_incremental_copia_las_muestras_sin_cambios_en_su_orden(matriz):
+    placa = matriz.iloc[:12]
+    editada = placa.copy()
+    editada.iloc[3, 1:] = matriz.iloc[15, 1:].to_numpy()
+    previo, huellas, _ = flujo.analizar_incremental(_archivo(placa), recomendar=False)
+    cohorte, _, calculados = flujo.analizar_incremental(_archivo(editada), previo, huellas, tamano_lote=5,
+                                                         recomendar=False)
+    assert calculados == 1
+    assert list(cohorte.pacientes) == list(editada["Sample/Assay"])
+    assert dict(cohorte.items()) == dict(flujo.analizar_lote(editada, recomendar=False).items())
@@ -0,0 +1,26 @@
+"""
+Métricas de las etapas del análisis.
+"""
+import os
+
+import pandas as pd
+
+from conftest import DIRECTORIO_PRUEBAS
+import farmacogenetica
+import genotipado
+from metricas import REGISTRO
+
+RUTA_MATRIZ = os.path.join(os.path.dirname(DIRECTORIO_PRUEBAS), "Genotype Matrix.csv")
+
+
+def _filas(etapa):
+    return REGISTRO.instantanea()["etapas"].get(etapa, {}).get("filas", 0)
+
+
+def test_las_etapas_vectorizadas_cuentan_las_filas_de_la_matriz():
+    df = pd.read_csv(RUTA_MATRIZ, sep=";")
+    etapas = ("mascaras_haplotipos", "resolver_diplotipos", "fenotipos_en_lote")
+    antes = {etapa: _filas(etapa) for etapa in etapas}
+    _, mascaras = genotipado.mascaras_haplotipos(df)
+    farmacogenetica.fenotipos_en_lote(farmacogenetica.resolver_diplotipos(mascaras))
+    assert {etapa: _filas(etapa) - antes[etapa] for etapa in etapas} == {etapa: len(df) for etapa in etapas}
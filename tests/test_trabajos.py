@@ -0,0 +1,45 @@
+"""
+Trabajos en segundo plano: progreso, cancelación y espera.
+"""
+import threading
+
+import trabajos
+
+
+def test_cancelar_y_esperar():
+    empezado = threading.Event()
+
+    def sin_fin(trabajo):
+        empezado.set()
+        while True:
+            trabajo.avanzar("etapa")
+
+    trabajo = trabajos.lanzar(sin_fin, "prueba", ("etapa",))
+    assert empezado.wait(5)
+    assert not trabajo.esperar(0.05)
+    trabajo.cancelar()
+    assert trabajo.esperar(5)
+    assert trabajo.estado == trabajos.CANCELADO and not trabajo.activo
+
+
+def test_esperar_un_trabajo_terminado():
+    trabajo = trabajos.lanzar(lambda trabajo: 42, "prueba", ("etapa",))
+    assert trabajo.esperar(5)
+    assert trabajo.estado == trabajos.TERMINADO and trabajo.resultado == 42
+
+
+def test_cancelar_un_trabajo_en_cola_no_espera_turno():
+    liberar = threading.Event()
+
+    def bloqueado(trabajo):
+        liberar.wait(5)
+
+    ocupados = [trabajos.lanzar(bloqueado, "ocupa", ("etapa",)) for _ in range(trabajos.HILOS)]
+    try:
+        en_cola = trabajos.lanzar(lambda trabajo: 42, "en cola", ("etapa",))
+        en_cola.cancelar()
+        assert en_cola.esperar(0.5)
+        assert en_cola.estado == trabajos.CANCELADO and en_cola.resultado is None
+    finally:
+        liberar.set()
+    assert all(trabajo.esperar(5) for trabajo in ocupados)
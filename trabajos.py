@@ -0,0 +1,150 @@
+"""
+Trabajos en segundo plano con progreso por etapas y cancelación.
+
+Los análisis largos se ejecutan en un pool de hilos del proceso, fuera del
+hilo del script de Streamlit, así que la página sigue respondiendo y tocar un
+widget no reinicia el trabajo. Cada ``Trabajo`` lleva la cuenta de lo hecho en
+cada etapa; la función que lo ejecuta informa con ``avanzar`` y, si se ha
+pedido la cancelación, esa misma llamada lanza ``TrabajoCancelado``.
+
+El número de hilos se configura con la variable de entorno TRABAJOS_HILOS
+(por defecto 2).
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+HILOS = int(os.environ.get("TRABAJOS_HILOS", "2"))
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en curso"
+TERMINADO = "terminado"
+CANCELADO = "cancelado"
+ERROR = "error"
+
+
+class TrabajoCancelado(Exception):
+    """Se lanza dentro del trabajo cuando se ha pedido su cancelación."""
+
+
+class Trabajo:
+    """
+    Estado de un trabajo en segundo plano.
+
+    Args:
+        descripcion (str): Texto para la interfaz.
+        etapas (tuple): Nombres de las etapas, en orden.
+        total (int): Unidades (p. ej. pacientes) que debe completar cada etapa, si se conocen.
+    """
+    def __init__(self, descripcion, etapas, total=None):
+        self.id = uuid.uuid4().hex
+        self.descripcion = descripcion
+        self.etapas = tuple(etapas)
+        self.total = total
+        self.estado = PENDIENTE
+        self.resultado = None
+        self.error = None
+        self.inicio = None
+        self.fin = None
+        self._hechas = {etapa: 0 for etapa in self.etapas}
+        self._cancelar = threading.Event()
+        self._terminado = threading.Event()
+        self._cerrojo = threading.Lock()
+        self._futuro = None
+
+    def avanzar(self, etapa, unidades=1):
+        """
+        Suma unidades completadas a una etapa; lanza TrabajoCancelado si se pidió cancelar.
+        """
+        with self._cerrojo:
+            self._hechas[etapa] = self._hechas.get(etapa, 0) + unidades
+        if self._cancelar.is_set():
+            raise TrabajoCancelado(self.descripcion)
+
+    def cancelar(self):
+        """
+        Pide la cancelación; el trabajo se detiene en su siguiente llamada a ``avanzar``.
+
+        Si aún esperaba turno en el pool se retira de la cola y queda cancelado al momento.
+        """
+        self._cancelar.set()
+        if self._futuro is not None and self._futuro.cancel():
+            self.estado = CANCELADO
+            self.fin = time.monotonic()
+            self._terminado.set()
+
+    def esperar(self, timeout=None):
+        """
+        Espera a que el trabajo termine (bien, con error o cancelado).
+
+        Returns:
+            bool: False si se agotó ``timeout`` antes de que terminara.
+        """
+        return self._terminado.wait(timeout)
+
+    @property
+    def activo(self):
+        return self.estado in (PENDIENTE, EN_CURSO)
+
+    def progreso(self):
+        """
+        Returns:
+            list: Tuplas (etapa, unidades hechas, fracción entre 0 y 1 o None si no se conoce el total).
+        """
+        with self._cerrojo:
+            hechas = dict(self._hechas)
+        return [(etapa, hechas[etapa], min(1.0, hechas[etapa] / self.total) if self.total else None)
+                for etapa in self.etapas]
+
+    def segundos(self):
+        if self.inicio is None:
+            return 0.0
+        return (self.fin or time.monotonic()) - self.inicio
+
+    def _ejecutar(self, funcion):
+        self.estado = EN_CURSO
+        self.inicio = time.monotonic()
+        try:
+            self.resultado = funcion(self)
+            self.estado = TERMINADO
+        except TrabajoCancelado:
+            self.estado = CANCELADO
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.estado = ERROR
+        finally:
+            self.fin = time.monotonic()
+            self._terminado.set()
+
+
+_pool = None
+_cerrojo_pool = threading.Lock()
+
+
+def _pool_hilos():
+    global _pool
+    with _cerrojo_pool:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix="trabajo")
+        return _pool
+
+
+def lanzar(funcion, descripcion, etapas, total=None):
+    """
+    Ejecuta ``funcion(trabajo)`` en el pool y devuelve el Trabajo sin esperar a que termine.
+
+    Args:
+        funcion (callable): Recibe el Trabajo (para llamar a ``avanzar``) y devuelve el resultado.
+        descripcion (str): Texto para la interfaz.
+        etapas (tuple): Nombres de las etapas, en orden.
+        total (int): Unidades de cada etapa, si se conocen.
+
+    Returns:
+        Trabajo: Consultar ``estado``, ``progreso()``, ``resultado`` y ``error``.
+    """
+    trabajo = Trabajo(descripcion, etapas, total)
+    trabajo._futuro = _pool_hilos().submit(trabajo._ejecutar, funcion)
+    return trabajo